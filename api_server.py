@@ -1,7 +1,7 @@
 """
 API Backend para Examinator Web
 """
-from fastapi import FastAPI, UploadFile, File, HTTPException, Form
+from fastapi import FastAPI, UploadFile, File, HTTPException, Form, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse, StreamingResponse
 from pathlib import Path
@@ -10,15 +10,27 @@ import json
 import shutil
 from datetime import datetime
 import asyncio
+import time
 import uuid
-import requests
+import httpx
 
 from examinator import obtener_texto
-from generador_dos_pasos import GeneradorDosPasos, PreguntaExamen
-from generador_unificado import GeneradorUnificado
+from generador_dos_pasos import PreguntaExamen
+from registro_generadores import obtener_registro, N_CTX_POR_DEFECTO
+from generador_unificado import olvidar_digests_ollama
+from planificador import obtener_planificador, CHAT, EVALUACION, GENERACION, LIMITES_POR_DEFECTO
+from trabajos import obtener_gestor
+from prefijos_kv import registrar_prefijo
+from esquemas_json import obtener_estadisticas_parseo
+from escaner_json import primer_json
+from presupuesto_tokens import Presupuesto, TOKENS_POR_MENSAJE
+from duplicados import indice_examenes_previos
+from cache_llm import obtener_cache_respuestas, obtener_cache_evaluaciones, normalizar_texto
 from generador_examenes import guardar_examen
 from cursos_db import CursosDatabase
 from busqueda_web import buscar_y_resumir
+from cliente_ollama import (obtener_cliente, obtener_balanceador, cerrar_clientes, configurar_endpoints,
+                            ErrorOllama)
 
 app = FastAPI(title="Examinator API")
 
@@ -36,9 +48,10 @@ app.add_middleware(
 
 # Estado global
 config_path = Path("config.json")
-generador_actual = None
-generador_unificado = None  # GeneradorUnificado para GPU/CPU
-progreso_generacion = {}  # {session_id: {progreso, mensaje, completado}}
+generador_actual = None  # Generador activo (del registro de generadores residentes)
+tarea_calentamiento = None  # Precarga del modelo activo en segundo plano
+
+KEEP_ALIVE_POR_DEFECTO = "30m"  # Tiempo que Ollama mantiene el modelo en memoria (-1 = siempre)
 
 
 def cargar_config():
@@ -65,6 +78,88 @@ def guardar_config(config: dict):
         json.dump(config, f, ensure_ascii=False, indent=2)
 
 
+def _activar_generador(generador):
+    """Hace activo a generador; el anterior, si era otra instancia con un GGUF cargado,
+    se libera (su worker no queda vivo fuera del registro ni duplica el modelo)"""
+    global generador_actual
+    anterior, generador_actual = generador_actual, generador
+    if anterior is not None and anterior is not generador and getattr(anterior, 'llm', None) is not None:
+        print("🗑️ Liberando el modelo GGUF del generador anterior")
+        obtener_registro().liberar(anterior)
+    return generador
+
+
+async def generador_configurado(config: dict = None):
+    """Generador residente para la configuración guardada (se carga solo si cambió); queda
+    como generador activo"""
+    if config is None:
+        config = cargar_config()
+    ajustes = config.get("ajustes_avanzados", {})
+    generador = await asyncio.to_thread(
+        obtener_registro().obtener,
+        usar_ollama=config.get("usar_ollama", True),
+        modelo_ollama=config.get("modelo_ollama_activo", "llama31-local"),
+        modelo_path_gguf=config.get("modelo_path"),
+        n_gpu_layers=ajustes.get("n_gpu_layers", 35),
+        n_ctx=ajustes.get("n_ctx", N_CTX_POR_DEFECTO)
+    )
+    generador.keep_alive = config.get("ollama_keep_alive", KEEP_ALIVE_POR_DEFECTO)
+    generador.salida_estructurada = config.get("salida_estructurada", True)
+    generador.casos_en_dos_fases = config.get("casos_en_dos_fases", True)
+    generador.lecturas_compartidas = config.get("lecturas_compartidas", True)
+    return _activar_generador(generador)
+
+
+def programar_calentamiento():
+    """Precarga el modelo activo en segundo plano (arranque y cambios de modelo)"""
+    global tarea_calentamiento
+    if generador_actual is None or not hasattr(generador_actual, 'calentar'):
+        return
+    generador_actual.keep_alive = cargar_config().get("ollama_keep_alive", KEEP_ALIVE_POR_DEFECTO)
+    generador_actual.calentado = False
+    print(f"🔥 Precargando modelo en segundo plano...")
+    tarea_calentamiento = asyncio.create_task(asyncio.to_thread(generador_actual.calentar))
+
+
+def _motor_de(generador) -> str:
+    """Motor al que va la petición en el planificador"""
+    return 'ollama' if getattr(generador, 'usar_ollama', False) else 'gguf'
+
+
+def _cliente_de(request: Request) -> str:
+    """Identidad del cliente para el reparto equitativo entre colas"""
+    return request.client.host if request is not None and request.client else "anonimo"
+
+
+async def estado_calentamiento() -> dict:
+    """Estado caliente/frío del modelo activo
+    
+    En Ollama se consulta /api/ps: el modelo puede haberse descargado al vencer el keep_alive.
+    """
+    if generador_actual is None or not hasattr(generador_actual, 'calentar'):
+        return {"estado": "frio"}
+    
+    estado = {
+        "keep_alive": generador_actual.keep_alive,
+        "segundos_calentamiento": generador_actual.segundos_calentamiento
+    }
+    if tarea_calentamiento is not None and not tarea_calentamiento.done():
+        estado["estado"] = "calentando"
+    elif generador_actual.usar_ollama:
+        modelo = generador_actual.modelo_ollama
+        try:
+            cargados = await obtener_cliente().ps()
+        except Exception:
+            cargados = []
+        en_memoria = next((m for m in cargados if m.get('name') in (modelo, f"{modelo}:latest")), None)
+        estado["estado"] = "caliente" if en_memoria else "frio"
+        if en_memoria:
+            estado["expira"] = en_memoria.get("expires_at")
+    else:
+        estado["estado"] = "caliente" if generador_actual.llm is not None and generador_actual.calentado else "frio"
+    return estado
+
+
 def inicializar_modelo():
     """Carga automáticamente el modelo configurado al iniciar el servidor"""
     global generador_actual
@@ -81,12 +176,13 @@ def inicializar_modelo():
         # Intentar usar Ollama primero (GPU automática)
         if usar_ollama:
             try:
-                generador_actual = GeneradorUnificado(
+                _activar_generador(obtener_registro().obtener(
                     usar_ollama=True,
                     modelo_ollama=modelo_ollama,
                     modelo_path_gguf=modelo_path,
-                    n_gpu_layers=35
-                )
+                    n_gpu_layers=config.get("ajustes_avanzados", {}).get('n_gpu_layers', 35),
+                    n_ctx=config.get("ajustes_avanzados", {}).get('n_ctx', N_CTX_POR_DEFECTO)
+                ))
                 print(f"✅ Ollama cargado - Usando GPU automáticamente")
                 print(f"🎮 Modelo activo: {modelo_ollama}")
                 print(f"{'='*60}\n")
@@ -98,7 +194,9 @@ def inicializar_modelo():
                 if modelo_path and Path(modelo_path).exists():
                     ajustes = config.get("ajustes_avanzados", {})
                     gpu_layers = ajustes.get('n_gpu_layers', 35)
-                    generador_actual = GeneradorDosPasos(modelo_path=modelo_path, n_gpu_layers=gpu_layers)
+                    _activar_generador(obtener_registro().obtener_dos_pasos(modelo_path, n_gpu_layers=gpu_layers))
+                    generador_actual.salida_estructurada = config.get("salida_estructurada", True)
+                    generador_actual.pasos_en_paralelo = config.get("pasos_en_paralelo", False)
                     print(f"✅ Modelo GGUF cargado: {modelo_path}")
                     print(f"{'='*60}\n")
                 else:
@@ -109,11 +207,12 @@ def inicializar_modelo():
             if modelo_path and Path(modelo_path).exists():
                 ajustes = config.get("ajustes_avanzados", {})
                 gpu_layers = ajustes.get('n_gpu_layers', 0)
-                generador_actual = GeneradorUnificado(
+                _activar_generador(obtener_registro().obtener(
                     usar_ollama=False,
                     modelo_path_gguf=modelo_path,
-                    n_gpu_layers=gpu_layers
-                )
+                    n_gpu_layers=gpu_layers,
+                    n_ctx=ajustes.get('n_ctx', N_CTX_POR_DEFECTO)
+                ))
                 print(f"✅ Modelo GGUF cargado: {modelo_path}")
                 print(f"{'='*60}\n")
             else:
@@ -125,19 +224,18 @@ def inicializar_modelo():
 
 
 # Función para verificar y arrancar Ollama
-def verificar_y_arrancar_ollama():
+async def verificar_y_arrancar_ollama():
     """Verifica si Ollama está corriendo y lo arranca si no lo está"""
     import subprocess
     import platform
     
-    try:
-        # Verificar si Ollama responde
-        response = requests.get("http://localhost:11434/api/tags", timeout=2)
-        if response.status_code == 200:
-            print("✅ Ollama ya está corriendo")
-            return True
-    except:
-        print("⚠️ Ollama no está corriendo, iniciando...")
+    cliente = obtener_cliente()
+    
+    # Verificar si Ollama responde
+    if await cliente.disponible():
+        print("✅ Ollama ya está corriendo")
+        return True
+    print("⚠️ Ollama no está corriendo, iniciando...")
         
     try:
         # Arrancar Ollama en segundo plano
@@ -156,16 +254,11 @@ def verificar_y_arrancar_ollama():
             )
         
         # Esperar a que Ollama arranque
-        import time
         for i in range(10):
-            time.sleep(1)
-            try:
-                response = requests.get("http://localhost:11434/api/tags", timeout=1)
-                if response.status_code == 200:
-                    print("✅ Ollama iniciado correctamente")
-                    return True
-            except:
-                continue
+            await asyncio.sleep(1)
+            if await cliente.disponible(timeout=1):
+                print("✅ Ollama iniciado correctamente")
+                return True
         
         print("⚠️ Ollama no pudo iniciarse automáticamente")
         return False
@@ -183,16 +276,32 @@ async def startup_event():
     print("="*60)
     
     # Verificar y arrancar Ollama automáticamente
-    verificar_y_arrancar_ollama()
+    await verificar_y_arrancar_ollama()
+    
+    # Servidores Ollama y límites de concurrencia guardados para el planificador
+    config = cargar_config()
+    if config.get("ollama_endpoints"):
+        await _aplicar_endpoints_ollama(config["ollama_endpoints"], config)
+    for motor, limite in config.get("limites_concurrencia", {}).items():
+        obtener_planificador().configurar_limite(motor, limite)
     
-    # Inicializar modelo
+    # Inicializar modelo y precargarlo sin bloquear el arranque
     inicializar_modelo()
+    programar_calentamiento()
+    obtener_gestor().iniciar()
     
     print("="*60)
     print("✅ Servidor listo en http://localhost:8000")
     print("="*60 + "\n")
 
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Detiene los workers de trabajos y cierra los pools de conexiones con Ollama"""
+    await obtener_gestor().detener()
+    await cerrar_clientes()
+
+
 @app.get("/api/prompt-template")
 async def obtener_prompt_template():
     """Obtiene el template del prompt predeterminado"""
@@ -486,22 +595,12 @@ async def actualizar_config(config: dict):
     global generador_actual
     if config.get("modelo_path"):
         try:
-            # Liberar modelo anterior si existe
-            if generador_actual and generador_actual.llm:
-                print("🔄 Liberando modelo anterior...")
-                del generador_actual.llm
-                generador_actual.llm = None
-                del generador_actual
-                generador_actual = None
-                
-                # Forzar garbage collection
-                import gc
-                gc.collect()
-                print("✅ Modelo anterior liberado")
-            
-            # Cargar nuevo modelo
+            # Cargar nuevo modelo desde el registro: libera el GGUF residente anterior (un solo
+            # GGUF en memoria) y, al activarlo, el generador que estaba activo
             print(f"🔄 Cargando nuevo modelo: {config['modelo_path']}")
-            generador_actual = GeneradorDosPasos(modelo_path=config["modelo_path"])
+            _activar_generador(await asyncio.to_thread(obtener_registro().obtener_dos_pasos, config["modelo_path"]))
+            generador_actual.salida_estructurada = config.get("salida_estructurada", True)
+            generador_actual.pasos_en_paralelo = config.get("pasos_en_paralelo", False)
             print("✅ Nuevo modelo cargado exitosamente")
             return {"message": "Configuración actualizada y modelo cargado", "success": True}
         except Exception as e:
@@ -515,24 +614,23 @@ async def actualizar_config(config: dict):
 async def diagnostico_ollama():
     """Verifica el estado de Ollama y devuelve información de diagnóstico"""
     try:
-        response = requests.get("http://localhost:11434/api/tags", timeout=2)
-        if response.status_code == 200:
-            modelos = response.json()
-            return {
-                "estado": "ok",
-                "corriendo": True,
-                "mensaje": "Ollama está funcionando correctamente",
-                "modelos_disponibles": len(modelos.get("models", [])),
-                "puerto": 11434
-            }
-        else:
-            return {
-                "estado": "error",
-                "corriendo": False,
-                "mensaje": f"Ollama responde pero con error (código {response.status_code})",
-                "puerto": 11434
-            }
-    except requests.exceptions.ConnectionError:
+        modelos = await obtener_cliente().tags()
+        return {
+            "estado": "ok",
+            "corriendo": True,
+            "mensaje": "Ollama está funcionando correctamente",
+            "modelos_disponibles": len(modelos),
+            "puerto": 11434,
+            "nodos": obtener_balanceador().estado()["nodos"]
+        }
+    except ErrorOllama as e:
+        return {
+            "estado": "error",
+            "corriendo": False,
+            "mensaje": f"Ollama responde pero con error (código {e.status_code})",
+            "puerto": 11434
+        }
+    except httpx.ConnectError:
         return {
             "estado": "error",
             "corriendo": False,
@@ -553,19 +651,16 @@ async def reparar_ollama():
     """Intenta reparar Ollama arrancándolo automáticamente"""
     import subprocess
     import platform
-    import time
+    
+    cliente = obtener_cliente()
     
     # Primero verificar si ya está corriendo
-    try:
-        response = requests.get("http://localhost:11434/api/tags", timeout=2)
-        if response.status_code == 200:
-            return {
-                "success": True,
-                "mensaje": "✅ Ollama ya está funcionando correctamente",
-                "accion": "ninguna"
-            }
-    except:
-        pass
+    if await cliente.disponible():
+        return {
+            "success": True,
+            "mensaje": "✅ Ollama ya está funcionando correctamente",
+            "accion": "ninguna"
+        }
     
     # Intentar arrancar Ollama
     try:
@@ -587,19 +682,15 @@ async def reparar_ollama():
         
         # Esperar a que Ollama arranque (máximo 15 segundos)
         for i in range(15):
-            time.sleep(1)
-            try:
-                response = requests.get("http://localhost:11434/api/tags", timeout=1)
-                if response.status_code == 200:
-                    print("✅ Ollama reparado exitosamente")
-                    return {
-                        "success": True,
-                        "mensaje": "✅ Ollama iniciado correctamente. El chatbot ya está disponible.",
-                        "accion": "iniciado",
-                        "tiempo_arranque": f"{i+1} segundos"
-                    }
-            except:
-                continue
+            await asyncio.sleep(1)
+            if await cliente.disponible(timeout=1):
+                print("✅ Ollama reparado exitosamente")
+                return {
+                    "success": True,
+                    "mensaje": "✅ Ollama iniciado correctamente. El chatbot ya está disponible.",
+                    "accion": "iniciado",
+                    "tiempo_arranque": f"{i+1} segundos"
+                }
         
         # Si llegamos aquí, no arrancó
         return {
@@ -623,48 +714,167 @@ async def reparar_ollama():
         }
 
 
-@app.post("/api/chat")
-async def chat_con_modelo(data: dict):
-    """Endpoint para chatear con el modelo (soporta Ollama y GGUF con fallback automático)"""
-    global generador_actual
+async def _motor_chat() -> tuple:
+    """Decide el motor del chat (Ollama con fallback a GGUF)
     
-    mensaje = data.get("mensaje", "").strip()
-    if not mensaje:
-        raise HTTPException(status_code=400, detail="El mensaje no puede estar vacío")
-    
-    print(f"\n{'='*70}")
-    print(f"💬 CHAT REQUEST RECIBIDA")
-    print(f"{'='*70}")
-    print(f"📝 Mensaje: {mensaje[:100]}...")
-    
-    # Verificar si hay modelo cargado
+    Retorna (usar_ollama, mensaje_error). Si no hay motor utilizable,
+    mensaje_error contiene la respuesta para el usuario.
+    """
     if generador_actual is None:
         print("❌ generador_actual es None")
-        return {"respuesta": "❌ No hay modelo inicializado. Ve a Configuración para seleccionar uno."}
+        return False, "❌ No hay modelo inicializado. Ve a Configuración para seleccionar uno."
     
     print(f"✅ Generador actual existe")
     print(f"🔧 Tipo configurado: {'Ollama' if generador_actual.usar_ollama else 'GGUF'}")
     
     # Si está configurado para Ollama, intentar usarlo con fallback a GGUF
-    usar_ollama_exitoso = False
     if generador_actual.usar_ollama:
+        # Verificar si Ollama está disponible
+        if await obtener_cliente().disponible():
+            print("✅ Ollama disponible - usando Ollama")
+            return True, None
+        print(f"⚠️ Ollama no disponible - fallback a GGUF")
+    
+    # Si no usa Ollama o falló, verificar GGUF
+    if generador_actual.llm is None:
+        return False, "❌ Ollama no está disponible y no hay modelo GGUF cargado. Por favor:\n\n1. Inicia Ollama con: ollama serve\n2. O carga un modelo GGUF desde Configuración"
+    print(f"✅ LLM GGUF cargado correctamente - usando fallback")
+    return False, None
+
+
+# Parte del contexto libre (tras sistema, pregunta y salida) que puede ocupar el
+# documento o la búsqueda web; lo que no use queda para el historial
+FRACCION_CONTEXTO_DOCUMENTO = 0.7
+
+
+async def _presupuesto_chat(usar_ollama: bool, max_tokens: int) -> Presupuesto:
+    """Presupuesto de la ventana del motor del chat (el tokenizador se mide una vez por modelo)"""
+    contador = await asyncio.to_thread(generador_actual.contador_tokens, usar_ollama)
+    return Presupuesto(contador, max_tokens)
+
+
+def _historial_en_presupuesto(historial: list, presupuesto: Presupuesto) -> list:
+    """Mensajes previos más recientes que caben enteros en lo que queda de la ventana"""
+    previos = [m for m in historial if m.get('tipo') in ('usuario', 'asistente')]
+    incluidos = presupuesto.seleccionar_recientes(
+        'historial', [m.get('texto', '') for m in previos], extra_por_texto=TOKENS_POR_MENSAJE
+    )
+    return previos[len(previos) - incluidos:]
+
+
+def _contexto_en_presupuesto(contexto: str, plantilla: str, presupuesto: Presupuesto) -> str:
+    """Recorta el documento (o resultado web) a su parte de la ventana. La plantilla es el
+    mensaje del usuario sin el contexto"""
+    presupuesto.consumir('pregunta', plantilla, extra=TOKENS_POR_MENSAJE)
+    maximo = int(presupuesto.restante * FRACCION_CONTEXTO_DOCUMENTO)
+    return presupuesto.recortar('contexto', contexto, maximo=maximo)
+
+
+async def _construir_mensajes_chat(data: dict, mensaje: str, presupuesto: Presupuesto) -> tuple:
+    """Arma la lista de mensajes (system + historial + actual) para el chat
+    
+    Retorna (messages, respuesta_directa). respuesta_directa no es None cuando
+    no hace falta llamar al modelo (p. ej. la búsqueda web no encontró nada).
+    El documento y el historial se ajustan a la ventana del modelo según presupuesto.
+    """
+    # Preparar el contexto si existe
+    contexto = data.get("contexto", None)
+    buscar_web = data.get("buscar_web", False)
+    mensaje_completo = mensaje
+    system_prompt = "Eres un asistente educativo útil y respondes de manera clara y concisa en español."
+    
+    # Si se solicita búsqueda web
+    if buscar_web:
         try:
-            # Verificar si Ollama está disponible
-            import requests
-            response = requests.get("http://localhost:11434/api/tags", timeout=2)
-            if response.status_code == 200:
-                usar_ollama_exitoso = True
-                print("✅ Ollama disponible - usando Ollama")
+            print(f"🌐 Realizando búsqueda web para: {mensaje}")
+            resultado_busqueda = await asyncio.to_thread(buscar_y_resumir, mensaje, max_resultados=3)
+            
+            if resultado_busqueda.get('exito', False) and resultado_busqueda.get('resultados'):
+                system_prompt = "Eres un asistente que tiene acceso a información de internet. DEBES usar ÚNICAMENTE la información proporcionada de las búsquedas web para responder."
+                plantilla = """INFORMACIÓN DE BÚSQUEDA WEB:\n\n{contexto}\n\n---\n\nPREGUNTA DEL USUARIO: {mensaje}\n\nResponde usando SOLO la información de búsqueda web proporcionada."""
+                presupuesto.consumir('sistema', system_prompt, extra=TOKENS_POR_MENSAJE)
+                contexto_web = _contexto_en_presupuesto(
+                    resultado_busqueda['resumen'], plantilla.format(contexto="", mensaje=mensaje), presupuesto
+                )
+                mensaje_completo = plantilla.format(contexto=contexto_web, mensaje=mensaje)
             else:
-                print(f"⚠️ Ollama no responde (status {response.status_code}) - fallback a GGUF")
+                return None, "🌐 No pude encontrar información actualizada en internet sobre ese tema."
         except Exception as e:
-            print(f"⚠️ Ollama no disponible ({str(e)}) - fallback a GGUF")
+            print(f"❌ Error en búsqueda web: {e}")
+            return None, f"🌐 Error al buscar en internet: {str(e)}"
+    
+    # Si hay contexto de archivo
+    elif contexto:
+        system_prompt = "Eres un asistente que analiza documentos. Responde basándote ÚNICAMENTE en el contenido del documento proporcionado."
+        plantilla = """DOCUMENTO:\n\n---\n{contexto}\n---\n\nPREGUNTA: {mensaje}\n\nResponde usando SOLO la información del documento."""
+        presupuesto.consumir('sistema', system_prompt, extra=TOKENS_POR_MENSAJE)
+        contexto_limitado = _contexto_en_presupuesto(
+            contexto, plantilla.format(contexto="", mensaje=mensaje), presupuesto
+        )
+        mensaje_completo = plantilla.format(contexto=contexto_limitado, mensaje=mensaje)
     
-    # Si no usa Ollama o falló, verificar GGUF
-    if not usar_ollama_exitoso:
-        if generador_actual.llm is None:
-            return {"respuesta": "❌ Ollama no está disponible y no hay modelo GGUF cargado. Por favor:\n\n1. Inicia Ollama con: ollama serve\n2. O carga un modelo GGUF desde Configuración"}
-        print(f"✅ LLM GGUF cargado correctamente - usando fallback")
+    else:
+        presupuesto.consumir('sistema', system_prompt, extra=TOKENS_POR_MENSAJE)
+        presupuesto.consumir('pregunta', mensaje_completo, extra=TOKENS_POR_MENSAJE)
+    
+    # Construir historial de mensajes
+    historial = data.get("historial", [])
+    messages = [{"role": "system", "content": system_prompt}]
+    
+    print(f"\n{'='*70}")
+    print(f"📥 HISTORIAL RECIBIDO DEL FRONTEND")
+    print(f"{'='*70}")
+    print(f"📊 Total mensajes recibidos: {len(historial)}")
+    
+    # Agregar historial previo (IMPORTANTE: no incluir el último mensaje porque ya viene en 'mensaje')
+    if historial:
+        # Los mensajes más recientes que quepan en la ventana (sin el último: es el actual)
+        historial_reciente = _historial_en_presupuesto(historial[:-1], presupuesto)
+        
+        print(f"📌 Mensajes a procesar: {len(historial_reciente)} (de {len(historial)} totales, presupuesto {presupuesto.resumen()})")
+        print(f"\n🔍 CONSTRUYENDO CONTEXTO PARA EL MODELO:")
+        print(f"1. [SYSTEM] {system_prompt[:80]}...")
+        
+        for i, msg in enumerate(historial_reciente):
+            tipo = msg.get('tipo', 'unknown')
+            texto = msg.get('texto', '')
+            preview = texto[:100] if len(texto) > 100 else texto
+            
+            if tipo == 'usuario':
+                messages.append({"role": "user", "content": texto})
+                print(f"{len(messages)}. [USER] {preview}...")
+            elif tipo == 'asistente':
+                messages.append({"role": "assistant", "content": texto})
+                print(f"{len(messages)}. [ASSISTANT] {preview}...")
+    
+    # Agregar mensaje actual
+    messages.append({"role": "user", "content": mensaje_completo})
+    print(f"{len(messages)}. [USER - ACTUAL] {mensaje_completo[:100]}...")
+    
+    print(f"\n📨 TOTAL MENSAJES ENVIADOS AL MODELO: {len(messages)}")
+    print(f"   └─ 1 system + {len(messages)-2} historial + 1 actual")
+    print(f"{'='*70}\n")
+    
+    return messages, None
+
+
+@app.post("/api/chat")
+async def chat_con_modelo(data: dict, request: Request):
+    """Endpoint para chatear con el modelo (soporta Ollama y GGUF con fallback automático)"""
+    global generador_actual
+    
+    mensaje = data.get("mensaje", "").strip()
+    if not mensaje:
+        raise HTTPException(status_code=400, detail="El mensaje no puede estar vacío")
+    
+    print(f"\n{'='*70}")
+    print(f"💬 CHAT REQUEST RECIBIDA")
+    print(f"{'='*70}")
+    print(f"📝 Mensaje: {mensaje[:100]}...")
+    
+    usar_ollama_exitoso, error_motor = await _motor_chat()
+    if error_motor:
+        return {"respuesta": error_motor}
     
     try:
         # Obtener ajustes avanzados del frontend
@@ -677,99 +887,36 @@ async def chat_con_modelo(data: dict):
         print(f"⚙️ Temperatura: {temperature} | Max tokens: {max_tokens}")
         print(f"{'='*60}\n")
         
-        # Preparar el contexto si existe
-        contexto = data.get("contexto", None)
-        buscar_web = data.get("buscar_web", False)
-        mensaje_completo = mensaje
-        system_prompt = "Eres un asistente educativo útil y respondes de manera clara y concisa en español."
-        
-        # Si se solicita búsqueda web
-        if buscar_web:
-            try:
-                print(f"🌐 Realizando búsqueda web para: {mensaje}")
-                resultado_busqueda = buscar_y_resumir(mensaje, max_resultados=3)
-                
-                if resultado_busqueda.get('exito', False) and resultado_busqueda.get('resultados'):
-                    contexto_web = resultado_busqueda['resumen']
-                    system_prompt = "Eres un asistente que tiene acceso a información de internet. DEBES usar ÚNICAMENTE la información proporcionada de las búsquedas web para responder."
-                    mensaje_completo = f"""INFORMACIÓN DE BÚSQUEDA WEB:\n\n{contexto_web}\n\n---\n\nPREGUNTA DEL USUARIO: {mensaje}\n\nResponde usando SOLO la información de búsqueda web proporcionada."""
-                else:
-                    return {"respuesta": "🌐 No pude encontrar información actualizada en internet sobre ese tema."}
-            except Exception as e:
-                print(f"❌ Error en búsqueda web: {e}")
-                return {"respuesta": f"🌐 Error al buscar en internet: {str(e)}"}
-        
-        # Si hay contexto de archivo
-        elif contexto:
-            contexto_limitado = contexto[:4000] if len(contexto) > 4000 else contexto
-            system_prompt = "Eres un asistente que analiza documentos. Responde basándote ÚNICAMENTE en el contenido del documento proporcionado."
-            mensaje_completo = f"""DOCUMENTO:\n\n---\n{contexto_limitado}\n---\n\nPREGUNTA: {mensaje}\n\nResponde usando SOLO la información del documento."""
-        
-        # Construir historial de mensajes
-        historial = data.get("historial", [])
-        messages = [{"role": "system", "content": system_prompt}]
-        
-        print(f"\n{'='*70}")
-        print(f"📥 HISTORIAL RECIBIDO DEL FRONTEND")
-        print(f"{'='*70}")
-        print(f"📊 Total mensajes recibidos: {len(historial)}")
-        
-        # Agregar historial previo (IMPORTANTE: no incluir el último mensaje porque ya viene en 'mensaje')
-        if historial:
-            # Tomar más mensajes del historial para mejor contexto
-            historial_reciente = historial[-20:]  # Últimos 20 mensajes (10 intercambios)
-            if buscar_web:
-                historial_reciente = historial[-12:]  # 6 intercambios para búsqueda web
-            elif contexto:
-                historial_reciente = historial[-8:]  # 4 intercambios con contexto
-            
-            print(f"📌 Mensajes a procesar: {len(historial_reciente)} (filtrados de {len(historial)} totales)")
-            print(f"\n🔍 CONSTRUYENDO CONTEXTO PARA EL MODELO:")
-            print(f"1. [SYSTEM] {system_prompt[:80]}...")
-            
-            # Filtrar solo hasta el penúltimo mensaje (el último es el actual)
-            for i, msg in enumerate(historial_reciente[:-1]):
-                tipo = msg.get('tipo', 'unknown')
-                texto = msg.get('texto', '')
-                preview = texto[:100] if len(texto) > 100 else texto
-                
-                if tipo == 'usuario':
-                    messages.append({"role": "user", "content": texto})
-                    print(f"{len(messages)}. [USER] {preview}...")
-                elif tipo == 'asistente':
-                    messages.append({"role": "assistant", "content": texto})
-                    print(f"{len(messages)}. [ASSISTANT] {preview}...")
-        
-        # Agregar mensaje actual
-        messages.append({"role": "user", "content": mensaje_completo})
-        print(f"{len(messages)}. [USER - ACTUAL] {mensaje_completo[:100]}...")
-        
-        print(f"\n📨 TOTAL MENSAJES ENVIADOS AL MODELO: {len(messages)}")
-        print(f"   └─ 1 system + {len(messages)-2} historial + 1 actual")
-        print(f"{'='*70}\n")
+        presupuesto = await _presupuesto_chat(usar_ollama_exitoso, max_tokens)
+        messages, respuesta_directa = await _construir_mensajes_chat(data, mensaje, presupuesto)
+        if respuesta_directa:
+            return {"respuesta": respuesta_directa}
         
         # Generar respuesta usando GeneradorUnificado con fallback
         print(f"🤖 Generando respuesta con temperatura={temperature}, max_tokens={max_tokens}")
         print(f"🔧 Usando {'Ollama' if usar_ollama_exitoso else 'GGUF/GPU (fallback)'}")
         
-        if usar_ollama_exitoso:
-            # Usar Ollama API de chat con historial completo
-            respuesta_texto = generador_actual._generar_ollama_chat(
-                messages=messages,
-                max_tokens=max_tokens,
-                temperature=temperature
-            )
-        else:
-            # Usar GGUF/llama-cpp (GPU o CPU)
-            respuesta = generador_actual.llm.create_chat_completion(
-                messages=messages,
-                max_tokens=max_tokens,
-                temperature=temperature,
-                top_p=ajustes.get('top_p', 0.9),
-                repeat_penalty=ajustes.get('repeat_penalty', 1.15),
-                stop=["\n\nHuman:", "\n\nUser:", "</s>"]
-            )
-            respuesta_texto = respuesta['choices'][0]['message']['content'].strip()
+        motor = 'ollama' if usar_ollama_exitoso else 'gguf'
+        async with obtener_planificador().turno(CHAT, motor, _cliente_de(request)):
+            if usar_ollama_exitoso:
+                # Usar Ollama API de chat con historial completo
+                respuesta_texto = await generador_actual._generar_ollama_chat_async(
+                    messages=messages,
+                    max_tokens=max_tokens,
+                    temperature=temperature
+                )
+            else:
+                # Usar GGUF/llama-cpp (GPU o CPU) en un hilo para no bloquear el event loop
+                respuesta = await asyncio.to_thread(
+                    generador_actual.llm.create_chat_completion,
+                    messages=messages,
+                    max_tokens=max_tokens,
+                    temperature=temperature,
+                    top_p=ajustes.get('top_p', 0.9),
+                    repeat_penalty=ajustes.get('repeat_penalty', 1.15),
+                    stop=["\n\nHuman:", "\n\nUser:", "</s>"]
+                )
+                respuesta_texto = respuesta['choices'][0]['message']['content'].strip()
         
         if not respuesta_texto:
             respuesta_texto = "Lo siento, no pude generar una respuesta. Intenta de nuevo."
@@ -786,6 +933,125 @@ async def chat_con_modelo(data: dict):
         raise HTTPException(status_code=500, detail=f"Error generando respuesta: {str(e)}")
 
 
+def _evento_sse(datos: dict) -> str:
+    return f"data: {json.dumps(datos, ensure_ascii=False)}\n\n"
+
+
+@app.post("/api/chat/stream")
+async def chat_con_modelo_stream(data: dict, request: Request):
+    """Chat con streaming SSE: envía cada token a medida que el modelo lo genera
+    
+    Eventos (campo 'tipo'):
+    - cola: {'posicion'} mientras la petición espera turno en el planificador
+    - token: {'texto'}
+    - fin: {'respuesta', 'ttft_ms', 'duracion_ms', 'tokens_prompt', 'tokens_respuesta', 'tokens_por_segundo'}
+    - error: {'error'}
+    Si el cliente se desconecta se corta la generación en el motor.
+    """
+    mensaje = data.get("mensaje", "").strip()
+    if not mensaje:
+        raise HTTPException(status_code=400, detail="El mensaje no puede estar vacío")
+    
+    print(f"\n{'='*70}")
+    print(f"💬 CHAT STREAM REQUEST RECIBIDA")
+    print(f"{'='*70}")
+    print(f"📝 Mensaje: {mensaje[:100]}...")
+    
+    inicio = time.perf_counter()
+    
+    async def event_generator():
+        usar_ollama, error_motor = await _motor_chat()
+        if error_motor:
+            yield _evento_sse({'tipo': 'token', 'texto': error_motor})
+            yield _evento_sse({'tipo': 'fin', 'respuesta': error_motor})
+            return
+        
+        ajustes = data.get("ajustes", {})
+        temperature = ajustes.get("temperature", 0.7)
+        max_tokens = ajustes.get("max_tokens", 768)
+        
+        presupuesto = await _presupuesto_chat(usar_ollama, max_tokens)
+        messages, respuesta_directa = await _construir_mensajes_chat(data, mensaje, presupuesto)
+        if respuesta_directa:
+            yield _evento_sse({'tipo': 'token', 'texto': respuesta_directa})
+            yield _evento_sse({'tipo': 'fin', 'respuesta': respuesta_directa})
+            return
+        
+        # Esperar turno en el planificador informando la posición en cola
+        planificador = obtener_planificador()
+        turno = planificador.solicitar(CHAT, 'ollama' if usar_ollama else 'gguf', _cliente_de(request))
+        partes = []
+        ttft = None
+        stream = None
+        try:
+            while not await turno.esperar(timeout=1.0):
+                yield _evento_sse({'tipo': 'cola', 'posicion': turno.posicion()})
+                if await request.is_disconnected():
+                    print(f"🔌 Cliente desconectado mientras esperaba turno")
+                    return
+            
+            print(f"🤖 Streaming con temperatura={temperature}, max_tokens={max_tokens}")
+            print(f"🔧 Usando {'Ollama' if usar_ollama else 'GGUF/GPU (fallback)'}")
+            
+            stream = generador_actual.chat_stream_async(
+                messages=messages,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                top_p=ajustes.get('top_p', 0.9),
+                repeat_penalty=ajustes.get('repeat_penalty', 1.15),
+                usar_ollama=usar_ollama
+            )
+            async for evento in stream:
+                if evento.get('fin'):
+                    duracion = time.perf_counter() - inicio
+                    tiempo_generacion = duracion - (ttft or 0)
+                    tokens = evento['tokens_respuesta']
+                    respuesta = "".join(partes).strip()
+                    print(f"✅ Stream completado: {len(respuesta)} caracteres, {tokens} tokens, "
+                          f"TTFT {(ttft or 0)*1000:.0f} ms, total {duracion:.2f}s")
+                    yield _evento_sse({
+                        'tipo': 'fin',
+                        'respuesta': respuesta,
+                        'ttft_ms': round((ttft or 0) * 1000),
+                        'duracion_ms': round(duracion * 1000),
+                        'tokens_prompt': evento['tokens_prompt'],
+                        'tokens_respuesta': tokens,
+                        'tokens_por_segundo': round(tokens / tiempo_generacion, 2) if tiempo_generacion > 0 else 0
+                    })
+                    break
+                
+                if ttft is None:
+                    ttft = time.perf_counter() - inicio
+                    print(f"⚡ Primer token en {ttft*1000:.0f} ms")
+                partes.append(evento['texto'])
+                yield _evento_sse({'tipo': 'token', 'texto': evento['texto']})
+                
+                if await request.is_disconnected():
+                    print(f"🔌 Cliente desconectado del chat stream - cortando generación")
+                    break
+        except asyncio.CancelledError:
+            print(f"🔌 Cliente desconectado del chat stream - cortando generación")
+            raise
+        except Exception as e:
+            print(f"❌ Error en chat stream: {type(e).__name__}: {e}")
+            yield _evento_sse({'tipo': 'error', 'error': f"Error generando respuesta: {str(e)}"})
+        finally:
+            # Cerrar el stream del motor aborta la petición a Ollama / el hilo de llama-cpp
+            if stream is not None:
+                await stream.aclose()
+            planificador.liberar(turno)
+    
+    return StreamingResponse(
+        event_generator(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "Connection": "keep-alive",
+            "X-Accel-Buffering": "no"
+        }
+    )
+
+
 @app.post("/api/guardar-nota-txt")
 async def guardar_nota_txt(datos: dict):
     """Guarda una nota como archivo TXT en la carpeta especificada"""
@@ -814,7 +1080,7 @@ async def guardar_nota_txt(datos: dict):
 
 
 @app.post("/api/chat_anterior")
-async def chat_con_modelo(data: dict):
+async def chat_con_modelo(data: dict, request: Request):
     """Endpoint para chatear con el modelo (soporta Ollama y GGUF)"""
     global generador_actual
     
@@ -857,6 +1123,7 @@ async def chat_con_modelo(data: dict):
         buscar_web = data.get("buscar_web", False)
         mensaje_completo = mensaje
         system_prompt = "Eres un asistente educativo útil y respondes de manera clara y concisa en español."
+        presupuesto = await _presupuesto_chat(generador_actual.usar_ollama, max_tokens)
         
         # Si se solicita búsqueda web
         if buscar_web:
@@ -865,9 +1132,13 @@ async def chat_con_modelo(data: dict):
                 resultado_busqueda = buscar_y_resumir(mensaje, max_resultados=3)
                 
                 if resultado_busqueda.get('exito', False) and resultado_busqueda.get('resultados'):
-                    contexto_web = resultado_busqueda['resumen']
                     system_prompt = "Eres un asistente que tiene acceso a información de internet. DEBES usar ÚNICAMENTE la información proporcionada de las búsquedas web para responder."
-                    mensaje_completo = f"""INFORMACIÓN DE BÚSQUEDA WEB:\n\n{contexto_web}\n\n---\n\nPREGUNTA DEL USUARIO: {mensaje}\n\nResponde usando SOLO la información de búsqueda web proporcionada."""
+                    plantilla = """INFORMACIÓN DE BÚSQUEDA WEB:\n\n{contexto}\n\n---\n\nPREGUNTA DEL USUARIO: {mensaje}\n\nResponde usando SOLO la información de búsqueda web proporcionada."""
+                    presupuesto.consumir('sistema', system_prompt, extra=TOKENS_POR_MENSAJE)
+                    contexto_web = _contexto_en_presupuesto(
+                        resultado_busqueda['resumen'], plantilla.format(contexto="", mensaje=mensaje), presupuesto
+                    )
+                    mensaje_completo = plantilla.format(contexto=contexto_web, mensaje=mensaje)
                 else:
                     return {"respuesta": "🌐 No pude encontrar información actualizada en internet sobre ese tema."}
             except Exception as e:
@@ -876,21 +1147,25 @@ async def chat_con_modelo(data: dict):
         
         # Si hay contexto de archivo
         elif contexto:
-            contexto_limitado = contexto[:4000] if len(contexto) > 4000 else contexto
             system_prompt = "Eres un asistente que analiza documentos. Responde basándote ÚNICAMENTE en el contenido del documento proporcionado."
-            mensaje_completo = f"""DOCUMENTO:\n\n---\n{contexto_limitado}\n---\n\nPREGUNTA: {mensaje}\n\nResponde usando SOLO la información del documento."""
+            plantilla = """DOCUMENTO:\n\n---\n{contexto}\n---\n\nPREGUNTA: {mensaje}\n\nResponde usando SOLO la información del documento."""
+            presupuesto.consumir('sistema', system_prompt, extra=TOKENS_POR_MENSAJE)
+            contexto_limitado = _contexto_en_presupuesto(
+                contexto, plantilla.format(contexto="", mensaje=mensaje), presupuesto
+            )
+            mensaje_completo = plantilla.format(contexto=contexto_limitado, mensaje=mensaje)
+        
+        else:
+            presupuesto.consumir('sistema', system_prompt, extra=TOKENS_POR_MENSAJE)
+            presupuesto.consumir('pregunta', mensaje_completo, extra=TOKENS_POR_MENSAJE)
         
         # Construir historial de mensajes
         historial = data.get("historial", [])
         messages = [{"role": "system", "content": system_prompt}]
         
-        # Agregar historial previo
+        # Agregar historial previo (los mensajes más recientes que quepan en la ventana)
         if historial:
-            historial_reciente = historial[-10:]  # Últimos 10 mensajes
-            if buscar_web:
-                historial_reciente = historial[-6:]
-            elif contexto:
-                historial_reciente = historial[-4:]
+            historial_reciente = _historial_en_presupuesto(historial, presupuesto)
             
             for msg in historial_reciente:
                 if msg.get('tipo') == 'usuario':
@@ -905,27 +1180,29 @@ async def chat_con_modelo(data: dict):
         print(f"🤖 Generando respuesta con temperatura={temperature}, max_tokens={max_tokens}")
         print(f"🔧 Usando {'Ollama' if generador_actual.usar_ollama else 'GGUF/GPU'}")
         
-        if generador_actual.usar_ollama:
-            # Usar Ollama para chat
-            respuesta_texto = generador_actual._generar_ollama(
-                prompt=mensaje_completo,
-                max_tokens=max_tokens,
-                temperature=temperature
-            )
-        else:
-            # Usar GGUF/llama-cpp (GPU o CPU)
-            if generador_actual.llm is None:
-                return {"respuesta": "❌ Modelo GGUF no está cargado. Ve a Configuración y carga un modelo."}
-            
-            respuesta = generador_actual.llm.create_chat_completion(
-                messages=messages,
-                max_tokens=max_tokens,
-                temperature=temperature,
-                top_p=ajustes.get('top_p', 0.9),
-                repeat_penalty=ajustes.get('repeat_penalty', 1.15),
-                stop=["\n\nHuman:", "\n\nUser:", "</s>"]
-            )
-            respuesta_texto = respuesta['choices'][0]['message']['content'].strip()
+        if not generador_actual.usar_ollama and generador_actual.llm is None:
+            return {"respuesta": "❌ Modelo GGUF no está cargado. Ve a Configuración y carga un modelo."}
+        
+        async with obtener_planificador().turno(CHAT, _motor_de(generador_actual), _cliente_de(request)):
+            if generador_actual.usar_ollama:
+                # Usar Ollama para chat
+                respuesta_texto = await generador_actual._generar_ollama_async(
+                    prompt=mensaje_completo,
+                    max_tokens=max_tokens,
+                    temperature=temperature
+                )
+            else:
+                # Usar GGUF/llama-cpp (GPU o CPU)
+                respuesta = await asyncio.to_thread(
+                    generador_actual.llm.create_chat_completion,
+                    messages=messages,
+                    max_tokens=max_tokens,
+                    temperature=temperature,
+                    top_p=ajustes.get('top_p', 0.9),
+                    repeat_penalty=ajustes.get('repeat_penalty', 1.15),
+                    stop=["\n\nHuman:", "\n\nUser:", "</s>"]
+                )
+                respuesta_texto = respuesta['choices'][0]['message']['content'].strip()
         
         if not respuesta_texto:
             respuesta_texto = "Lo siento, no pude generar una respuesta. Intenta de nuevo."
@@ -1250,7 +1527,7 @@ async def obtener_archivos_recursivos(ruta: str = ""):
 
 
 @app.post("/api/generar_examen_bloque")
-async def generar_examen_bloque(datos: dict):
+async def generar_examen_bloque(datos: dict, request: Request):
     """Genera preguntas para un bloque de archivos"""
     print(f"\n{'='*70}")
     print(f"📝 GENERAR EXAMEN POR BLOQUE")
@@ -1299,8 +1576,17 @@ async def generar_examen_bloque(datos: dict):
             'open_question': num_desarrollo
         }
         
-        print(f"🤖 Generando preguntas...")
-        preguntas = generador_actual.generar_examen(contenido_total, num_preguntas)
+        # Por partes: el bloque completo no cabe en una ventana y los últimos archivos quedarían
+        # recortados; las preguntas se reparten por todo el bloque y cada parte pide su turno
+        generador = await generador_configurado()
+        motor, cliente = _motor_de(generador), _cliente_de(request)
+        print(f"🤖 Generando preguntas por partes del bloque...")
+        preguntas = await asyncio.to_thread(
+            generador.generar_examen_por_partes, contenido_total, num_preguntas,
+            turno=lambda: obtener_planificador().turno_sync(GENERACION, motor, cliente),
+            streaming=True,
+            usar_cache=not datos.get("forzar_nuevas", False)
+        )
         print(f"✅ {len(preguntas)} preguntas generadas")
         
         return {
@@ -1371,10 +1657,22 @@ async def actualizar_contenido_documento(data: dict):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def _respuesta_trabajo(trabajo) -> dict:
+    """Respuesta inmediata de un POST en segundo plano"""
+    return {
+        "success": True,
+        "trabajo_id": trabajo.id,
+        "session_id": trabajo.id,
+        "estado": trabajo.estado,
+        "eventos": f"/api/trabajos/{trabajo.id}/eventos",
+        "resultado": f"/api/trabajos/{trabajo.id}"
+    }
+
+
 @app.post("/api/generar-examen")
-async def generar_examen(datos: dict):
+async def generar_examen(datos: dict, request: Request):
     """Genera un examen basado en contenido de documentos"""
-    global generador_actual, progreso_generacion
+    global generador_actual
     
     # DEBUG: Imprimir datos recibidos
     print(f"\n{'='*60}")
@@ -1394,6 +1692,10 @@ async def generar_examen(datos: dict):
     num_desarrollo = datos.get("num_desarrollo", 2)
     num_verdadero_falso = datos.get("num_verdadero_falso", 0)
     session_id = datos.get("session_id", str(uuid.uuid4()))
+    usar_cache = not datos.get("forzar_nuevas", False)  # True = no reutilizar respuestas en caché
+    en_segundo_plano = datos.get("en_segundo_plano", False)  # True = responder con el id del trabajo
+    carpeta_path = datos.get("carpeta_path", "")  # Para no repetir preguntas de exámenes anteriores
+    cliente = _cliente_de(request)
     
     # Cargar ajustes avanzados desde config
     config = cargar_config()
@@ -1448,25 +1750,15 @@ async def generar_examen(datos: dict):
     if not contenido:
         raise HTTPException(status_code=400, detail="Falta el contenido para generar el examen")
     
-    # Inicializar progreso
-    progreso_generacion[session_id] = {
-        'progreso': 0,
-        'mensaje': 'Iniciando generación...',
-        'completado': False,
-        'error': None
-    }
-    
-    def callback_progreso(progreso: int, mensaje: str):
-        """Callback para actualizar el progreso"""
-        progreso_generacion[session_id] = {
-            'progreso': progreso,
-            'mensaje': mensaje,
-            'completado': False,
-            'error': None
-        }
-        print(f"📊 Progreso {progreso}%: {mensaje}")
-    
-    try:
+    async def ejecutar(trabajo):
+        """Genera el examen dentro del pool de trabajos publicando el progreso"""
+        global generador_actual
+        
+        def callback_progreso(progreso: int, mensaje: str):
+            """Callback para actualizar el progreso"""
+            trabajo.actualizar(progreso, mensaje)
+            print(f"📊 Progreso {progreso}%: {mensaje}")
+        
         # Recargar generador con la configuración actual
         callback_progreso(5, "Cargando modelo de IA...")
         config = cargar_config()
@@ -1483,21 +1775,8 @@ async def generar_examen(datos: dict):
             print(f"   • Modelo GGUF: {modelo_path}")
             print(f"   • GPU Layers: {gpu_layers}")
         
-        # Crear generador con la configuración actual
-        if usar_ollama:
-            print(f"🔄 Cargando modelo Ollama: {modelo_ollama}")
-            generador_actual = GeneradorUnificado(
-                usar_ollama=True,
-                modelo_ollama=modelo_ollama,
-                n_gpu_layers=gpu_layers
-            )
-        else:
-            print(f"🔄 Cargando modelo GGUF: {modelo_path}")
-            generador_actual = GeneradorUnificado(
-                usar_ollama=False,
-                modelo_path_gguf=modelo_path,
-                n_gpu_layers=gpu_layers
-            )
+        # Generador residente para la configuración actual (solo se recarga si cambió)
+        generador_actual = await generador_configurado(config)
         
         # Generar preguntas (claves normalizadas para coincidir con el generador)
         num_preguntas = {
@@ -1507,15 +1786,29 @@ async def generar_examen(datos: dict):
             'open_question': num_desarrollo
         }
         
+        def al_esperar(posicion: int):
+            trabajo.actualizar(trabajo.progreso, f"En cola: posición {posicion}")
+        
+        # Cada parte del documento pide su propio turno de generación
+        motor = _motor_de(generador_actual)
+        turno = lambda: obtener_planificador().turno_sync(GENERACION, motor, cliente, al_esperar=al_esperar)
+        
         callback_progreso(10, "Preparando generación de preguntas...")
-        print("🤖 Generando preguntas con IA en DOS PASOS...")
-        preguntas = generador_actual.generar_examen(
+        indice_previas = await asyncio.to_thread(indice_examenes_previos, _carpeta_relativa_examenes(carpeta_path))
+        print("🤖 Generando preguntas con IA por partes del documento...")
+        preguntas = await asyncio.to_thread(
+            generador_actual.generar_examen_por_partes,
             contenido, 
             num_preguntas,
             ajustes_modelo=ajustes,
             callback_progreso=callback_progreso,
+            turno=turno,
+            indice_similitud=indice_previas,
             archivos=archivos,  # Pasar lista de archivos
-            session_id=session_id  # Pasar session_id para el log
+            session_id=session_id,  # Pasar session_id para el log
+            streaming=True,
+            callback_pregunta=trabajo.publicar_pregunta,
+            usar_cache=usar_cache
         )
         print(f"✅ Generadas {len(preguntas)} preguntas exitosamente")
         
@@ -1523,14 +1816,6 @@ async def generar_examen(datos: dict):
         callback_progreso(95, "Finalizando...")
         preguntas_json = [p.to_dict() for p in preguntas]
         
-        # Marcar como completado
-        progreso_generacion[session_id] = {
-            'progreso': 100,
-            'mensaje': 'Examen generado exitosamente',
-            'completado': True,
-            'error': None
-        }
-        
         resultado = {
             "success": True,
             "session_id": session_id,
@@ -1541,75 +1826,92 @@ async def generar_examen(datos: dict):
         
         print(f"✅ Examen generado: {resultado['total_preguntas']} preguntas, {resultado['puntos_totales']} puntos totales\n")
         return resultado
-        
+    
+    try:
+        trabajo = obtener_gestor().enviar("examen", ejecutar, id_trabajo=session_id)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    
+    if en_segundo_plano:
+        return _respuesta_trabajo(trabajo)
+    
+    try:
+        return await trabajo.esperar()
     except Exception as e:
         import traceback
         print(f"\n❌ ERROR generando examen:")
         print(f"   Tipo: {type(e).__name__}")
         print(f"   Mensaje: {str(e)}")
         print(f"   Traceback:")
-        traceback.print_exc()
+        traceback.print_exception(type(e), e, e.__traceback__)
         print(f"{'='*60}\n")
         
-        # Marcar progreso como error
-        if session_id in progreso_generacion:
-            progreso_generacion[session_id] = {
-                'progreso': 0,
-                'mensaje': f'Error: {str(e)}',
-                'completado': True,
-                'error': str(e)
-            }
-        
         raise HTTPException(status_code=500, detail=f"Error al generar examen: {str(e)}")
 
 
-@app.get("/api/progreso-examen/{session_id}")
-async def obtener_progreso_examen(session_id: str):
-    """Endpoint SSE para streaming de progreso de generación de examen"""
-    async def event_generator():
-        try:
-            while True:
-                # Obtener progreso actual
-                if session_id in progreso_generacion:
-                    progreso = progreso_generacion[session_id]
-                    
-                    # Enviar evento SSE
-                    data = json.dumps({
-                        'progreso': progreso['progreso'],
-                        'mensaje': progreso['mensaje'],
-                        'completado': progreso['completado'],
-                        'error': progreso['error']
-                    })
-                    yield f"data: {data}\n\n"
-                    
-                    # Si está completado (exitoso o error), terminar stream
-                    if progreso['completado']:
-                        # Limpiar progreso después de 5 segundos
-                        await asyncio.sleep(5)
-                        if session_id in progreso_generacion:
-                            del progreso_generacion[session_id]
-                        break
-                else:
-                    # Si no existe la sesión, enviar progreso inicial
-                    data = json.dumps({
-                        'progreso': 0,
-                        'mensaje': 'Esperando inicio...',
-                        'completado': False,
-                        'error': None
-                    })
-                    yield f"data: {data}\n\n"
-                
-                # Esperar un poco antes de la siguiente actualización
-                await asyncio.sleep(0.5)
-                
-        except asyncio.CancelledError:
-            # Cliente desconectó
-            print(f"🔌 Cliente desconectado del stream de progreso: {session_id}")
-            if session_id in progreso_generacion:
-                del progreso_generacion[session_id]
+def _carpeta_relativa_examenes(ruta: str) -> str:
+    """Ruta de la carpeta relativa a extracciones/ (la misma que usa examenes/); un
+    archivo se asocia a la carpeta que lo contiene"""
+    if not ruta:
+        return ""
+    carpeta = Path(ruta)
+    if not carpeta.exists():
+        carpeta = cursos_db.base_path / ruta
+    if carpeta.is_file():
+        carpeta = carpeta.parent
+    try:
+        return str(carpeta.relative_to(cursos_db.base_path))
+    except ValueError:
+        return ruta
+
+
+async def _eventos_trabajo(id_trabajo: str, request: Request = None):
+    """Eventos SSE de un trabajo: estado actual y luego cada cambio empujado por el trabajo"""
+    # El frontend abre el stream antes de enviar el POST: esperar a que exista
+    yield _evento_sse({
+        'progreso': 0,
+        'mensaje': 'Esperando inicio...',
+        'completado': False,
+        'error': None,
+        'preguntas_nuevas': []
+    })
+    trabajo = await obtener_gestor().esperar_registro(id_trabajo, timeout=600)
+    if trabajo is None:
+        yield _evento_sse({
+            'progreso': 0,
+            'mensaje': 'Trabajo no encontrado',
+            'completado': True,
+            'error': 'Trabajo no encontrado o expirado',
+            'preguntas_nuevas': []
+        })
+        return
     
+    cola = trabajo.suscribir()
+    try:
+        while True:
+            try:
+                evento = await asyncio.wait_for(cola.get(), timeout=15)
+            except asyncio.TimeoutError:
+                # Comentario SSE para que proxies y navegador no cierren la conexión
+                yield ": keep-alive\n\n"
+                if request is not None and await request.is_disconnected():
+                    break
+                continue
+            yield _evento_sse(evento)
+            if evento['completado']:
+                break
+    except asyncio.CancelledError:
+        print(f"🔌 Cliente desconectado del stream de progreso: {id_trabajo}")
+        raise
+    finally:
+        trabajo.desuscribir(cola)
+
+
+@app.get("/api/progreso-examen/{session_id}")
+async def obtener_progreso_examen(session_id: str, request: Request):
+    """Endpoint SSE para streaming de progreso de generación de examen (session_id = id del trabajo)"""
     return StreamingResponse(
-        event_generator(),
+        _eventos_trabajo(session_id, request),
         media_type="text/event-stream",
         headers={
             "Cache-Control": "no-cache",
@@ -1619,27 +1921,33 @@ async def obtener_progreso_examen(session_id: str):
     )
 
 
+@app.get("/api/trabajos/{trabajo_id}/eventos")
+async def eventos_trabajo(trabajo_id: str, request: Request):
+    """SSE con el progreso y las preguntas de un trabajo en segundo plano"""
+    return await obtener_progreso_examen(trabajo_id, request)
+
+
+@app.get("/api/trabajos/{trabajo_id}")
+async def obtener_trabajo(trabajo_id: str):
+    """Estado de un trabajo y, si terminó, su resultado"""
+    trabajo = obtener_gestor().obtener(trabajo_id)
+    if trabajo is None:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado o expirado")
+    return trabajo.resumen(incluir_resultado=True)
+
+
+@app.get("/api/trabajos")
+async def listar_trabajos():
+    """Trabajos conocidos (en cola, en ejecución y terminados aún no expirados)"""
+    return obtener_gestor().estadisticas()
+
+
 @app.post("/api/evaluar-examen")
-async def evaluar_examen(datos: dict):
+async def evaluar_examen(datos: dict, request: Request):
     """Evalúa las respuestas de un examen"""
-    global generador_unificado
-    
     try:
-        # Usar GeneradorUnificado (con GPU/CPU según configuración)
-        if generador_unificado is None:
-            config = cargar_config()
-            usar_ollama = config.get("usar_ollama", True)
-            modelo_ollama = config.get("modelo_ollama_activo", "llama31-local")
-            modelo_path_gguf = config.get("modelo_path")
-            ajustes = config.get("ajustes_avanzados", {})
-            n_gpu_layers = ajustes.get("n_gpu_layers", 35)
-            
-            generador_unificado = GeneradorUnificado(
-                usar_ollama=usar_ollama,
-                modelo_ollama=modelo_ollama,
-                modelo_path_gguf=modelo_path_gguf,
-                n_gpu_layers=n_gpu_layers
-            )
+        # Mismo generador residente que usa el resto del servidor
+        generador = await generador_configurado()
         
         try:
             # Validar que los datos requeridos estén presentes
@@ -1668,6 +1976,7 @@ async def evaluar_examen(datos: dict):
             puntos_obtenidos = 0
             puntos_totales = 0
 
+            pares = []
             for i, pregunta_dict in enumerate(preguntas_data):
                 pregunta = PreguntaExamen.from_dict(pregunta_dict)
                 respuesta_usuario = respuestas.get(str(i), "")
@@ -1675,9 +1984,23 @@ async def evaluar_examen(datos: dict):
                     respuesta_usuario = ""
                 elif not isinstance(respuesta_usuario, str):
                     respuesta_usuario = str(respuesta_usuario)
+                pares.append((pregunta, respuesta_usuario))
+
+            # Todas las preguntas abiertas se evalúan a la vez (limitado a los slots del backend)
+            # evaluacion_lote=True agrupa las abiertas en pocas llamadas al modelo
+            config = cargar_config()
+            paralelismo = datos.get("paralelismo") or config.get("paralelismo_evaluacion")
+            en_lote = bool(datos.get("evaluacion_lote", config.get("evaluacion_lote", False)))
+            inicio = time.perf_counter()
+            motor, cliente = _motor_de(generador), _cliente_de(request)
+            evaluaciones = await generador.evaluar_respuestas_async(
+                pares, paralelismo=paralelismo, en_lote=en_lote,
+                turno=lambda: obtener_planificador().turno(EVALUACION, motor, cliente)
+            )
+            duracion_ms = round((time.perf_counter() - inicio) * 1000, 1)
+            print(f"✅ Examen evaluado en {duracion_ms:.0f} ms")
 
-                # Evaluar respuesta
-                resultado_eval = generador_unificado.evaluar_respuesta(pregunta, respuesta_usuario)
+            for (pregunta, respuesta_usuario), resultado_eval in zip(pares, evaluaciones):
                 puntos = resultado_eval["puntos_obtenidos"]
                 feedback = resultado_eval["feedback"]
 
@@ -1692,7 +2015,8 @@ async def evaluar_examen(datos: dict):
                     "respuesta_correcta": pregunta.respuesta_correcta,
                     "puntos": puntos,
                     "puntos_maximos": pregunta.puntos,
-                    "feedback": feedback
+                    "feedback": feedback,
+                    "latencia_ms": resultado_eval.get("latencia_ms")
                 })
             
             porcentaje = (puntos_obtenidos / puntos_totales * 100) if puntos_totales > 0 else 0
@@ -1741,7 +2065,8 @@ async def evaluar_examen(datos: dict):
                 "puntos_obtenidos": puntos_obtenidos,
                 "puntos_totales": puntos_totales,
                 "porcentaje": porcentaje,
-                "resultados": resultados
+                "resultados": resultados,
+                "duracion_ms": duracion_ms
             }
         except Exception as e:
             print(f"Error evaluando examen: {e}")
@@ -2727,11 +3052,12 @@ async def guardar_txt_en_cursos(data: dict):
 async def listar_modelos_ollama():
     """Lista todos los modelos disponibles en Ollama"""
     try:
-        response = requests.get("http://localhost:11434/api/tags", timeout=5)
-        if response.status_code == 200:
-            data = response.json()
-            modelos = data.get('models', [])
-            
+        try:
+            modelos = await obtener_cliente().tags(timeout=5)
+        except ErrorOllama:
+            modelos = None
+        
+        if modelos is not None:
             # Formatear modelos con información adicional
             modelos_formateados = []
             for modelo in modelos:
@@ -2800,26 +3126,16 @@ async def cambiar_modelo_ollama(datos: dict):
     try:
         print(f"\n🔄 Cambiando a modelo Ollama: {modelo}")
         
-        # Liberar generador anterior
-        if generador_actual:
-            del generador_actual
-            generador_actual = None
-            import gc
-            gc.collect()
-        
-        # Crear nuevo generador con Ollama
-        from generador_unificado import GeneradorUnificado
-        generador_actual = GeneradorUnificado(
-            usar_ollama=True,
-            modelo_ollama=modelo,
-            n_gpu_layers=35
-        )
-        
         # Guardar en config
         config = cargar_config()
         config["modelo_ollama_activo"] = modelo
         config["usar_ollama"] = True
         guardar_config(config)
+        olvidar_digests_ollama()
+        
+        # Generador residente del nuevo modelo
+        generador_actual = await generador_configurado(config)
+        programar_calentamiento()
         
         print(f"✅ Modelo cambiado a: {modelo}")
         
@@ -2850,20 +3166,16 @@ async def eliminar_modelo_ollama(nombre_modelo: str):
             }
         
         # Llamar a Ollama para eliminar el modelo
-        response = requests.delete(
-            f"http://localhost:11434/api/delete",
-            json={"name": nombre_modelo},
-            timeout=10
-        )
-        
-        if response.status_code == 200:
+        try:
+            await obtener_cliente().eliminar_modelo(nombre_modelo, timeout=10)
+            olvidar_digests_ollama()
             print(f"✅ Modelo eliminado: {nombre_modelo}")
             return {
                 "success": True,
                 "mensaje": f"Modelo '{nombre_modelo}' eliminado correctamente"
             }
-        else:
-            error_msg = response.text if response.text else "Error desconocido"
+        except ErrorOllama as e:
+            error_msg = e.detalle
             print(f"❌ Error eliminando modelo: {error_msg}")
             return {
                 "success": False,
@@ -2887,6 +3199,7 @@ async def cambiar_motor_ia(datos: dict):
     modelo_ollama = datos.get("modelo_ollama", "llama31-local")
     modelo_gguf = datos.get("modelo_gguf", None)
     n_gpu_layers = datos.get("n_gpu_layers", 35)
+    n_ctx = cargar_config().get("ajustes_avanzados", {}).get("n_ctx", N_CTX_POR_DEFECTO)
     
     try:
         motor = "Ollama (GPU automática)" if usar_ollama else "llama-cpp-python"
@@ -2897,22 +3210,17 @@ async def cambiar_motor_ia(datos: dict):
         print(f"Modelo Ollama: {modelo_ollama}")
         print(f"GPU Layers: {n_gpu_layers}")
         
-        # Liberar generador anterior
-        if generador_actual:
-            del generador_actual
-            generador_actual = None
-            import gc
-            gc.collect()
-        
-        # Crear nuevo generador
-        from generador_unificado import GeneradorUnificado
-        
+        # Generador residente del motor destino (el registro libera el GGUF anterior si cambia)
         if usar_ollama:
-            generador_actual = GeneradorUnificado(
+            olvidar_digests_ollama()
+            _activar_generador(await asyncio.to_thread(
+                obtener_registro().obtener,
                 usar_ollama=True,
                 modelo_ollama=modelo_ollama,
-                n_gpu_layers=n_gpu_layers
-            )
+                modelo_path_gguf=cargar_config().get("modelo_path"),
+                n_gpu_layers=n_gpu_layers,
+                n_ctx=n_ctx
+            ))
             print(f"✅ Motor Ollama activo - GPU automática")
             print(f"🎯 Modelo: {modelo_ollama}")
             print(f"{'='*70}\n")
@@ -2924,11 +3232,13 @@ async def cambiar_motor_ia(datos: dict):
             if not modelo_gguf or not Path(modelo_gguf).exists():
                 raise ValueError("No hay modelo GGUF configurado o no existe")
             
-            generador_actual = GeneradorUnificado(
+            _activar_generador(await asyncio.to_thread(
+                obtener_registro().obtener,
                 usar_ollama=False,
                 modelo_path_gguf=modelo_gguf,
-                n_gpu_layers=n_gpu_layers
-            )
+                n_gpu_layers=n_gpu_layers,
+                n_ctx=n_ctx
+            ))
             
             gpu_info = f"GPU activada ({n_gpu_layers} capas)" if n_gpu_layers > 0 else "Solo CPU (0 capas)"
             print(f"✅ Motor llama-cpp-python activo - {gpu_info}")
@@ -2941,6 +3251,7 @@ async def cambiar_motor_ia(datos: dict):
         config["modelo_ollama_activo"] = modelo_ollama if usar_ollama else None
         config["ajustes_avanzados"]["n_gpu_layers"] = n_gpu_layers
         guardar_config(config)
+        programar_calentamiento()
         
         print(f"💾 Configuración guardada:")
         print(f"   - usar_ollama: {usar_ollama}")
@@ -2977,6 +3288,7 @@ async def reparar_motor():
         usar_ollama = config.get("usar_ollama", True)
         modelo_ollama = config.get("modelo_ollama_activo", "qwen-local:latest")
         n_gpu_layers = config.get("ajustes_avanzados", {}).get("n_gpu_layers", 35)
+        n_ctx = config.get("ajustes_avanzados", {}).get("n_ctx", N_CTX_POR_DEFECTO)
         
         print(f"\n{'='*70}")
         print(f"🔧 REPARANDO MOTOR DE IA")
@@ -2986,25 +3298,27 @@ async def reparar_motor():
         print(f"   - Modelo: {modelo_ollama}")
         print(f"   - GPU Layers: {n_gpu_layers}")
         
-        # Liberar completamente el generador anterior
+        # Liberar completamente los generadores residentes
+        registro = obtener_registro()
         if generador_actual:
             print(f"🗑️  Liberando generador anterior...")
-            del generador_actual
             generador_actual = None
+            registro.descartar()
             import gc
             gc.collect()
             print(f"✅ Generador anterior liberado")
         
         # Recrear generador con la configuración actual
-        from generador_unificado import GeneradorUnificado
-        
         if usar_ollama:
             print(f"🔄 Recreando generador Ollama...")
-            generador_actual = GeneradorUnificado(
+            _activar_generador(await asyncio.to_thread(
+                registro.obtener,
                 usar_ollama=True,
                 modelo_ollama=modelo_ollama,
-                n_gpu_layers=n_gpu_layers
-            )
+                modelo_path_gguf=config.get("modelo_path"),
+                n_gpu_layers=n_gpu_layers,
+                n_ctx=n_ctx
+            ))
             print(f"✅ Motor Ollama reparado y activo")
             print(f"🎯 Modelo: {modelo_ollama}")
         else:
@@ -3013,14 +3327,17 @@ async def reparar_motor():
                 raise ValueError("No hay modelo GGUF configurado")
             
             print(f"🔄 Recreando generador llama-cpp-python...")
-            generador_actual = GeneradorUnificado(
+            _activar_generador(await asyncio.to_thread(
+                registro.obtener,
                 usar_ollama=False,
                 modelo_path_gguf=modelo_gguf,
-                n_gpu_layers=n_gpu_layers
-            )
+                n_gpu_layers=n_gpu_layers,
+                n_ctx=n_ctx
+            ))
             print(f"✅ Motor llama-cpp-python reparado y activo")
             print(f"📁 Modelo: {Path(modelo_gguf).name}")
         
+        programar_calentamiento()
         print(f"{'='*70}\n")
         
         return {
@@ -3047,7 +3364,9 @@ async def obtener_estado_motor():
             "activo": False,
             "tipo": None,
             "modelo": None,
-            "gpu_activa": False
+            "gpu_activa": False,
+            "registro": obtener_registro().estadisticas(),
+            "calentamiento": await estado_calentamiento()
         }
     
     if hasattr(generador_actual, 'usar_ollama') and generador_actual.usar_ollama:
@@ -3057,7 +3376,9 @@ async def obtener_estado_motor():
             "modelo": generador_actual.modelo_ollama,
             "gpu_activa": True,
             "gpu_automatica": True,
-            "descripcion": "Ollama activa la GPU automáticamente"
+            "descripcion": "Ollama activa la GPU automáticamente",
+            "registro": obtener_registro().estadisticas(),
+            "calentamiento": await estado_calentamiento()
         }
     else:
         gpu_layers = generador_actual.n_gpu_layers if hasattr(generador_actual, 'n_gpu_layers') else 0
@@ -3067,13 +3388,173 @@ async def obtener_estado_motor():
             "modelo": Path(generador_actual.modelo_path_gguf).name if hasattr(generador_actual, 'modelo_path_gguf') else None,
             "gpu_activa": gpu_layers > 0,
             "gpu_layers": gpu_layers,
-            "descripcion": f"GPU con {gpu_layers} capas" if gpu_layers > 0 else "Solo CPU"
+            "descripcion": f"GPU con {gpu_layers} capas" if gpu_layers > 0 else "Solo CPU",
+            "worker": generador_actual.llm.estado() if hasattr(getattr(generador_actual, 'llm', None), 'estado') else None,
+            "formateador": {
+                "pasos_en_paralelo": generador_actual.pasos_en_paralelo,
+                "cargado": generador_actual.llm_formato is not None,
+                "n_gpu_layers": generador_actual.N_GPU_CAPAS_FORMATO
+            } if hasattr(generador_actual, 'pasos_en_paralelo') else None,
+            "registro": obtener_registro().estadisticas(),
+            "calentamiento": await estado_calentamiento()
         }
 
 
+@app.get("/api/cache/estadisticas")
+async def estadisticas_cache():
+    """Aciertos/fallos y tamaño de las cachés del modelo (generación y evaluación)"""
+    return {
+        "respuestas": obtener_cache_respuestas().estadisticas(),
+        "evaluaciones": obtener_cache_evaluaciones().estadisticas()
+    }
+
+
+@app.delete("/api/cache")
+async def limpiar_cache(tipo: Optional[str] = None):
+    """Vacía las cachés del modelo (memoria y disco). tipo: "respuestas", "evaluaciones" o ambas"""
+    caches = {
+        "respuestas": obtener_cache_respuestas,
+        "evaluaciones": obtener_cache_evaluaciones
+    }
+    if tipo is not None and tipo not in caches:
+        raise HTTPException(status_code=400, detail=f"Tipo de caché desconocido: {tipo}")
+    
+    for nombre, obtener in caches.items():
+        if tipo is None or tipo == nombre:
+            obtener().limpiar()
+            print(f"🧹 Caché de {nombre} vaciada")
+    return {"success": True}
+
+
+async def _aplicar_endpoints_ollama(urls: list, config: dict) -> list:
+    """Configura los nodos Ollama; sin límite guardado, el planificador admite OLLAMA_NUM_PARALLEL por nodo"""
+    nodos = await configurar_endpoints(urls)
+    if "ollama" not in config.get("limites_concurrencia", {}):
+        obtener_planificador().configurar_limite("ollama", LIMITES_POR_DEFECTO["ollama"] * len(nodos))
+    print(f"🌐 Nodos Ollama: {', '.join(nodos)}")
+    return nodos
+
+
+@app.get("/api/ollama/nodos")
+async def estado_nodos_ollama():
+    """Servidores Ollama del balanceador: salud, peticiones en curso y modelos de cada uno"""
+    return obtener_balanceador().estado()
+
+
+@app.post("/api/ollama/nodos")
+async def configurar_nodos_ollama(datos: dict):
+    """Cambia la lista de servidores Ollama (se guarda en config.json)"""
+    urls = datos.get("endpoints")
+    if not isinstance(urls, list) or not urls or not all(isinstance(u, str) and u.startswith("http") for u in urls):
+        raise HTTPException(status_code=400, detail="endpoints debe ser una lista de URLs http(s)")
+    
+    config = cargar_config()
+    config["ollama_endpoints"] = urls
+    guardar_config(config)
+    nodos = await _aplicar_endpoints_ollama(urls, config)
+    return {"success": True, "endpoints": nodos}
+
+
+@app.get("/api/planificador/estado")
+async def estado_planificador():
+    """Peticiones en curso y en cola por motor, con su posición y espera media por clase"""
+    return obtener_planificador().estado()
+
+
+@app.post("/api/planificador/limite")
+async def configurar_limite_planificador(datos: dict):
+    """Cambia cuántas peticiones simultáneas acepta un motor (ollama: OLLAMA_NUM_PARALLEL, gguf: 1)"""
+    motor = datos.get("motor")
+    limite = datos.get("limite")
+    if motor not in ("ollama", "gguf"):
+        raise HTTPException(status_code=400, detail="motor debe ser 'ollama' o 'gguf'")
+    try:
+        limite = int(limite)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="limite debe ser un entero")
+    if limite < 1:
+        raise HTTPException(status_code=400, detail="limite debe ser al menos 1")
+    
+    config = cargar_config()
+    config.setdefault("limites_concurrencia", {})[motor] = limite
+    guardar_config(config)
+    obtener_planificador().configurar_limite(motor, limite)
+    print(f"🚦 Límite de concurrencia de {motor}: {limite}")
+    return {"success": True, "motor": motor, "limite": limite}
+
+
+@app.post("/api/motor/keep-alive")
+async def configurar_keep_alive(datos: dict):
+    """Cambia cuánto tiempo mantiene Ollama el modelo en memoria ("30m", "2h", -1 = siempre, 0 = descargar)"""
+    keep_alive = datos.get("keep_alive")
+    if keep_alive is None or str(keep_alive).strip() == "":
+        raise HTTPException(status_code=400, detail="Falta el valor de keep_alive")
+    
+    # Ollama solo acepta números sin unidad como enteros (segundos)
+    if isinstance(keep_alive, str) and keep_alive.strip().lstrip('-').isdigit():
+        keep_alive = int(keep_alive.strip())
+    
+    config = cargar_config()
+    config["ollama_keep_alive"] = keep_alive
+    guardar_config(config)
+    print(f"⏳ keep_alive de Ollama: {keep_alive}")
+    
+    # Reaplicar la política sobre el modelo activo
+    programar_calentamiento()
+    return {"success": True, "keep_alive": keep_alive}
+
+
+@app.post("/api/motor/salida-estructurada")
+async def configurar_salida_estructurada(datos: dict):
+    """Activa o desactiva la salida restringida al esquema JSON (para comparar la tasa de
+    fallos de parseo con y sin restricción en /api/parseo/estadisticas)"""
+    activa = datos.get("activa")
+    if not isinstance(activa, bool):
+        raise HTTPException(status_code=400, detail="activa debe ser true o false")
+    
+    config = cargar_config()
+    config["salida_estructurada"] = activa
+    guardar_config(config)
+    if generador_actual is not None:
+        generador_actual.salida_estructurada = activa
+    print(f"🧩 Salida JSON restringida por esquema: {'activada' if activa else 'desactivada'}")
+    return {"success": True, "salida_estructurada": activa}
+
+
+@app.get("/api/parseo/estadisticas")
+async def estadisticas_parseo():
+    """Respuestas del modelo que no eran JSON válido tal cual, con y sin salida restringida"""
+    return {
+        "salida_estructurada": cargar_config().get("salida_estructurada", True),
+        **obtener_estadisticas_parseo().estado()
+    }
+
+
 @app.post("/api/generar_practica")
-def generar_practica(datos: dict):
-    """Genera una práctica basada en archivos o carpetas con prompt personalizado"""
+async def generar_practica(datos: dict, request: Request):
+    """Genera una práctica basada en archivos o carpetas con prompt personalizado
+    
+    Se ejecuta como trabajo en segundo plano. Con en_segundo_plano=True responde al
+    instante con el id del trabajo; si no, espera y retorna la práctica como antes.
+    session_id (opcional) es el id del trabajo para /api/progreso-examen.
+    """
+    cliente = _cliente_de(request)
+    try:
+        trabajo = obtener_gestor().enviar(
+            "practica",
+            lambda t: asyncio.to_thread(_generar_practica, datos, cliente, t),
+            id_trabajo=datos.get("session_id")
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    
+    if datos.get("en_segundo_plano", False):
+        return _respuesta_trabajo(trabajo)
+    return await trabajo.esperar()
+
+
+def _generar_practica(datos: dict, cliente: str, trabajo) -> dict:
+    """Cuerpo de /api/generar_practica; corre en un hilo del pool de trabajos"""
     print(f"\n{'='*70}")
     print(f"📝 GENERACIÓN DE PRÁCTICA REQUEST")
     print(f"{'='*70}")
@@ -3090,6 +3571,7 @@ def generar_practica(datos: dict):
     ruta = datos.get("ruta", "")
     prompt_personalizado = datos.get("prompt", "")
     tipo_caso = datos.get("tipo_caso", "descriptivo")  # Tipo de caso de estudio
+    usar_cache = not datos.get("forzar_nuevas", False)  # True = no reutilizar respuestas en caché
     
     # Obtener cantidades de cada tipo de pregunta - Generales
     num_flashcards = int(datos.get("num_flashcards", 0))
@@ -3195,8 +3677,9 @@ def generar_practica(datos: dict):
                 print(f"❌ ERROR: No se encontraron documentos en la carpeta")
                 raise HTTPException(status_code=404, detail=f"No se encontraron documentos en la carpeta '{ruta}' ni sus subcarpetas")
 
-            print(f"📚 Procesando {min(len(documentos), 20)} documentos...")
-            for doc in documentos[:20]:  # Limitar a 20 documentos para no sobrecargar
+            # Se leen todos: la generación reparte las preguntas por partes del contenido
+            print(f"📚 Procesando {len(documentos)} documentos...")
+            for doc in documentos:
                 try:
                     resultado_doc = cursos_db.obtener_contenido_documento(doc["ruta"])
                     contenido_doc = resultado_doc.get('contenido', '') if isinstance(resultado_doc, dict) else str(resultado_doc)
@@ -3216,14 +3699,9 @@ def generar_practica(datos: dict):
         if generador_actual is None:
             raise HTTPException(status_code=500, detail="Modelo no inicializado")
 
-        # El prompt ya viene completo desde el frontend con las especificaciones
-        contenido_para_ia = prompt_personalizado if prompt_personalizado else contenido_total
-        
-        # Si hay prompt personalizado, agregar el contenido
-        if prompt_personalizado:
-            contenido_para_ia = f"{prompt_personalizado}\n\nCONTENIDO:\n{contenido_total[:8000]}"
-        else:
-            contenido_para_ia = contenido_total[:8000]
+        # El prompt ya viene completo desde el frontend con las especificaciones; se antepone
+        # a cada parte del contenido ("prompt\n\nCONTENIDO:\nparte")
+        contenido_para_ia = contenido_total
 
         # Ajustes del modelo - MÁS GENEROSOS para casos de estudio
         # Si hay casos de estudio, necesitamos más tokens para contenido detallado
@@ -3243,7 +3721,7 @@ def generar_practica(datos: dict):
         print(f"\n{'='*60}")
         print(f"📝 Generando práctica personalizada...")
         print(f"   Total: {total_preguntas} preguntas")
-        print(f"   Contenido: {len(contenido_para_ia)} caracteres")
+        print(f"   Contenido: {len(contenido_para_ia)} caracteres (+ prompt de {len(prompt_personalizado)})")
         print(f"   Max tokens: {max_tokens_base}")
         print(f"{'='*60}\n")
 
@@ -3307,12 +3785,25 @@ def generar_practica(datos: dict):
             
             print(f"📦 Diccionario de tipos enviado al generador: {num_preguntas_dict}")
             
-            preguntas_obj = generador_actual.generar_examen(
+            trabajo.actualizar(10, 'Generando práctica...')
+            
+            # Un grupo de tipos por generación (plan_practica): salidas cortas y JSON más fiable
+            motor = _motor_de(generador_actual)
+            preguntas_obj = generador_actual.generar_practica_por_grupos(
                 contenido_para_ia,
                 num_preguntas=num_preguntas_dict,
+                encabezado=prompt_personalizado,  # Usar el prompt del usuario directamente
                 ajustes_modelo=ajustes_modelo,
-                sin_prompt_sistema=True,  # Usar el prompt del usuario directamente
-                tipo_caso=tipo_caso if num_caso_estudio > 0 else None
+                tipo_caso=tipo_caso if num_caso_estudio > 0 else None,
+                streaming=True,
+                callback_progreso=trabajo.actualizar,
+                callback_pregunta=trabajo.publicar_pregunta,
+                usar_cache=usar_cache,
+                indice_similitud=indice_examenes_previos(_carpeta_relativa_examenes(ruta)),
+                turno=lambda: obtener_planificador().turno_sync(
+                    GENERACION, motor, cliente,
+                    al_esperar=lambda pos: trabajo.actualizar(trabajo.progreso, f"En cola: posición {pos}")
+                )
             )
             
             print(f"✅ Generador retornó: {type(preguntas_obj)}")
@@ -3354,8 +3845,36 @@ def generar_practica(datos: dict):
         raise HTTPException(status_code=500, detail=f"Error inesperado: {str(e)}")
 
 
+# Parte fija del prompt de evaluación de flashcards (va antes de los datos de la tarjeta)
+INSTRUCCIONES_FLASHCARD = """Eres un evaluador de respuestas de estudiantes.
+
+TU TAREA:
+1. Compara la RESPUESTA DEL ESTUDIANTE (al final) con la respuesta correcta y los key_points del CONTEXTO.
+2. Decide un score numérico entre 0 y 100.
+3. Indica si la respuesta es:
+   - "correct": cubre la mayoría de los puntos importantes y no tiene errores graves
+   - "partially_correct": cubre algunos puntos importantes pero omite otros o tiene errores
+   - "incorrect": no refleja la idea principal o es muy pobre
+4. Indica qué key_points fueron cubiertos y cuáles faltan.
+5. Da un feedback breve al estudiante.
+
+FORMATO DE SALIDA:
+Devuelve EXCLUSIVAMENTE un objeto JSON (sin texto adicional):
+{
+  "score": 85,
+  "verdict": "correct",
+  "covered_key_points": ["punto que sí mencionó"],
+  "missing_key_points": ["punto que faltó"],
+  "feedback": "Texto breve dirigido al estudiante explicando qué entendió bien y qué le falta"
+}
+
+No agregues texto fuera del JSON.
+
+"""
+
+
 @app.post("/api/evaluate_flashcard")
-def evaluate_flashcard(datos: dict):
+def evaluate_flashcard(datos: dict, request: Request):
     """Evalúa la respuesta del usuario para una flashcard usando IA"""
     print(f"\n{'='*70}")
     print(f"🎯 EVALUACIÓN DE FLASHCARD")
@@ -3389,10 +3908,8 @@ def evaluate_flashcard(datos: dict):
         print(f"🎯 Key points: {key_points}")
         print(f"👤 Respuesta usuario: {user_answer[:60]}...")
         
-        # Construir prompt para Ollama
-        prompt = f"""Eres un evaluador de respuestas de estudiantes.
-
-CONTEXTO:
+        # Construir prompt: instrucciones fijas primero (su KV-cache se reutiliza) y luego la flashcard
+        prompt = registrar_prefijo(INSTRUCCIONES_FLASHCARD) + f"""CONTEXTO:
 Pregunta (front): {front}
 Respuesta correcta de referencia: {correct_answer}
 Ideas clave que debe cubrir (key_points): {', '.join(key_points)}
@@ -3401,67 +3918,58 @@ Explicación del concepto: {explanation}
 RESPUESTA DEL ESTUDIANTE:
 {user_answer}
 
-TU TAREA:
-1. Compara la respuesta del estudiante con la respuesta correcta y los key_points.
-2. Decide un score numérico entre 0 y 100.
-3. Indica si la respuesta es:
-   - "correct": cubre la mayoría de los puntos importantes y no tiene errores graves
-   - "partially_correct": cubre algunos puntos importantes pero omite otros o tiene errores
-   - "incorrect": no refleja la idea principal o es muy pobre
-4. Indica qué key_points fueron cubiertos y cuáles faltan.
-5. Da un feedback breve al estudiante.
-
-FORMATO DE SALIDA:
-Devuelve EXCLUSIVAMENTE un objeto JSON (sin texto adicional):
-{{
-  "score": 85,
-  "verdict": "correct",
-  "covered_key_points": ["punto que sí mencionó"],
-  "missing_key_points": ["punto que faltó"],
-  "feedback": "Texto breve dirigido al estudiante explicando qué entendió bien y qué le falta"
-}}
-
-No agregues texto fuera del JSON."""
+JSON:"""
 
         if generador_actual is None:
             raise HTTPException(status_code=500, detail="No hay modelo activo")
         
-        print(f"\n🤖 Enviando a IA para evaluación...")
+        # Misma flashcard y misma respuesta (salvo mayúsculas/acentos/espacios) → sin llamar al modelo
+        cache_evaluaciones = obtener_cache_evaluaciones()
+        clave_cache = {
+            'flashcard': True,
+            'modelo': generador_actual.modelo_ollama if generador_actual.usar_ollama else generador_actual.modelo_path_gguf,
+            'front': front,
+            'respuesta_modelo': correct_answer,
+            'key_points': key_points,
+            'respuesta': normalizar_texto(user_answer)
+        }
+        resultado = cache_evaluaciones.obtener(clave_cache)
+        if resultado is not None:
+            print(f"⚡ Evaluación desde caché: score {resultado.get('score')}")
+            return resultado
         
-        # Usar el modelo para evaluar
-        respuesta = generador_actual.llm(
-            prompt,
-            max_tokens=1000,
-            temperature=0.3,  # Baja temperatura para evaluación consistente
-            top_p=0.9,
-            repeat_penalty=1.1
-        )
+        print(f"\n🤖 Enviando a IA para evaluación...")
         
-        respuesta_texto = respuesta['choices'][0]['text'].strip()
+        # Usar el motor activo (Ollama o GGUF) para evaluar
+        with obtener_planificador().turno_sync(EVALUACION, _motor_de(generador_actual), _cliente_de(request)):
+            respuesta_texto = generador_actual.generar_texto(
+                prompt,
+                max_tokens=1000,
+                temperature=0.3,  # Baja temperatura para evaluación consistente
+                top_p=0.9,
+                repeat_penalty=1.1
+            ).strip()
         
         print(f"📄 Respuesta IA: {respuesta_texto[:200]}...")
         
-        # Extraer JSON
-        json_inicio = respuesta_texto.find('{')
-        json_fin = respuesta_texto.rfind('}') + 1
+        # Extraer JSON (el primer objeto válido, aunque haya texto con llaves alrededor)
+        resultado = primer_json(respuesta_texto)
         
-        if json_inicio >= 0 and json_fin > json_inicio:
-            json_str = respuesta_texto[json_inicio:json_fin]
-            resultado = json.loads(json_str)
-            
+        if resultado is not None:
             print(f"✅ Evaluación completada:")
             print(f"   Score: {resultado.get('score')}")
             print(f"   Verdict: {resultado.get('verdict')}")
             print(f"   Cubiertos: {resultado.get('covered_key_points')}")
             print(f"   Faltantes: {resultado.get('missing_key_points')}")
             
+            cache_evaluaciones.guardar(clave_cache, resultado)
             return resultado
         else:
-            raise Exception("No se pudo extraer JSON de la respuesta")
+            print(f"❌ No se encontró un objeto JSON válido en la respuesta")
+            raise HTTPException(status_code=500, detail="Error parseando respuesta de IA")
             
-    except json.JSONDecodeError as e:
-        print(f"❌ Error parseando JSON: {e}")
-        raise HTTPException(status_code=500, detail="Error parseando respuesta de IA")
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"❌ Error evaluando flashcard: {e}")
         import traceback
@@ -3544,6 +4052,7 @@ PARAMETER num_ctx 4096
                 detail=f"Error instalando modelo en Ollama: {stderr}"
             )
         
+        olvidar_digests_ollama()
         print(f"✅ Modelo instalado exitosamente")
         print(f"STDOUT: {stdout}")
         
@@ -3557,11 +4066,8 @@ PARAMETER num_ctx 4096
         
         # Actualizar lista de modelos
         try:
-            response_modelos = requests.get("http://localhost:11434/api/tags", timeout=5)
-            modelos_disponibles = []
-            if response_modelos.status_code == 200:
-                data = response_modelos.json()
-                modelos_disponibles = [m['name'] for m in data.get('models', [])]
+            modelos = await obtener_cliente().tags(timeout=5)
+            modelos_disponibles = [m['name'] for m in modelos]
         except Exception as e:
             print(f"⚠️ No se pudo obtener lista de modelos: {e}")
             modelos_disponibles = [nombre_modelo]
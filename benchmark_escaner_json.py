@@ -0,0 +1,135 @@
+"""
+Benchmark: búsqueda de JSON en respuestas del modelo
+Compara el escaneo anterior de _extraer_preguntas (un recorrido balanceado desde cada '{',
+O(n²)) con escaner_json.spans_json (una sola pasada) sobre las respuestas guardadas en
+logs_practicas_detallado/. Sin logs usa respuestas sintéticas tipo DeepSeek-R1.
+
+Uso: python benchmark_escaner_json.py [carpeta_logs] [repeticiones]
+"""
+import json
+import sys
+import time
+from pathlib import Path
+
+from escaner_json import spans_json
+
+
+def escaneo_cuadratico(respuesta: str) -> list:
+    """Implementación anterior: un escaneo balanceado que arranca en cada '{'"""
+    candidatos = []
+    for i, char in enumerate(respuesta):
+        if char != '{':
+            continue
+        nivel = 0
+        en_string = False
+        escape = False
+        for j in range(i, len(respuesta)):
+            c = respuesta[j]
+            if escape:
+                escape = False
+                continue
+            if c == '\\':
+                escape = True
+                continue
+            if c == '"':
+                en_string = not en_string
+                continue
+            if not en_string:
+                if c == '{':
+                    nivel += 1
+                elif c == '}':
+                    nivel -= 1
+                    if nivel == 0:
+                        candidatos.append((i, j + 1))
+                        break
+    return candidatos
+
+
+def respuestas_registradas(carpeta: Path) -> list:
+    """Texto de 'respuesta_modelo' de cada log JSON de generación"""
+    respuestas = []
+    for archivo in sorted(carpeta.glob("**/*.json")):
+        try:
+            datos = json.loads(archivo.read_text(encoding='utf-8'))
+        except (OSError, ValueError):
+            continue
+        texto = datos.get('respuesta_modelo') if isinstance(datos, dict) else None
+        if isinstance(texto, str) and texto.strip():
+            respuestas.append((archivo.name, texto))
+    return respuestas
+
+
+def respuestas_sinteticas() -> list:
+    """Razonamiento largo con llaves seguido del JSON final, de varios tamaños. En las
+    variantes 'sin_cerrar' el razonamiento deja llaves abiertas y el JSON queda cortado por
+    max_tokens: cada una de esas llaves hacía recorrer el resto de la respuesta"""
+    pregunta = {
+        "tipo": "mcq",
+        "pregunta": "¿Cuál es la función principal de los cloroplastos según el texto?",
+        "opciones": ["A) Fotosíntesis", "B) Respiración", "C) Digestión", "D) Transporte"],
+        "respuesta_correcta": "A",
+        "puntos": 3
+    }
+    razonamiento = ("<think>Primero reviso el contenido. El formato pide {\"tipo\": ...} para cada "
+                    "pregunta y la lista va en {preguntas}. Debo cubrir {fase luminosa} y {ciclo de Calvin}. ")
+    respuestas = []
+    for n in (10, 40, 160):
+        texto = razonamiento * n + "</think>\n" + json.dumps({"preguntas": [pregunta] * (n // 4)}, ensure_ascii=False)
+        respuestas.append((f"sintetica_{len(texto)}_chars", texto))
+        sin_cerrar = ((razonamiento + "Si abro { tengo que cerrarla al final. ") * n + "</think>\n"
+                      + json.dumps({"preguntas": [pregunta] * (n // 4)}, ensure_ascii=False)[:-40])
+        respuestas.append((f"sintetica_sin_cerrar_{len(sin_cerrar)}_chars", sin_cerrar))
+    return respuestas
+
+
+def medir(funcion, texto: str, repeticiones: int) -> float:
+    inicio = time.perf_counter()
+    for _ in range(repeticiones):
+        funcion(texto)
+    return (time.perf_counter() - inicio) / repeticiones
+
+
+def main():
+    carpeta = Path(sys.argv[1]) if len(sys.argv) > 1 else Path("logs_practicas_detallado")
+    repeticiones = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+
+    print("\n" + "="*70)
+    print("⚡ BENCHMARK: búsqueda de candidatos JSON")
+    print("="*70)
+
+    respuestas = respuestas_registradas(carpeta) if carpeta.exists() else []
+    if respuestas:
+        print(f"📂 {len(respuestas)} respuestas registradas en {carpeta}")
+    else:
+        print(f"⚠️ Sin respuestas registradas en {carpeta}: se usan respuestas sintéticas")
+        respuestas = respuestas_sinteticas()
+
+    total_antes = total_ahora = 0.0
+    diferencias = 0
+    print(f"\n{'respuesta':<40}{'chars':>9}{'antes (ms)':>13}{'ahora (ms)':>13}{'x':>8}")
+    for nombre, texto in respuestas:
+        antes = medir(escaneo_cuadratico, texto, repeticiones)
+        ahora = medir(spans_json, texto, repeticiones)
+        total_antes += antes
+        total_ahora += ahora
+        # Los candidatos que usa _extraer_preguntas (> 50 caracteres) deben coincidir
+        viejos = {s for s in escaneo_cuadratico(texto) if s[1] - s[0] > 50}
+        nuevos = {s for s in spans_json(texto) if s[1] - s[0] > 50}
+        if viejos != nuevos:
+            diferencias += 1
+        print(f"{nombre[:38]:<40}{len(texto):>9}{antes * 1000:>13.2f}{ahora * 1000:>13.2f}"
+              f"{antes / ahora if ahora else 0:>8.1f}")
+
+    print("-"*70)
+    print(f"⏱️  Total: {total_antes * 1000:.1f} ms → {total_ahora * 1000:.1f} ms "
+          f"({total_antes / total_ahora if total_ahora else 0:.1f}x)")
+    if diferencias:
+        # El escaneo anterior también arrancaba en llaves dentro de strings y en texto libre
+        print(f"ℹ️  {diferencias} respuesta(s) con candidatos distintos (llaves dentro de strings o texto libre)")
+    else:
+        print("✅ Mismos candidatos en todas las respuestas")
+    print("="*70)
+
+
+if __name__ == "__main__":
+    main()
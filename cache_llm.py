@@ -0,0 +1,241 @@
+"""
+Caché persistente de respuestas del modelo
+- CacheLLM: dos niveles, LRU en memoria + archivos JSON en disco con expulsión por tamaño
+- La clave es un hash del contenido (modelo/digest, prompt completo, opciones de muestreo)
+- Instancias separadas para generación y para evaluación de respuestas
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+
+DIRECTORIO_CACHE = Path("cache_llm")
+
+# Límites por defecto
+MAX_ENTRADAS_MEMORIA = 128
+MAX_BYTES_DISCO = 200 * 1024 * 1024  # 200 MB
+
+# Las evaluaciones son pequeñas: más entradas en memoria, menos disco
+MAX_ENTRADAS_EVALUACIONES = 1024
+MAX_BYTES_EVALUACIONES = 50 * 1024 * 1024  # 50 MB
+
+
+def hash_clave(clave: dict) -> str:
+    """SHA-256 estable de un dict serializable (orden de claves normalizado)"""
+    texto = json.dumps(clave, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(texto.encode('utf-8')).hexdigest()
+
+
+def normalizar_texto(texto) -> str:
+    """Forma canónica de una respuesta: sin acentos, en minúsculas y con espacios colapsados"""
+    if texto is None:
+        return ""
+    texto = unicodedata.normalize('NFKD', str(texto))
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    return re.sub(r'\s+', ' ', texto.casefold()).strip()
+
+
+def digest_archivo(ruta: str) -> str:
+    """Identidad barata de un modelo GGUF: ruta, tamaño y fecha de modificación"""
+    try:
+        st = os.stat(ruta)
+        return f"{Path(ruta).name}:{st.st_size}:{int(st.st_mtime)}"
+    except OSError:
+        return str(ruta)
+
+
+class CacheLLM:
+    """Caché clave→valor (JSON) con nivel en memoria y nivel en disco
+
+    - Memoria: OrderedDict con las entradas usadas más recientemente
+    - Disco: un archivo por entrada en <directorio>/<hash[:2]>/<hash>.json; al superar
+      max_bytes se borran las entradas con acceso más antiguo
+    """
+
+    def __init__(self, directorio: Path = DIRECTORIO_CACHE,
+                 max_entradas_memoria: int = MAX_ENTRADAS_MEMORIA,
+                 max_bytes_disco: int = MAX_BYTES_DISCO):
+        self.directorio = Path(directorio)
+        self.max_entradas_memoria = max_entradas_memoria
+        self.max_bytes_disco = max_bytes_disco
+        self._memoria: "OrderedDict[str, Any]" = OrderedDict()
+        self._indice_disco: Optional[Dict[str, list]] = None  # hash -> [bytes, último acceso]
+        self._bytes_disco = 0
+        self._lock = threading.Lock()
+        self.estadisticas_uso = {
+            'aciertos_memoria': 0,
+            'aciertos_disco': 0,
+            'fallos': 0,
+            'guardados': 0,
+            'expulsados_disco': 0
+        }
+
+    # ------------------------------------------------------------------ disco
+
+    def _ruta(self, h: str) -> Path:
+        return self.directorio / h[:2] / f"{h}.json"
+
+    def _cargar_indice(self):
+        """Recorre el directorio una sola vez para conocer tamaño y antigüedad de cada entrada"""
+        if self._indice_disco is not None:
+            return
+        self._indice_disco = {}
+        self._bytes_disco = 0
+        if not self.directorio.exists():
+            return
+        for archivo in self.directorio.glob("*/*.json"):
+            try:
+                st = archivo.stat()
+            except OSError:
+                continue
+            self._indice_disco[archivo.stem] = [st.st_size, st.st_mtime]
+            self._bytes_disco += st.st_size
+
+    def _expulsar_disco(self):
+        """Borra las entradas menos usadas hasta quedar por debajo del 90% del límite"""
+        if self._bytes_disco <= self.max_bytes_disco:
+            return
+        objetivo = int(self.max_bytes_disco * 0.9)
+        for h, (tam, _) in sorted(self._indice_disco.items(), key=lambda kv: kv[1][1]):
+            if self._bytes_disco <= objetivo:
+                break
+            try:
+                self._ruta(h).unlink()
+            except OSError:
+                pass
+            del self._indice_disco[h]
+            self._bytes_disco -= tam
+            self.estadisticas_uso['expulsados_disco'] += 1
+
+    # ---------------------------------------------------------------- memoria
+
+    def _recordar(self, h: str, valor: Any):
+        self._memoria[h] = valor
+        self._memoria.move_to_end(h)
+        while len(self._memoria) > self.max_entradas_memoria:
+            self._memoria.popitem(last=False)
+
+    # ------------------------------------------------------------------- API
+
+    def obtener(self, clave: dict) -> Optional[Any]:
+        """Retorna el valor guardado para la clave o None"""
+        h = hash_clave(clave)
+        with self._lock:
+            if h in self._memoria:
+                self._memoria.move_to_end(h)
+                self.estadisticas_uso['aciertos_memoria'] += 1
+                return self._memoria[h]
+
+            self._cargar_indice()
+            if h in self._indice_disco:
+                ruta = self._ruta(h)
+                try:
+                    with open(ruta, 'r', encoding='utf-8') as f:
+                        valor = json.load(f)['valor']
+                    ahora = time.time()
+                    os.utime(ruta, (ahora, ahora))
+                    self._indice_disco[h][1] = ahora
+                    self._recordar(h, valor)
+                    self.estadisticas_uso['aciertos_disco'] += 1
+                    return valor
+                except (OSError, ValueError, KeyError):
+                    # Entrada corrupta o borrada a mano
+                    self._bytes_disco -= self._indice_disco.pop(h)[0]
+
+            self.estadisticas_uso['fallos'] += 1
+            return None
+
+    def guardar(self, clave: dict, valor: Any):
+        """Guarda el valor en memoria y en disco"""
+        h = hash_clave(clave)
+        contenido = json.dumps({
+            'clave': clave,
+            'valor': valor,
+            'creado': time.time()
+        }, ensure_ascii=False, default=str)
+
+        with self._lock:
+            self._recordar(h, valor)
+            self._cargar_indice()
+            ruta = self._ruta(h)
+            try:
+                ruta.parent.mkdir(parents=True, exist_ok=True)
+                temporal = ruta.with_suffix('.tmp')
+                with open(temporal, 'w', encoding='utf-8') as f:
+                    f.write(contenido)
+                os.replace(temporal, ruta)
+            except OSError as e:
+                print(f"⚠️ No se pudo escribir en caché: {e}")
+                return
+
+            tam = len(contenido.encode('utf-8'))
+            anterior = self._indice_disco.get(h)
+            if anterior:
+                self._bytes_disco -= anterior[0]
+            self._indice_disco[h] = [tam, time.time()]
+            self._bytes_disco += tam
+            self.estadisticas_uso['guardados'] += 1
+            self._expulsar_disco()
+
+    def limpiar(self):
+        """Vacía ambos niveles"""
+        with self._lock:
+            self._memoria.clear()
+            self._cargar_indice()
+            for h in list(self._indice_disco):
+                try:
+                    self._ruta(h).unlink()
+                except OSError:
+                    pass
+            self._indice_disco = {}
+            self._bytes_disco = 0
+
+    def estadisticas(self) -> dict:
+        with self._lock:
+            self._cargar_indice()
+            uso = dict(self.estadisticas_uso)
+            aciertos = uso['aciertos_memoria'] + uso['aciertos_disco']
+            consultas = aciertos + uso['fallos']
+            return {
+                **uso,
+                'tasa_aciertos': round(aciertos / consultas, 3) if consultas else 0.0,
+                'entradas_memoria': len(self._memoria),
+                'entradas_disco': len(self._indice_disco),
+                'bytes_disco': self._bytes_disco,
+                'max_bytes_disco': self.max_bytes_disco
+            }
+
+
+# Instancias compartidas por proceso
+_cache_respuestas: Optional[CacheLLM] = None
+_cache_evaluaciones: Optional[CacheLLM] = None
+_lock_instancias = threading.Lock()
+
+
+def obtener_cache_respuestas() -> CacheLLM:
+    """Caché de respuestas de generación (exámenes y prácticas)"""
+    global _cache_respuestas
+    with _lock_instancias:
+        if _cache_respuestas is None:
+            _cache_respuestas = CacheLLM(DIRECTORIO_CACHE / "respuestas")
+        return _cache_respuestas
+
+
+def obtener_cache_evaluaciones() -> CacheLLM:
+    """Caché de evaluaciones con IA (respuestas abiertas y flashcards)"""
+    global _cache_evaluaciones
+    with _lock_instancias:
+        if _cache_evaluaciones is None:
+            _cache_evaluaciones = CacheLLM(
+                DIRECTORIO_CACHE / "evaluaciones",
+                max_entradas_memoria=MAX_ENTRADAS_EVALUACIONES,
+                max_bytes_disco=MAX_BYTES_EVALUACIONES
+            )
+        return _cache_evaluaciones
@@ -0,0 +1,204 @@
+"""
+Casos de estudio en dos fases
+- Fase 1: un escenario (titulo, contexto, descripcion) por caso, generado una sola vez por
+  (contenido, tipo_caso, caso) y guardado en la caché de respuestas; pedir preguntas
+  nuevas para el mismo contenido reutiliza el escenario, nunca lo reescribe
+- Fase 2: sobre el escenario, la pregunta (con su respuesta esperada) y cada campo de
+  análisis del subtipo (puntos_clave, restricciones, stakeholders...) se generan en
+  llamadas cortas y a la vez, cada una restringida a su propio esquema
+- Los campos de cada subtipo y lo que debe contener cada uno salen del formato de
+  GeneradorUnificado._obtener_prompt_caso_estudio
+"""
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from typing import Dict, List, Optional
+
+from cache_llm import obtener_cache_respuestas, hash_clave
+from generador_examenes import PreguntaExamen
+from particion_contenido import dividir_en_partes
+from prefijos_kv import registrar_prefijo
+
+
+CAMPOS_ESCENARIO = ('titulo', 'contexto', 'descripcion')
+CAMPOS_FIJOS = ('tipo', 'subtipo', 'puntos')
+CAMPOS_PREGUNTA = ('pregunta', 'respuesta_esperada')
+
+AJUSTES_ESCENARIO = {'temperature': 0.6, 'max_tokens': 1200, 'top_p': 0.9, 'repeat_penalty': 1.15}
+AJUSTES_CAMPO = {'temperature': 0.4, 'max_tokens': 700, 'top_p': 0.9, 'repeat_penalty': 1.15}
+
+INSTRUCCIONES_ESCENARIO = """Eres un experto en crear casos de estudio educativos. Escribe SOLO el escenario de un caso de estudio basado en el contenido proporcionado al final: un título, el contexto y la descripción, con datos concretos (fechas, personas, cifras) coherentes con el contenido.
+Responde SOLO con un objeto JSON con los campos indicados, sin texto adicional.
+"""
+
+INSTRUCCIONES_CAMPO = """Eres un experto en crear casos de estudio educativos. Recibes el escenario ya escrito de un caso de estudio y completas SOLO los campos que se piden al final, coherentes con ese escenario (no lo reescribas ni inventes otro).
+Responde SOLO con un objeto JSON con los campos indicados, sin texto adicional.
+"""
+
+
+def _esquema_valor(ejemplo) -> dict:
+    """Esquema JSON de un campo según el valor de ejemplo del formato"""
+    if isinstance(ejemplo, bool):
+        return {"type": "boolean"}
+    if isinstance(ejemplo, int):
+        return {"type": "integer"}
+    if isinstance(ejemplo, list):
+        return {"type": "array", "items": {"type": "string", "minLength": 1},
+                "minItems": min(3, len(ejemplo)) or 1}
+    if isinstance(ejemplo, dict):
+        return {"type": "object", "properties": {k: _esquema_valor(v) for k, v in ejemplo.items()},
+                "required": list(ejemplo)}
+    return {"type": "string", "minLength": 1}
+
+
+def _esquema_campos(formato: dict, campos) -> dict:
+    return {"type": "object", "properties": {c: _esquema_valor(formato[c]) for c in campos},
+            "required": list(campos)}
+
+
+class MotorCasosEstudio:
+    """Casos de estudio de un GeneradorUnificado en dos fases (escenario y campos)"""
+
+    def __init__(self, generador):
+        self.generador = generador
+        self._locks: Dict[str, list] = {}  # clave → [lock, peticiones que lo usan]
+        self._lock = threading.Lock()
+
+    def formato(self, tipo_caso: str) -> dict:
+        """Campos del subtipo con la descripción de lo que debe contener cada uno"""
+        return json.loads(self.generador._obtener_prompt_caso_estudio(tipo_caso))
+
+    @contextmanager
+    def _lock_escenario(self, clave: str):
+        """Lock por clave; la entrada se borra al salir la última petición que la usa
+        (para entonces el escenario ya está en la caché o no se pudo generar)"""
+        with self._lock:
+            entrada = self._locks.setdefault(clave, [threading.Lock(), 0])
+            entrada[1] += 1
+        try:
+            with entrada[0]:
+                yield
+        finally:
+            with self._lock:
+                entrada[1] -= 1
+                if not entrada[1]:
+                    del self._locks[clave]
+
+    def _clave_escenario(self, contenido: str, tipo_caso: str, caso: int) -> dict:
+        g = self.generador
+        return {
+            'motor': 'escenario_caso',
+            'modelo': g.modelo_ollama if g.usar_ollama else g.modelo_path_gguf,
+            'digest': g._digest_modelo(),
+            'contenido': hash_clave({'contenido': contenido}),
+            'tipo_caso': tipo_caso,
+            'caso': caso
+        }
+
+    def escenario(self, contenido: str, tipo_caso: str, caso: int = 0, turno=None) -> Optional[dict]:
+        """Fase 1: titulo, contexto y descripcion del caso (de la caché si ya se generó)"""
+        clave = self._clave_escenario(contenido, tipo_caso, caso)
+        cache = obtener_cache_respuestas()
+        # Dos peticiones simultáneas del mismo escenario lo generan una sola vez
+        with self._lock_escenario(hash_clave(clave)):
+            guardado = cache.obtener(clave)
+            if isinstance(guardado, dict):
+                print(f"♻️ Escenario del caso {caso + 1} ({tipo_caso}) reutilizado: {guardado.get('titulo', '')[:60]}")
+                return guardado
+
+            formato = self.formato(tipo_caso)
+            pedido = {c: formato[c] for c in CAMPOS_ESCENARIO}
+            prompt = registrar_prefijo(INSTRUCCIONES_ESCENARIO) + f"""
+CAMPOS (tipo de caso: {tipo_caso}):
+{json.dumps(pedido, ensure_ascii=False, indent=2)}
+
+CONTENIDO:
+{contenido}
+
+ESCENARIO EN JSON:"""
+            with (turno or nullcontext)():
+                datos = self.generador.generar_json(prompt, _esquema_campos(formato, CAMPOS_ESCENARIO),
+                                                    AJUSTES_ESCENARIO, usar_cache=False)
+            if not datos or not all(isinstance(datos.get(c), str) and datos[c].strip() for c in CAMPOS_ESCENARIO):
+                print(f"⚠️ El escenario del caso {caso + 1} ({tipo_caso}) no se pudo generar")
+                return None
+            escenario = {c: datos[c].strip() for c in CAMPOS_ESCENARIO}
+            cache.guardar(clave, escenario)
+            print(f"🎬 Escenario del caso {caso + 1} ({tipo_caso}): {escenario['titulo'][:60]}")
+            return escenario
+
+    def _campos(self, escenario: dict, formato: dict, tipo_caso: str, campos: tuple,
+                turno=None, usar_cache: bool = True) -> dict:
+        """Fase 2: los campos pedidos, generados sobre el escenario"""
+        pedido = {c: formato[c] for c in campos}
+        prompt = registrar_prefijo(INSTRUCCIONES_CAMPO) + f"""
+ESCENARIO (caso {tipo_caso}):
+Título: {escenario['titulo']}
+Contexto: {escenario['contexto']}
+Descripción: {escenario['descripcion']}
+
+CAMPOS A COMPLETAR:
+{json.dumps(pedido, ensure_ascii=False, indent=2)}
+
+CAMPOS EN JSON:"""
+        with (turno or nullcontext)():
+            datos = self.generador.generar_json(prompt, _esquema_campos(formato, campos), AJUSTES_CAMPO,
+                                                usar_cache=usar_cache)
+        return {c: datos[c] for c in campos if datos and datos.get(c) not in (None, "", [], {})}
+
+    def generar_caso(self, contenido: str, tipo_caso: str, caso: int = 0, turno=None,
+                     usar_cache: bool = True) -> Optional[PreguntaExamen]:
+        """Un caso completo: escenario (fase 1) y luego todos sus campos a la vez (fase 2)"""
+        escenario = self.escenario(contenido, tipo_caso, caso, turno)
+        if escenario is None:
+            return None
+        formato = self.formato(tipo_caso)
+        # La respuesta esperada depende de la pregunta: van juntas; cada campo de análisis, aparte
+        grupos = [CAMPOS_PREGUNTA] + [(c,) for c in formato
+                                      if c not in CAMPOS_ESCENARIO + CAMPOS_FIJOS + CAMPOS_PREGUNTA]
+        with ThreadPoolExecutor(max_workers=len(grupos), thread_name_prefix="campo-caso") as pool:
+            partes = list(pool.map(
+                lambda campos: self._campos(escenario, formato, tipo_caso, campos, turno, usar_cache), grupos))
+
+        caso_dict = {'tipo': 'case_study', 'subtipo': formato.get('subtipo', tipo_caso), **escenario,
+                     'puntos': formato.get('puntos', 10)}
+        for parte in partes:
+            caso_dict.update(parte)
+        if not caso_dict.get('pregunta'):
+            print(f"⚠️ El caso {caso + 1} ({tipo_caso}) quedó sin pregunta")
+            return None
+        faltan = [c for c in formato if c not in caso_dict]
+        if faltan:
+            print(f"⚠️ Caso {caso + 1}: campos sin generar {faltan}")
+        pregunta = PreguntaExamen.from_dict(caso_dict)
+        pregunta.respuesta_correcta = pregunta.respuesta_correcta or caso_dict.get('respuesta_esperada', '')
+        return pregunta
+
+    def generar(self, contenido: str, num_casos: int, tipo_caso: str = None, max_tokens_contenido: int = None,
+                turno=None, usar_cache: bool = True, callback_pregunta=None) -> List[PreguntaExamen]:
+        """num_casos casos a la vez, cada uno sobre su propia parte del contenido
+
+        max_tokens_contenido: lo que cabe del contenido en el prompt del escenario. El
+        contenido se divide en partes (una por caso si alcanza) y el caso i usa la parte i.
+        """
+        tipo_caso = tipo_caso or 'descriptivo'
+        contador = self.generador.contador_tokens()
+        tokens = contador.contar(contenido)
+        limite = min(max_tokens_contenido or tokens, tokens // max(1, num_casos) + 1)
+        partes = dividir_en_partes(contenido, max(1, limite), contador) or [contenido]
+
+        def generar(caso: int):
+            try:
+                pregunta = self.generar_caso(partes[caso % len(partes)], tipo_caso, caso, turno, usar_cache)
+            except Exception as e:
+                print(f"⚠️ Caso de estudio {caso + 1}/{num_casos} falló: {e}")
+                return None
+            if pregunta is not None and callback_pregunta:
+                callback_pregunta(pregunta)
+            return pregunta
+
+        print(f"🎬 {num_casos} caso(s) de estudio ({tipo_caso}) en dos fases: escenario y campos en paralelo")
+        with ThreadPoolExecutor(max_workers=max(1, num_casos), thread_name_prefix="caso-estudio") as pool:
+            casos = list(pool.map(generar, range(num_casos)))
+        return [c for c in casos if c is not None]
@@ -0,0 +1,705 @@
+"""
+Cliente HTTP compartido para Ollama
+- ClienteOllama: asíncrono, un único pool de conexiones keep-alive por servidor Ollama
+- ClienteOllamaSync: fachada síncrona (mismo API) para herramientas de consola y código en hilos
+- BalanceadorOllama: varios servidores Ollama (OLLAMA_ENDPOINTS o config.json); cada petición
+  va al nodo sano con menos peticiones en curso que tenga el modelo descargado, y si el nodo
+  cae durante la petición se reintenta en otro
+"""
+import asyncio
+import itertools
+import json
+import os
+import threading
+import time
+from typing import AsyncIterator, Awaitable, Callable, Iterator, List, Dict, Optional, Set
+
+import httpx
+
+
+OLLAMA_URL = "http://localhost:11434"
+
+# Lista de servidores separada por comas, p. ej. "http://gpu1:11434,http://gpu2:11434"
+ENDPOINTS_POR_DEFECTO = [u.strip() for u in os.environ.get("OLLAMA_ENDPOINTS", OLLAMA_URL).split(",")
+                         if u.strip()]
+
+INTERVALO_SONDEO_NODOS = 15.0  # cada cuánto se refresca la lista de modelos de cada nodo
+ESPERA_TRAS_FALLO = 10.0       # segundos que un nodo caído queda fuera del reparto
+
+# Errores que indican que el nodo (no la petición) falló: se reintenta en otro nodo.
+# Un ReadTimeout no está incluido: la generación puede ser lenta sin que el nodo haya caído
+ERRORES_DE_NODO = (httpx.ConnectError, httpx.ConnectTimeout, httpx.ReadError,
+                   httpx.WriteError, httpx.RemoteProtocolError)
+
+# Timeouts por defecto (segundos)
+TIMEOUT_CONEXION = 5.0
+TIMEOUT_SONDEO = 2.0
+TIMEOUT_GENERACION = 600.0
+
+# Tamaño del pool de conexiones
+MAX_CONEXIONES = 20
+MAX_CONEXIONES_KEEPALIVE = 10
+KEEPALIVE_SEGUNDOS = 120.0
+
+
+class ErrorOllama(Exception):
+    """Ollama respondió con un código distinto de 200"""
+
+    def __init__(self, status_code: int, detalle: str = ""):
+        self.status_code = status_code
+        self.detalle = detalle or "Sin detalles"
+        super().__init__(f"Ollama respondió {status_code}: {self.detalle[:500]}")
+
+
+def _sin_nodos(modelo: Optional[str], ultimo_error: Optional[Exception]) -> Exception:
+    """Error a lanzar cuando no queda nodo que elegir: el último fallo de nodo, si lo hubo"""
+    return ultimo_error or ErrorOllama(503, f"No hay nodos Ollama disponibles para {modelo or 'la petición'}")
+
+
+def _timeout(segundos: float) -> httpx.Timeout:
+    """Timeout por llamada: conexión corta, lectura según el tipo de petición"""
+    return httpx.Timeout(segundos, connect=min(TIMEOUT_CONEXION, segundos))
+
+
+def _limites() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=MAX_CONEXIONES,
+        max_keepalive_connections=MAX_CONEXIONES_KEEPALIVE,
+        keepalive_expiry=KEEPALIVE_SEGUNDOS
+    )
+
+
+def _payload(modelo: str, opciones: dict = None, **extra) -> dict:
+    """Construye el cuerpo común de /api/generate y /api/chat (sin streaming)"""
+    payload = {"model": modelo, "stream": False}
+    if opciones:
+        payload["options"] = opciones
+    payload.update({k: v for k, v in extra.items() if v is not None})
+    return payload
+
+
+def _leer_json(response: httpx.Response) -> dict:
+    if response.status_code != 200:
+        raise ErrorOllama(response.status_code, response.text)
+    return response.json()
+
+
+class ClienteOllama:
+    """Cliente asíncrono de Ollama con pool de conexiones keep-alive
+
+    Todas las llamadas aceptan un timeout propio. Cancelar la tarea que espera
+    (por ejemplo, cuando el cliente HTTP se desconecta) cierra la conexión y
+    Ollama aborta la generación en curso.
+    """
+
+    def __init__(self, base_url: str = OLLAMA_URL):
+        self.base_url = base_url.rstrip('/')
+        self._cliente: Optional[httpx.AsyncClient] = None
+
+    def _http(self) -> httpx.AsyncClient:
+        if self._cliente is None or self._cliente.is_closed:
+            self._cliente = httpx.AsyncClient(
+                base_url=self.base_url,
+                limits=_limites(),
+                timeout=_timeout(TIMEOUT_GENERACION)
+            )
+        return self._cliente
+
+    async def cerrar(self):
+        """Cierra el pool de conexiones"""
+        if self._cliente is not None and not self._cliente.is_closed:
+            await self._cliente.aclose()
+        self._cliente = None
+
+    async def _post(self, ruta: str, payload: dict, timeout: float) -> dict:
+        response = await self._http().post(ruta, json=payload, timeout=_timeout(timeout))
+        return _leer_json(response)
+
+    async def generar(self, modelo: str, prompt: str, opciones: dict = None,
+                      timeout: float = TIMEOUT_GENERACION, **extra) -> dict:
+        """POST /api/generate (sin streaming). Retorna el JSON completo de Ollama"""
+        payload = _payload(modelo, opciones, prompt=prompt, **extra)
+        return await self._post("/api/generate", payload, timeout)
+
+    async def chat(self, modelo: str, messages: List[Dict], opciones: dict = None,
+                   timeout: float = TIMEOUT_GENERACION, **extra) -> dict:
+        """POST /api/chat (sin streaming). Retorna el JSON completo de Ollama"""
+        payload = _payload(modelo, opciones, messages=messages, **extra)
+        return await self._post("/api/chat", payload, timeout)
+
+    async def _stream(self, ruta: str, payload: dict, timeout: float) -> AsyncIterator[dict]:
+        payload = dict(payload, stream=True)
+        async with self._http().stream("POST", ruta, json=payload, timeout=_timeout(timeout)) as response:
+            if response.status_code != 200:
+                await response.aread()
+                raise ErrorOllama(response.status_code, response.text)
+            async for linea in response.aiter_lines():
+                if linea.strip():
+                    yield json.loads(linea)
+
+    def generar_stream(self, modelo: str, prompt: str, opciones: dict = None,
+                       timeout: float = TIMEOUT_GENERACION, **extra) -> AsyncIterator[dict]:
+        """POST /api/generate con streaming: produce cada fragmento NDJSON de Ollama.
+        El timeout aplica entre fragmentos; cerrar el iterador corta la generación"""
+        payload = _payload(modelo, opciones, prompt=prompt, **extra)
+        return self._stream("/api/generate", payload, timeout)
+
+    def chat_stream(self, modelo: str, messages: List[Dict], opciones: dict = None,
+                    timeout: float = TIMEOUT_GENERACION, **extra) -> AsyncIterator[dict]:
+        """POST /api/chat con streaming: produce cada fragmento NDJSON de Ollama.
+        El timeout aplica entre fragmentos; cerrar el iterador corta la generación"""
+        payload = _payload(modelo, opciones, messages=messages, **extra)
+        return self._stream("/api/chat", payload, timeout)
+
+    async def tags(self, timeout: float = TIMEOUT_SONDEO) -> List[Dict]:
+        """GET /api/tags: lista de modelos instalados"""
+        response = await self._http().get("/api/tags", timeout=_timeout(timeout))
+        return _leer_json(response).get('models', [])
+
+    async def ps(self, timeout: float = TIMEOUT_SONDEO) -> List[Dict]:
+        """GET /api/ps: modelos cargados en memoria"""
+        response = await self._http().get("/api/ps", timeout=_timeout(timeout))
+        return _leer_json(response).get('models', [])
+
+    async def show(self, modelo: str, timeout: float = TIMEOUT_SONDEO) -> dict:
+        """POST /api/show: parámetros del Modelfile e información del modelo"""
+        return await self._post("/api/show", {"model": modelo}, timeout)
+
+    async def disponible(self, timeout: float = TIMEOUT_SONDEO) -> bool:
+        """Sondeo rápido: True si Ollama responde a /api/tags"""
+        try:
+            await self.tags(timeout=timeout)
+            return True
+        except Exception:
+            return False
+
+    async def eliminar_modelo(self, nombre: str, timeout: float = 10) -> None:
+        """DELETE /api/delete"""
+        response = await self._http().request(
+            "DELETE", "/api/delete", json={"name": nombre}, timeout=_timeout(timeout)
+        )
+        if response.status_code != 200:
+            raise ErrorOllama(response.status_code, response.text)
+
+
+class ClienteOllamaSync:
+    """Fachada síncrona de ClienteOllama para CLI y código que corre en hilos"""
+
+    def __init__(self, base_url: str = OLLAMA_URL):
+        self.base_url = base_url.rstrip('/')
+        self._cliente: Optional[httpx.Client] = None
+        self._lock = threading.Lock()
+
+    def _http(self) -> httpx.Client:
+        with self._lock:
+            if self._cliente is None or self._cliente.is_closed:
+                self._cliente = httpx.Client(
+                    base_url=self.base_url,
+                    limits=_limites(),
+                    timeout=_timeout(TIMEOUT_GENERACION)
+                )
+            return self._cliente
+
+    def cerrar(self):
+        """Cierra el pool de conexiones"""
+        with self._lock:
+            if self._cliente is not None and not self._cliente.is_closed:
+                self._cliente.close()
+            self._cliente = None
+
+    def _post(self, ruta: str, payload: dict, timeout: float) -> dict:
+        response = self._http().post(ruta, json=payload, timeout=_timeout(timeout))
+        return _leer_json(response)
+
+    def generar(self, modelo: str, prompt: str, opciones: dict = None,
+                timeout: float = TIMEOUT_GENERACION, **extra) -> dict:
+        """POST /api/generate (sin streaming). Retorna el JSON completo de Ollama"""
+        payload = _payload(modelo, opciones, prompt=prompt, **extra)
+        return self._post("/api/generate", payload, timeout)
+
+    def chat(self, modelo: str, messages: List[Dict], opciones: dict = None,
+             timeout: float = TIMEOUT_GENERACION, **extra) -> dict:
+        """POST /api/chat (sin streaming). Retorna el JSON completo de Ollama"""
+        payload = _payload(modelo, opciones, messages=messages, **extra)
+        return self._post("/api/chat", payload, timeout)
+
+    def _stream(self, ruta: str, payload: dict, timeout: float) -> Iterator[dict]:
+        payload = dict(payload, stream=True)
+        with self._http().stream("POST", ruta, json=payload, timeout=_timeout(timeout)) as response:
+            if response.status_code != 200:
+                response.read()
+                raise ErrorOllama(response.status_code, response.text)
+            for linea in response.iter_lines():
+                if linea.strip():
+                    yield json.loads(linea)
+
+    def generar_stream(self, modelo: str, prompt: str, opciones: dict = None,
+                       timeout: float = TIMEOUT_GENERACION, **extra) -> Iterator[dict]:
+        """POST /api/generate con streaming: produce cada fragmento NDJSON de Ollama"""
+        payload = _payload(modelo, opciones, prompt=prompt, **extra)
+        return self._stream("/api/generate", payload, timeout)
+
+    def chat_stream(self, modelo: str, messages: List[Dict], opciones: dict = None,
+                    timeout: float = TIMEOUT_GENERACION, **extra) -> Iterator[dict]:
+        """POST /api/chat con streaming: produce cada fragmento NDJSON de Ollama"""
+        payload = _payload(modelo, opciones, messages=messages, **extra)
+        return self._stream("/api/chat", payload, timeout)
+
+    def tags(self, timeout: float = TIMEOUT_SONDEO) -> List[Dict]:
+        """GET /api/tags: lista de modelos instalados"""
+        response = self._http().get("/api/tags", timeout=_timeout(timeout))
+        return _leer_json(response).get('models', [])
+
+    def show(self, modelo: str, timeout: float = TIMEOUT_SONDEO) -> dict:
+        """POST /api/show: parámetros del Modelfile e información del modelo"""
+        return self._post("/api/show", {"model": modelo}, timeout)
+
+    def disponible(self, timeout: float = TIMEOUT_SONDEO) -> bool:
+        """Sondeo rápido: True si Ollama responde a /api/tags"""
+        try:
+            self.tags(timeout=timeout)
+            return True
+        except Exception:
+            return False
+
+
+def _nombre_modelo(nombre: str) -> str:
+    """Ollama trata "modelo" y "modelo:latest" como el mismo"""
+    return nombre if ':' in nombre else f"{nombre}:latest"
+
+
+def _es_fallo_de_nodo(error: Exception) -> bool:
+    if isinstance(error, ERRORES_DE_NODO):
+        return True
+    # 404: el nodo no tiene el modelo; 5xx: el nodo no pudo atender (p. ej. sin memoria)
+    return isinstance(error, ErrorOllama) and (error.status_code == 404 or error.status_code >= 500)
+
+
+class NodoOllama:
+    """Un servidor Ollama del balanceador con sus dos clientes y su estado de salud"""
+
+    def __init__(self, url: str):
+        self.url = url.rstrip('/')
+        self.cliente = ClienteOllama(self.url)
+        self.cliente_sync = ClienteOllamaSync(self.url)
+        self.en_curso = 0
+        self.caido_hasta = 0.0
+        self.modelos: Optional[Set[str]] = None  # None = aún no se sondeó
+        self.sondeado = 0.0
+        self.peticiones = 0
+        self.fallos = 0
+        self.ultimo_error: Optional[str] = None
+
+    @property
+    def sano(self) -> bool:
+        return time.time() >= self.caido_hasta
+
+    def tiene_modelo(self, modelo: Optional[str]) -> bool:
+        return modelo is None or self.modelos is None or _nombre_modelo(modelo) in self.modelos
+
+    def estado(self) -> dict:
+        return {
+            'url': self.url,
+            'sano': self.sano,
+            'en_curso': self.en_curso,
+            'peticiones': self.peticiones,
+            'fallos': self.fallos,
+            'ultimo_error': self.ultimo_error,
+            'modelos': sorted(self.modelos) if self.modelos is not None else None
+        }
+
+
+class BalanceadorOllama:
+    """Reparte las peticiones entre varios servidores Ollama
+
+    - Menos peticiones en curso primero; a igualdad, rota entre nodos
+    - Solo nodos que tienen el modelo (según su /api/tags, refrescado cada
+      INTERVALO_SONDEO_NODOS); un 404 de modelo lo retira de ese nodo
+    - Un nodo que falla queda fuera ESPERA_TRAS_FALLO segundos y la petición se
+      reintenta en otro. Si no queda ninguno sano se intenta igualmente con todos
+    Los contadores son compartidos por la fachada asíncrona y la síncrona.
+    """
+
+    def __init__(self, urls: List[str] = None):
+        self._lock = threading.Lock()
+        self._rotacion = itertools.count()
+        self.nodos: List[NodoOllama] = [NodoOllama(u) for u in (urls or ENDPOINTS_POR_DEFECTO)]
+
+    def configurar(self, urls: List[str]) -> List[NodoOllama]:
+        """Cambia la lista de servidores; conserva los nodos existentes y retorna los retirados"""
+        urls = [u.rstrip('/') for u in urls if u and u.strip()] or [OLLAMA_URL]
+        with self._lock:
+            actuales = {n.url: n for n in self.nodos}
+            self.nodos = [actuales.pop(u, None) or NodoOllama(u) for u in dict.fromkeys(urls)]
+            return list(actuales.values())
+
+    # -------------------------------------------------------------- selección
+
+    def _elegir(self, modelo: Optional[str], excluidos: Set[str]) -> Optional[NodoOllama]:
+        with self._lock:
+            candidatos = [n for n in self.nodos if n.url not in excluidos]
+            con_modelo = [n for n in candidatos if n.tiene_modelo(modelo)] or candidatos
+            sanos = [n for n in con_modelo if n.sano]
+            if not sanos and excluidos:
+                return None  # ya se probó al menos un nodo: no insistir con los caídos
+            opciones = sanos or con_modelo
+            if not opciones:
+                return None
+            turno = next(self._rotacion)
+            nodo = min(opciones, key=lambda n: (n.en_curso, (self.nodos.index(n) - turno) % len(self.nodos)))
+            nodo.en_curso += 1
+            nodo.peticiones += 1
+            return nodo
+
+    def _terminar(self, nodo: NodoOllama, error: Exception = None, modelo: str = None):
+        with self._lock:
+            nodo.en_curso -= 1
+            if error is None or not _es_fallo_de_nodo(error):
+                return
+            nodo.fallos += 1
+            nodo.ultimo_error = f"{type(error).__name__}: {error}"[:300]
+            if isinstance(error, ErrorOllama) and error.status_code == 404:
+                if modelo and nodo.modelos is not None:
+                    nodo.modelos.discard(_nombre_modelo(modelo))
+            else:
+                nodo.caido_hasta = time.time() + ESPERA_TRAS_FALLO
+        print(f"⚠️ Nodo Ollama {nodo.url} falló: {nodo.ultimo_error}")
+
+    def _pendientes_de_sondeo(self) -> List[NodoOllama]:
+        """Nodos cuya lista de modelos caducó (con un solo nodo no hace falta sondear)"""
+        if len(self.nodos) < 2:
+            return []
+        ahora = time.time()
+        with self._lock:
+            pendientes = [n for n in self.nodos if ahora - n.sondeado >= INTERVALO_SONDEO_NODOS]
+            for nodo in pendientes:
+                nodo.sondeado = ahora
+            return pendientes
+
+    def _registrar_sondeo(self, nodo: NodoOllama, modelos: Optional[List[Dict]], error: Exception = None):
+        with self._lock:
+            if error is None:
+                nodo.modelos = {_nombre_modelo(m.get('name', '')) for m in modelos}
+                nodo.caido_hasta = 0.0
+            else:
+                nodo.caido_hasta = time.time() + ESPERA_TRAS_FALLO
+                nodo.ultimo_error = f"{type(error).__name__}: {error}"[:300]
+
+    def estado(self) -> dict:
+        with self._lock:
+            return {'nodos': [n.estado() for n in self.nodos]}
+
+
+class ClienteBalanceado:
+    """Mismo API que ClienteOllama, repartiendo entre los nodos del balanceador"""
+
+    def __init__(self, balanceador: BalanceadorOllama):
+        self.balanceador = balanceador
+        self._lock_sondeo: Optional[asyncio.Lock] = None
+        self._refrescos: Set[asyncio.Task] = set()
+
+    async def _sondear_nodos(self, nodos: List[NodoOllama]):
+        async def sondear(nodo: NodoOllama):
+            try:
+                self.balanceador._registrar_sondeo(nodo, await nodo.cliente.tags())
+            except Exception as e:
+                self.balanceador._registrar_sondeo(nodo, None, e)
+
+        await asyncio.gather(*(sondear(n) for n in nodos))
+
+    async def _sondear(self):
+        """El primer sondeo de un nodo se espera (sin él no se sabe qué modelos tiene);
+        los refrescos posteriores corren en segundo plano"""
+        if self._lock_sondeo is None:
+            self._lock_sondeo = asyncio.Lock()
+        async with self._lock_sondeo:
+            pendientes = self.balanceador._pendientes_de_sondeo()
+            nuevos = [n for n in pendientes if n.modelos is None]
+            conocidos = [n for n in pendientes if n.modelos is not None]
+            if conocidos:
+                tarea = asyncio.create_task(self._sondear_nodos(conocidos))
+                self._refrescos.add(tarea)
+                tarea.add_done_callback(self._refrescos.discard)
+            if nuevos:
+                await self._sondear_nodos(nuevos)
+
+    async def _ejecutar(self, modelo: Optional[str], operacion: Callable[[ClienteOllama], Awaitable]):
+        await self._sondear()
+        excluidos: Set[str] = set()
+        ultimo_error: Optional[Exception] = None
+        while True:
+            nodo = self.balanceador._elegir(modelo, excluidos)
+            if nodo is None:
+                raise _sin_nodos(modelo, ultimo_error)
+            try:
+                resultado = await operacion(nodo.cliente)
+            except Exception as e:
+                self.balanceador._terminar(nodo, e, modelo)
+                if not _es_fallo_de_nodo(e):
+                    raise
+                excluidos.add(nodo.url)
+                ultimo_error = e
+                continue
+            except BaseException:
+                self.balanceador._terminar(nodo)  # cancelación
+                raise
+            self.balanceador._terminar(nodo)
+            return resultado
+
+    async def _stream(self, modelo: str, abrir: Callable[[ClienteOllama], AsyncIterator[dict]]) -> AsyncIterator[dict]:
+        """Reintenta en otro nodo solo si no se emitió ningún fragmento todavía"""
+        await self._sondear()
+        excluidos: Set[str] = set()
+        ultimo_error: Optional[Exception] = None
+        while True:
+            nodo = self.balanceador._elegir(modelo, excluidos)
+            if nodo is None:
+                raise _sin_nodos(modelo, ultimo_error)
+            flujo = abrir(nodo.cliente)
+            emitidos = 0
+            error = None
+            try:
+                async for fragmento in flujo:
+                    emitidos += 1
+                    yield fragmento
+                return
+            except Exception as e:
+                error = e
+                if emitidos or not _es_fallo_de_nodo(e):
+                    raise
+                excluidos.add(nodo.url)
+                ultimo_error = e
+            finally:
+                await flujo.aclose()
+                self.balanceador._terminar(nodo, error, modelo)
+
+    async def generar(self, modelo: str, prompt: str, opciones: dict = None,
+                      timeout: float = TIMEOUT_GENERACION, **extra) -> dict:
+        return await self._ejecutar(modelo, lambda c: c.generar(modelo, prompt, opciones, timeout, **extra))
+
+    async def chat(self, modelo: str, messages: List[Dict], opciones: dict = None,
+                   timeout: float = TIMEOUT_GENERACION, **extra) -> dict:
+        return await self._ejecutar(modelo, lambda c: c.chat(modelo, messages, opciones, timeout, **extra))
+
+    def generar_stream(self, modelo: str, prompt: str, opciones: dict = None,
+                       timeout: float = TIMEOUT_GENERACION, **extra) -> AsyncIterator[dict]:
+        return self._stream(modelo, lambda c: c.generar_stream(modelo, prompt, opciones, timeout, **extra))
+
+    def chat_stream(self, modelo: str, messages: List[Dict], opciones: dict = None,
+                    timeout: float = TIMEOUT_GENERACION, **extra) -> AsyncIterator[dict]:
+        return self._stream(modelo, lambda c: c.chat_stream(modelo, messages, opciones, timeout, **extra))
+
+    async def tags(self, timeout: float = TIMEOUT_SONDEO) -> List[Dict]:
+        """Modelos instalados en al menos un nodo (falla solo si no responde ninguno)"""
+        nodos = list(self.balanceador.nodos)
+        respuestas = await asyncio.gather(*(n.cliente.tags(timeout=timeout) for n in nodos),
+                                          return_exceptions=True)
+        modelos: Dict[str, Dict] = {}
+        for nodo, respuesta in zip(nodos, respuestas):
+            if isinstance(respuesta, Exception):
+                self.balanceador._registrar_sondeo(nodo, None, respuesta)
+                continue
+            self.balanceador._registrar_sondeo(nodo, respuesta)
+            for m in respuesta:
+                modelos.setdefault(m.get('name'), m)
+        if len(modelos) == 0 and all(isinstance(r, Exception) for r in respuestas):
+            raise respuestas[0]
+        return list(modelos.values())
+
+    async def show(self, modelo: str, timeout: float = TIMEOUT_SONDEO) -> dict:
+        return await self._ejecutar(modelo, lambda c: c.show(modelo, timeout))
+
+    async def ps(self, timeout: float = TIMEOUT_SONDEO) -> List[Dict]:
+        """Modelos cargados en memoria en cualquiera de los nodos"""
+        respuestas = await asyncio.gather(*(n.cliente.ps(timeout=timeout) for n in self.balanceador.nodos),
+                                          return_exceptions=True)
+        if all(isinstance(r, Exception) for r in respuestas):
+            raise respuestas[0]
+        return [m for r in respuestas if not isinstance(r, Exception) for m in r]
+
+    async def disponible(self, timeout: float = TIMEOUT_SONDEO) -> bool:
+        """True si responde al menos un nodo"""
+        try:
+            await self.tags(timeout=timeout)
+            return True
+        except Exception:
+            return False
+
+    async def eliminar_modelo(self, nombre: str, timeout: float = 10) -> None:
+        """Elimina el modelo en todos los nodos que lo tienen"""
+        nodos = [n for n in self.balanceador.nodos if n.tiene_modelo(nombre)]
+        respuestas = await asyncio.gather(*(n.cliente.eliminar_modelo(nombre, timeout) for n in nodos),
+                                          return_exceptions=True)
+        if nodos and all(isinstance(r, Exception) for r in respuestas):
+            raise respuestas[0]
+
+    async def cerrar(self):
+        for nodo in self.balanceador.nodos:
+            await nodo.cliente.cerrar()
+
+
+class ClienteBalanceadoSync:
+    """Mismo API que ClienteOllamaSync, repartiendo entre los nodos del balanceador"""
+
+    def __init__(self, balanceador: BalanceadorOllama):
+        self.balanceador = balanceador
+        self._lock_sondeo = threading.Lock()
+
+    def _sondear(self):
+        with self._lock_sondeo:
+            for nodo in self.balanceador._pendientes_de_sondeo():
+                try:
+                    self.balanceador._registrar_sondeo(nodo, nodo.cliente_sync.tags())
+                except Exception as e:
+                    self.balanceador._registrar_sondeo(nodo, None, e)
+
+    def _ejecutar(self, modelo: Optional[str], operacion: Callable[[ClienteOllamaSync], dict]):
+        self._sondear()
+        excluidos: Set[str] = set()
+        ultimo_error: Optional[Exception] = None
+        while True:
+            nodo = self.balanceador._elegir(modelo, excluidos)
+            if nodo is None:
+                raise _sin_nodos(modelo, ultimo_error)
+            try:
+                resultado = operacion(nodo.cliente_sync)
+            except Exception as e:
+                self.balanceador._terminar(nodo, e, modelo)
+                if not _es_fallo_de_nodo(e):
+                    raise
+                excluidos.add(nodo.url)
+                ultimo_error = e
+                continue
+            except BaseException:
+                self.balanceador._terminar(nodo)
+                raise
+            self.balanceador._terminar(nodo)
+            return resultado
+
+    def _stream(self, modelo: str, abrir: Callable[[ClienteOllamaSync], Iterator[dict]]) -> Iterator[dict]:
+        """Reintenta en otro nodo solo si no se emitió ningún fragmento todavía"""
+        self._sondear()
+        excluidos: Set[str] = set()
+        ultimo_error: Optional[Exception] = None
+        while True:
+            nodo = self.balanceador._elegir(modelo, excluidos)
+            if nodo is None:
+                raise _sin_nodos(modelo, ultimo_error)
+            flujo = abrir(nodo.cliente_sync)
+            emitidos = 0
+            error = None
+            try:
+                for fragmento in flujo:
+                    emitidos += 1
+                    yield fragmento
+                return
+            except Exception as e:
+                error = e
+                if emitidos or not _es_fallo_de_nodo(e):
+                    raise
+                excluidos.add(nodo.url)
+                ultimo_error = e
+            finally:
+                flujo.close()
+                self.balanceador._terminar(nodo, error, modelo)
+
+    def generar(self, modelo: str, prompt: str, opciones: dict = None,
+                timeout: float = TIMEOUT_GENERACION, **extra) -> dict:
+        return self._ejecutar(modelo, lambda c: c.generar(modelo, prompt, opciones, timeout, **extra))
+
+    def chat(self, modelo: str, messages: List[Dict], opciones: dict = None,
+             timeout: float = TIMEOUT_GENERACION, **extra) -> dict:
+        return self._ejecutar(modelo, lambda c: c.chat(modelo, messages, opciones, timeout, **extra))
+
+    def generar_stream(self, modelo: str, prompt: str, opciones: dict = None,
+                       timeout: float = TIMEOUT_GENERACION, **extra) -> Iterator[dict]:
+        return self._stream(modelo, lambda c: c.generar_stream(modelo, prompt, opciones, timeout, **extra))
+
+    def chat_stream(self, modelo: str, messages: List[Dict], opciones: dict = None,
+                    timeout: float = TIMEOUT_GENERACION, **extra) -> Iterator[dict]:
+        return self._stream(modelo, lambda c: c.chat_stream(modelo, messages, opciones, timeout, **extra))
+
+    def tags(self, timeout: float = TIMEOUT_SONDEO) -> List[Dict]:
+        """Modelos instalados en al menos un nodo (falla solo si no responde ninguno)"""
+        modelos: Dict[str, Dict] = {}
+        errores = []
+        for nodo in list(self.balanceador.nodos):
+            try:
+                respuesta = nodo.cliente_sync.tags(timeout=timeout)
+            except Exception as e:
+                self.balanceador._registrar_sondeo(nodo, None, e)
+                errores.append(e)
+                continue
+            self.balanceador._registrar_sondeo(nodo, respuesta)
+            for m in respuesta:
+                modelos.setdefault(m.get('name'), m)
+        if errores and len(errores) == len(self.balanceador.nodos):
+            raise errores[0]
+        return list(modelos.values())
+
+    def show(self, modelo: str, timeout: float = TIMEOUT_SONDEO) -> dict:
+        return self._ejecutar(modelo, lambda c: c.show(modelo, timeout))
+
+    def disponible(self, timeout: float = TIMEOUT_SONDEO) -> bool:
+        """True si responde al menos un nodo"""
+        try:
+            self.tags(timeout=timeout)
+            return True
+        except Exception:
+            return False
+
+    def cerrar(self):
+        for nodo in self.balanceador.nodos:
+            nodo.cliente_sync.cerrar()
+
+
+# Instancias compartidas por proceso
+_balanceador: Optional[BalanceadorOllama] = None
+_cliente_async: Optional[ClienteBalanceado] = None
+_cliente_sync: Optional[ClienteBalanceadoSync] = None
+_lock_instancias = threading.Lock()
+
+
+def obtener_balanceador() -> BalanceadorOllama:
+    """Retorna el balanceador de nodos Ollama del proceso"""
+    global _balanceador
+    with _lock_instancias:
+        if _balanceador is None:
+            _balanceador = BalanceadorOllama()
+        return _balanceador
+
+
+def obtener_cliente() -> ClienteBalanceado:
+    """Retorna el cliente asíncrono compartido del proceso"""
+    global _cliente_async
+    balanceador = obtener_balanceador()
+    with _lock_instancias:
+        if _cliente_async is None:
+            _cliente_async = ClienteBalanceado(balanceador)
+        return _cliente_async
+
+
+def obtener_cliente_sync() -> ClienteBalanceadoSync:
+    """Retorna la fachada síncrona compartida del proceso"""
+    global _cliente_sync
+    balanceador = obtener_balanceador()
+    with _lock_instancias:
+        if _cliente_sync is None:
+            _cliente_sync = ClienteBalanceadoSync(balanceador)
+        return _cliente_sync
+
+
+async def configurar_endpoints(urls: List[str]) -> List[str]:
+    """Cambia los servidores Ollama del proceso y cierra los pools de los retirados"""
+    for nodo in obtener_balanceador().configurar(urls):
+        await nodo.cliente.cerrar()
+        nodo.cliente_sync.cerrar()
+    return [n.url for n in obtener_balanceador().nodos]
+
+
+async def cerrar_clientes():
+    """Cierra los pools de todos los nodos (usar en el shutdown del servidor)"""
+    if _balanceador is not None:
+        for nodo in _balanceador.nodos:
+            await nodo.cliente.cerrar()
+            nodo.cliente_sync.cerrar()
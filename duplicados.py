@@ -0,0 +1,165 @@
+"""
+Detección de preguntas casi duplicadas (paráfrasis)
+- Cada pregunta (enunciado + opciones) se normaliza, se quitan palabras vacías y se
+  convierte en shingles de caracteres; su firma MinHash estima la similitud de Jaccard
+- IndiceSimilitud: índice LSH por bandas; solo se comparan las firmas que coinciden en
+  alguna banda, así que agregar y consultar no depende del tamaño del índice
+- indice_examenes_previos: índice con las preguntas ya guardadas en examenes/ para una carpeta
+"""
+import hashlib
+import json
+import random
+import re
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from cache_llm import normalizar_texto
+
+
+TAMANO_SHINGLE = 5              # caracteres por shingle (además de cada palabra)
+NUM_PERMUTACIONES = 64
+BANDAS = 16                     # 16 bandas de 4 filas: candidato con p≈0.9 a similitud 0.6
+UMBRAL_SIMILITUD = 0.6          # Jaccard estimado a partir del cual se considera duplicada
+CARPETA_EXAMENES = Path("examenes")
+
+_PRIMO = (1 << 61) - 1
+_generador = random.Random(20240611)  # semilla fija: firmas comparables entre procesos
+_PERMUTACIONES = [(_generador.randrange(1, _PRIMO), _generador.randrange(0, _PRIMO))
+                  for _ in range(NUM_PERMUTACIONES)]
+
+PALABRAS_VACIAS = frozenset("""
+a al algo ante antes como con cual cuales de del desde el ella ellas ellos en entre es
+esta este esto estos fue ha hay la las le les lo los mas mediante muy no o para pero por
+que se segun ser si sin sobre son su sus tiene un una uno unos y ya
+define describe explica menciona indica consiste significa
+the a an of to in is are what which how
+""".split())
+
+
+def texto_pregunta(pregunta) -> str:
+    """Enunciado y opciones de una PreguntaExamen o de su dict"""
+    if isinstance(pregunta, dict):
+        enunciado, opciones = pregunta.get('pregunta', ''), pregunta.get('opciones') or []
+    else:
+        enunciado, opciones = pregunta.pregunta, pregunta.opciones or []
+    return ' '.join([str(enunciado or '')] + [str(o) for o in opciones if o])
+
+
+def _shingles(texto: str) -> set:
+    # Los interrogativos concretos (quién, cuándo, dónde, cuántos) no son palabras vacías:
+    # "¿quién fundó X?" y "¿cuándo se fundó X?" son preguntas distintas
+    palabras = [p for p in re.findall(r'\w+', normalizar_texto(texto)) if p not in PALABRAS_VACIAS]
+    compacto = ' '.join(palabras)
+    shingles = {compacto[i:i + TAMANO_SHINGLE] for i in range(max(1, len(compacto) - TAMANO_SHINGLE + 1))}
+    # Las palabras enteras pesan en textos cortos, donde pocos caracteres cambian el sentido (UX/UI)
+    shingles.update('#' + p for p in palabras)
+    shingles.discard('')
+    return shingles
+
+
+def firma_minhash(texto: str) -> Optional[Tuple[int, ...]]:
+    """Firma MinHash del texto (None si no tiene contenido comparable)"""
+    valores = [int.from_bytes(hashlib.blake2b(s.encode('utf-8'), digest_size=8).digest(), 'big')
+               for s in _shingles(texto)]
+    if not valores:
+        return None
+    return tuple(min((a * v + b) % _PRIMO for v in valores) for a, b in _PERMUTACIONES)
+
+
+def similitud(firma_a: Tuple[int, ...], firma_b: Tuple[int, ...]) -> float:
+    """Jaccard estimado: fracción de permutaciones con el mismo mínimo"""
+    return sum(x == y for x, y in zip(firma_a, firma_b)) / NUM_PERMUTACIONES
+
+
+class IndiceSimilitud:
+    """Conjunto de preguntas con búsqueda de casi duplicados (seguro entre hilos)"""
+
+    def __init__(self, umbral: float = UMBRAL_SIMILITUD):
+        self.umbral = umbral
+        self._firmas: List[Tuple[Tuple[int, ...], str]] = []   # (firma, origen)
+        self._bandas: List[Dict[Tuple[int, ...], List[int]]] = [{} for _ in range(BANDAS)]
+        self._lock = threading.Lock()
+        self.descartadas = 0
+
+    def __len__(self) -> int:
+        return len(self._firmas)
+
+    def _claves_banda(self, firma: Tuple[int, ...]):
+        filas = NUM_PERMUTACIONES // BANDAS
+        return [firma[i * filas:(i + 1) * filas] for i in range(BANDAS)]
+
+    def _buscar(self, firma: Tuple[int, ...]) -> Optional[Tuple[str, float]]:
+        candidatos = set()
+        for banda, clave in zip(self._bandas, self._claves_banda(firma)):
+            candidatos.update(banda.get(clave, ()))
+        mejor = None
+        for i in candidatos:
+            valor = similitud(firma, self._firmas[i][0])
+            if valor >= self.umbral and (mejor is None or valor > mejor[1]):
+                mejor = (self._firmas[i][1], valor)
+        return mejor
+
+    def _insertar(self, firma: Tuple[int, ...], origen: str):
+        posicion = len(self._firmas)
+        self._firmas.append((firma, origen))
+        for banda, clave in zip(self._bandas, self._claves_banda(firma)):
+            banda.setdefault(clave, []).append(posicion)
+
+    def agregar(self, texto: str, origen: str = ""):
+        """Agrega sin comprobar (p. ej. preguntas de exámenes anteriores)"""
+        firma = firma_minhash(texto)
+        if firma is not None:
+            with self._lock:
+                self._insertar(firma, origen)
+
+    def duplicada(self, texto: str) -> Optional[Tuple[str, float]]:
+        """(origen, similitud) de la pregunta más parecida por encima del umbral, o None"""
+        firma = firma_minhash(texto)
+        if firma is None:
+            return None
+        with self._lock:
+            return self._buscar(firma)
+
+    def agregar_si_nueva(self, texto: str, origen: str = "") -> bool:
+        """Agrega la pregunta salvo que sea casi duplicada de una ya indexada"""
+        firma = firma_minhash(texto)
+        if firma is None:
+            return True
+        with self._lock:
+            parecida = self._buscar(firma)
+            if parecida is not None:
+                self.descartadas += 1
+                print(f"♊ Pregunta casi duplicada descartada (similitud {parecida[1]:.2f} con "
+                      f"{parecida[0] or 'otra de esta generación'}): {texto[:60]}...")
+                return False
+            self._insertar(firma, origen)
+            return True
+
+
+def _preguntas_guardadas(archivo: Path) -> List[dict]:
+    try:
+        datos = json.loads(archivo.read_text(encoding='utf-8'))
+    except (OSError, ValueError):
+        return []
+    if not isinstance(datos, dict):
+        return []
+    # Exámenes completados guardan 'resultados'; los pausados, 'preguntas'
+    preguntas = datos.get('resultados') or datos.get('preguntas') or []
+    return [p for p in preguntas if isinstance(p, dict)] if isinstance(preguntas, list) else []
+
+
+def indice_examenes_previos(carpeta_relativa: str, umbral: float = UMBRAL_SIMILITUD) -> IndiceSimilitud:
+    """Índice con las preguntas de los exámenes guardados para la carpeta (ruta relativa a
+    extracciones/, la misma estructura que usa examenes/)"""
+    indice = IndiceSimilitud(umbral)
+    if not carpeta_relativa:
+        return indice
+    carpeta = CARPETA_EXAMENES / carpeta_relativa
+    archivos = list(carpeta.glob("examen_*.json")) + list(carpeta.glob("examenes_progreso/examen_progreso_*.json"))
+    for archivo in archivos:
+        for pregunta in _preguntas_guardadas(archivo):
+            indice.agregar(texto_pregunta(pregunta), origen=archivo.name)
+    if archivos:
+        print(f"♊ {len(indice)} preguntas de {len(archivos)} examen(es) anteriores indexadas para evitar repetirlas")
+    return indice
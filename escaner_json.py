@@ -0,0 +1,57 @@
+"""
+Búsqueda de JSON dentro de la salida del modelo (razonamiento, markdown, texto libre)
+- spans_json: en una sola pasada registra todos los objetos (o arrays) balanceados,
+  de primer nivel y anidados, como (inicio, fin). Las comillas solo cuentan dentro de
+  un objeto: el texto libre no puede dejar abierta una string
+- primer_json: el primer candidato (el más externo primero) que es JSON válido
+"""
+import json
+from typing import Callable, List, Tuple
+
+
+_CIERRES = {'}': '{', ']': '['}
+
+
+def spans_json(texto: str, aperturas: str = '{') -> List[Tuple[int, int]]:
+    """(inicio, fin) de cada bloque balanceado que abre con un carácter de aperturas,
+    ordenados por inicio (un bloque va antes que los anidados en él)"""
+    spans = []
+    pila: List[Tuple[str, int]] = []
+    en_string = False
+    escape = False
+    for i, c in enumerate(texto):
+        if en_string:
+            if escape:
+                escape = False
+            elif c == '\\':
+                escape = True
+            elif c == '"':
+                en_string = False
+        elif c in aperturas:
+            pila.append((c, i))
+        elif not pila:
+            continue
+        elif c == '"':
+            en_string = True
+        elif c in _CIERRES and _CIERRES[c] in aperturas:
+            # Cierra el bloque que le corresponde; los abiertos dentro de él quedan sin cerrar
+            apertura = _CIERRES[c]
+            while pila and pila[-1][0] != apertura:
+                pila.pop()
+            if pila:
+                spans.append((pila.pop()[1], i + 1))
+    spans.sort()
+    return spans
+
+
+def primer_json(texto: str, aperturas: str = '{', aceptar: Callable = None):
+    """Primer bloque que parsea como JSON (y cumple aceptar, si se indica), o None"""
+    tipo = dict if aperturas == '{' else (list if aperturas == '[' else object)
+    for inicio, fin in spans_json(texto, aperturas):
+        try:
+            datos = json.loads(texto[inicio:fin])
+        except ValueError:
+            continue
+        if isinstance(datos, tipo) and (aceptar is None or aceptar(datos)):
+            return datos
+    return None
@@ -0,0 +1,190 @@
+"""
+Salida JSON restringida por esquema
+- esquema_preguntas: esquema JSON del examen pedido, con el esquema de cada tipo de
+  pregunta y exactamente la cantidad pedida de cada uno (prefixItems en orden) o,
+  si la cantidad por tipo no está garantizada, solo el total
+- esquema_practica: {"questions": [...]} de las prácticas; fija el "type" de cada
+  pregunta entre los de la generación y el total (el resto lo define el prompt)
+- Ollama lo recibe como "format" y llama-cpp como gramática (LlamaGrammar), así que
+  la respuesta es JSON válido por construcción; "json" pide JSON sin esquema
+- EstadisticasParseo: respuestas que no parsean tal cual, con y sin restricción, para
+  comparar la tasa de fallos de ambos modos
+"""
+import json
+import threading
+from functools import lru_cache
+from typing import Dict, Optional, Union
+
+
+ESQUEMA_JSON_LIBRE = "json"    # cualquier JSON válido (prompts personalizados con su propio formato)
+
+_TEXTO = {"type": "string", "minLength": 1}
+
+ESQUEMAS_TIPO = {
+    'mcq': {
+        "pregunta": _TEXTO,
+        "opciones": {"type": "array", "items": _TEXTO, "minItems": 4, "maxItems": 4},
+        "respuesta_correcta": {"type": "string", "enum": ["A", "B", "C", "D"]},
+        "puntos": {"type": "integer"}
+    },
+    'true_false': {
+        "pregunta": _TEXTO,
+        "respuesta_correcta": {"type": "string", "enum": ["verdadero", "falso"]},
+        "puntos": {"type": "integer"}
+    },
+    'short_answer': {
+        "pregunta": _TEXTO,
+        "respuesta_correcta": _TEXTO,
+        "puntos": {"type": "integer"}
+    },
+    'open_question': {
+        "pregunta": _TEXTO,
+        "respuesta_correcta": _TEXTO,
+        "puntos": {"type": "integer"}
+    },
+    'case_study': {
+        "subtipo": {"type": "string"},
+        "titulo": _TEXTO,
+        "contexto": _TEXTO,
+        "descripcion": _TEXTO,
+        "pregunta": _TEXTO,
+        "respuesta_esperada": _TEXTO,
+        "puntos": {"type": "integer"}
+    }
+}
+
+
+def esquema_pregunta(tipo: str, nombre: str = None) -> dict:
+    """Esquema de una pregunta del tipo (nombre: valor de "tipo" si difiere del normalizado)"""
+    campos = ESQUEMAS_TIPO.get(tipo)
+    propiedades = {"tipo": {"const": nombre or tipo}}
+    if campos is None:
+        return {"type": "object", "properties": propiedades, "required": ["tipo", "pregunta"]}
+    propiedades.update(campos)
+    return {
+        "type": "object",
+        "properties": propiedades,
+        "required": list(propiedades),
+        # Los casos de estudio agregan campos según el subtipo (puntos_clave, restricciones...)
+        "additionalProperties": tipo == 'case_study'
+    }
+
+
+def esquema_preguntas(cupo: Dict[str, int], nombres: Dict[str, str] = None,
+                      exacto: bool = True) -> Optional[dict]:
+    """{"preguntas": [...]} con exactamente cupo[tipo] preguntas de cada tipo
+
+    cupo usa los tipos normalizados (mcq, true_false...); nombres traduce cada uno al
+    valor de "tipo" que espera el prompt (p. ej. 'mcq' -> 'multiple'). Con exacto=False
+    cada pregunta puede ser de cualquiera de los tipos y solo se limita el total.
+    """
+    nombres = nombres or {}
+    cupo = {tipo: cantidad for tipo, cantidad in cupo.items() if cantidad > 0}
+    total = sum(cupo.values())
+    if not total:
+        return None
+    if exacto:
+        lista = {"prefixItems": [esquema_pregunta(tipo, nombres.get(tipo))
+                                 for tipo, cantidad in cupo.items() for _ in range(cantidad)],
+                 "minItems": total}
+    else:
+        lista = {"items": {"anyOf": [esquema_pregunta(tipo, nombres.get(tipo)) for tipo in cupo]}}
+    return {
+        "type": "object",
+        "properties": {"preguntas": {"type": "array", **lista, "maxItems": total}},
+        "required": ["preguntas"]
+    }
+
+
+def esquema_practica(cupo: Dict[str, int]) -> Optional[dict]:
+    """{"questions": [...]} con hasta cupo[tipo] preguntas en total, cada una de uno de los tipos"""
+    cupo = {tipo: cantidad for tipo, cantidad in cupo.items() if cantidad > 0}
+    total = sum(cupo.values())
+    if not total:
+        return None
+    pregunta = {
+        "type": "object",
+        "properties": {"type": {"type": "string", "enum": list(cupo)}},
+        "required": ["type"]
+    }
+    return {
+        "type": "object",
+        "properties": {"questions": {"type": "array", "items": pregunta, "minItems": 1, "maxItems": total}},
+        "required": ["questions"]
+    }
+
+
+# ------------------------------------------------------------------ llama-cpp
+
+@lru_cache(maxsize=32)
+def _gramatica(esquema_texto: str):
+    from llama_cpp import LlamaGrammar
+    if esquema_texto == ESQUEMA_JSON_LIBRE:
+        from llama_cpp.llama_grammar import JSON_GBNF
+        return LlamaGrammar.from_string(JSON_GBNF, verbose=False)
+    return LlamaGrammar.from_json_schema(esquema_texto, verbose=False)
+
+
+def gramatica_llama(esquema: Union[dict, str]):
+    """LlamaGrammar del esquema (o de JSON libre); se compila una vez por esquema"""
+    texto = esquema if isinstance(esquema, str) else json.dumps(esquema, sort_keys=True)
+    return _gramatica(texto)
+
+
+def argumentos_restriccion(llm, esquema: Union[dict, str, None]) -> dict:
+    """kwargs de llm(...) para restringir la salida al esquema
+
+    La gramática no se puede enviar al proceso de LlamaRemoto: se pasa el esquema y
+    el proceso hijo la compila (proceso_llama).
+    """
+    if not esquema:
+        return {}
+    if hasattr(llm, 'completar_con_prefijo'):
+        return {'esquema_json': esquema}
+    return {'grammar': gramatica_llama(esquema)}
+
+
+# ----------------------------------------------------------- tasa de fallos
+
+def json_estricto(texto: str):
+    """El JSON de la respuesta tal cual llegó, o None si no parsea sin reparaciones"""
+    try:
+        return json.loads((texto or "").strip())
+    except ValueError:
+        return None
+
+
+class EstadisticasParseo:
+    """Respuestas que necesitaron reparación o no dieron preguntas, por modo"""
+
+    MODOS = ('restringida', 'libre')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._conteos = {modo: {'respuestas': 0, 'json_invalido': 0, 'sin_preguntas': 0}
+                         for modo in self.MODOS}
+
+    def registrar(self, restringida: bool, json_valido: bool, con_preguntas: bool):
+        conteo = self._conteos['restringida' if restringida else 'libre']
+        with self._lock:
+            conteo['respuestas'] += 1
+            conteo['json_invalido'] += not json_valido
+            conteo['sin_preguntas'] += not con_preguntas
+
+    def estado(self) -> dict:
+        with self._lock:
+            return {
+                modo: {
+                    **conteo,
+                    'tasa_fallos': round(conteo['json_invalido'] / conteo['respuestas'], 3)
+                                   if conteo['respuestas'] else None
+                }
+                for modo, conteo in self._conteos.items()
+            }
+
+
+_estadisticas = EstadisticasParseo()
+
+
+def obtener_estadisticas_parseo() -> EstadisticasParseo:
+    return _estadisticas
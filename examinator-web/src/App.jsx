@@ -2976,7 +2976,8 @@ function App() {
           num_multiple: configExamen.num_multiple,
           num_corta: configExamen.num_corta,
           num_desarrollo: configExamen.num_desarrollo,
-          session_id: sessionId
+          session_id: sessionId,
+          carpeta_path: carpetaConfigExamen?.ruta || ''
         }),
         signal: controller.signal
       })
@@ -10,7 +10,14 @@ from dataclasses import dataclass
 from llama_cpp import Llama
 import json
 import re
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from cache_llm import obtener_cache_respuestas, digest_archivo, hash_clave
+from proceso_llama import LlamaRemoto
+from prefijos_kv import completar, registrar_prefijo
+from presupuesto_tokens import obtener_contador, ContadorTokens, Presupuesto, TOKENS_MINIMOS_CONTENIDO
+from esquemas_json import esquema_preguntas, argumentos_restriccion, ESQUEMA_JSON_LIBRE
 
 
 @dataclass
@@ -110,10 +117,28 @@ class PreguntaExamen:
 
 
 class GeneradorDosPasos:
-    def __init__(self, modelo_path: str, n_gpu_layers: int = 35):
+    N_CTX = 8192
+    N_HILOS = 6
+    # Pasos en paralelo: el paso 2 formatea cada lote de preguntas del paso 1 mientras el paso 1
+    # sigue generando. Opcional (config "pasos_en_paralelo"): carga una segunda instancia del
+    # modelo (ventana más chica, pocos hilos, en CPU para no duplicar la VRAM)
+    N_CTX_FORMATO = 4096
+    N_HILOS_FORMATO = 2
+    N_GPU_CAPAS_FORMATO = 0
+    PREGUNTAS_POR_LOTE = 3
+    TOKENS_FORMATO_PASO1 = 400  # instrucciones de formato por tipo que se agregan al contenido
+    # Valor de "tipo" que usa el paso 2 para cada tipo normalizado
+    TIPOS_PASO2 = {'mcq': 'multiple', 'true_false': 'verdadero_falso',
+                   'short_answer': 'corta', 'open_question': 'desarrollo'}
+    
+    def __init__(self, modelo_path: str, n_gpu_layers: int = 35, en_proceso_separado: bool = False):
         self.modelo_path = modelo_path
         self.n_gpu_layers = n_gpu_layers
         self.llm = None
+        self.en_proceso_separado = en_proceso_separado  # True: modelo en un proceso hijo (LlamaRemoto)
+        self.salida_estructurada = True  # paso 2 restringido al esquema JSON (gramática de llama-cpp)
+        self.pasos_en_paralelo = False   # paso 2 por lotes mientras el paso 1 genera (segunda instancia)
+        self.llm_formato = None          # se carga al primer uso (_formateador)
         self.log_dir = Path("logs_generacion_dos_pasos")
         self.log_dir.mkdir(exist_ok=True)
         self._cargar_modelo()
@@ -130,10 +155,10 @@ class GeneradorDosPasos:
                 print(f"📚 llama-cpp-python versión: {llama_cpp.__version__}")
                 
                 # Intentar cargar con GPU
-                self.llm = Llama(
+                self.llm = self._clase_llama()(
                     model_path=self.modelo_path,
-                    n_ctx=8192,
-                    n_threads=6,
+                    n_ctx=self.N_CTX,
+                    n_threads=self.N_HILOS,
                     n_gpu_layers=self.n_gpu_layers,
                     verbose=True  # Activar verbose para ver mensajes de GPU
                 )
@@ -161,10 +186,10 @@ class GeneradorDosPasos:
                 print(f"⚠️  Error verificando GPU: {e_gpu}")
                 # Intentar cargar solo con CPU
                 print(f"🔄 Intentando cargar solo con CPU...")
-                self.llm = Llama(
+                self.llm = self._clase_llama()(
                     model_path=self.modelo_path,
-                    n_ctx=8192,
-                    n_threads=6,
+                    n_ctx=self.N_CTX,
+                    n_threads=self.N_HILOS,
                     n_gpu_layers=0,
                     verbose=False
                 )
@@ -174,6 +199,81 @@ class GeneradorDosPasos:
             print(f"❌ Error cargando modelo: {e}")
             self.llm = None
     
+    def _clase_llama(self):
+        return LlamaRemoto if self.en_proceso_separado else Llama
+    
+    def _formateador(self):
+        """Instancia del modelo para el paso 2 en paralelo, o None si no se usa o no cargó"""
+        if not self.pasos_en_paralelo or not self.llm:
+            return None
+        if self.llm_formato is None:
+            try:
+                print(f"📦 Cargando instancia de formateo (paso 2 en paralelo, {self.N_HILOS_FORMATO} hilos, "
+                      f"{self.N_GPU_CAPAS_FORMATO} capas GPU)")
+                self.llm_formato = self._clase_llama()(
+                    model_path=self.modelo_path,
+                    n_ctx=self.N_CTX_FORMATO,
+                    n_threads=self.N_HILOS_FORMATO,
+                    n_gpu_layers=self.N_GPU_CAPAS_FORMATO,
+                    verbose=False
+                )
+            except Exception as e:
+                print(f"⚠️  No se pudo cargar la instancia de formateo ({e}): pasos en secuencia")
+                self.pasos_en_paralelo = False
+                return None
+        return self.llm_formato
+    
+    def cerrar_formateador(self):
+        """Libera la instancia del paso 2 en paralelo (registro_generadores la cierra con el modelo)"""
+        if self.llm_formato is not None and hasattr(self.llm_formato, 'close'):
+            self.llm_formato.close()
+        self.llm_formato = None
+    
+    def contador_tokens(self, usar_ollama: bool = None) -> ContadorTokens:
+        """Tokenizador y ventana del modelo GGUF (misma interfaz que GeneradorUnificado)"""
+        return obtener_contador('gguf', self.modelo_path, llm=self.llm, ventana=self.N_CTX)
+    
+    def _completar(self, prompt: str, usar_cache: bool = True, esquema: dict = None, llm=None,
+                   al_generar=None, **opciones) -> str:
+        """Llama al modelo consultando antes la caché de respuestas (prompt + opciones + modelo)
+        esquema: restringe la salida a ese esquema JSON
+        llm: instancia a usar (por defecto self.llm)
+        al_generar: recibe cada fragmento de texto a medida que se genera (stream)"""
+        llm = llm or self.llm
+        cache = obtener_cache_respuestas()
+        clave = {
+            'motor': 'gguf_dos_pasos',
+            'modelo': digest_archivo(self.modelo_path),
+            'n_gpu_layers': self.n_gpu_layers,
+            'prompt': hash_clave({'prompt': prompt}),
+            'opciones': opciones
+        }
+        if esquema:
+            clave['esquema'] = hash_clave({'esquema': esquema})
+        if usar_cache:
+            texto = cache.obtener(clave)
+            if texto:
+                print(f"♻️ Respuesta reutilizada de la caché ({len(texto)} caracteres)")
+                if al_generar:
+                    al_generar(texto)
+                return texto
+        
+        restriccion = argumentos_restriccion(llm, esquema)
+        if al_generar:
+            fragmentos = []
+            for chunk in completar(llm, prompt, stream=True, **opciones, **restriccion):
+                fragmento = chunk['choices'][0].get('text') or ''
+                if fragmento:
+                    fragmentos.append(fragmento)
+                    al_generar(fragmento)
+            texto = ''.join(fragmentos).strip()
+        else:
+            respuesta = completar(llm, prompt, **opciones, **restriccion)
+            texto = respuesta['choices'][0]['text'].strip()
+        if texto:
+            cache.guardar(clave, texto)
+        return texto
+    
     def _formatear_prompt_llama(self, system_msg: str, user_msg: str) -> str:
         """Formatea el prompt usando el chat template de Llama 3.1"""
         return f"""<|begin_of_text|><|start_header_id|>system<|end_header_id|>
@@ -201,10 +301,12 @@ class GeneradorDosPasos:
     
     def paso1_generar_preguntas_naturales(self, contenido: str, num_preguntas: Dict[str, int],
                                           ajustes_modelo: dict = None, archivos: list = None,
-                                          log_file: Path = None, sin_prompt_sistema: bool = False) -> str:
+                                          log_file: Path = None, sin_prompt_sistema: bool = False,
+                                          usar_cache: bool = True, al_generar=None) -> str:
         """
         PASO 1: Genera preguntas en lenguaje natural, sin formato JSON.
         El modelo se enfoca solo en hacer buenas preguntas.
+        al_generar: recibe el texto a medida que se genera (pasos en paralelo)
         """
         if not self.llm:
             print("❌ No hay modelo cargado")
@@ -221,8 +323,12 @@ class GeneradorDosPasos:
         top_p = ajustes_modelo.get('top_p', 0.9)
         repeat_penalty = ajustes_modelo.get('repeat_penalty', 1.15)
         
-        # Limitar contenido
-        contenido_limitado = contenido[:6000] if len(contenido) > 6000 else contenido
+        # Limitar contenido a lo que deja libre la ventana (se reserva la respuesta y el
+        # espacio del formato; el paso 2 procesa luego este texto más las preguntas)
+        presupuesto = Presupuesto(self.contador_tokens(), max_tokens)
+        presupuesto.consumir('instrucciones', self._formatear_prompt_llama(
+            "Eres un profesor experto que crea exámenes educativos de alta calidad.", ""), extra=self.TOKENS_FORMATO_PASO1)
+        contenido_limitado = presupuesto.recortar('contenido', contenido, minimo=TOKENS_MINIMOS_CONTENIDO)
         
         # Calcular totales
         total_multiple = num_preguntas.get('multiple', 0)
@@ -339,8 +445,10 @@ IMPORTANTE:
         print(f"📝 PASO 1: Generando preguntas en lenguaje natural...")
         print(f"   Temperatura: {temperature}, Max tokens: {max_tokens}")
         
-        respuesta = self.llm(
+        texto_preguntas = self._completar(
             prompt,
+            usar_cache=usar_cache,
+            al_generar=al_generar,
             max_tokens=max_tokens,
             temperature=temperature,
             top_p=top_p,
@@ -348,8 +456,6 @@ IMPORTANTE:
             stop=["<|eot_id|>", "<|end_of_text|>"]
         )
         
-        texto_preguntas = respuesta['choices'][0]['text'].strip()
-        
         print(f"✅ PASO 1 completado: {len(texto_preguntas)} caracteres generados")
         print(f"\n{'='*60}")
         print("📋 PREGUNTAS GENERADAS (primeros 500 caracteres):")
@@ -370,9 +476,11 @@ IMPORTANTE:
         return texto_preguntas
     
     def paso2_formatear_a_json(self, texto_preguntas: str, num_preguntas: Dict[str, int],
-                               ajustes_modelo: dict = None, log_file: Path = None) -> str:
+                               ajustes_modelo: dict = None, log_file: Path = None,
+                               usar_cache: bool = True, llm=None) -> str:
         """
         PASO 2: Toma las preguntas en lenguaje natural y las formatea al JSON requerido.
+        llm: instancia a usar (la de formateo cuando los pasos van en paralelo)
         """
         if not self.llm:
             print("❌ No hay modelo cargado")
@@ -389,9 +497,8 @@ IMPORTANTE:
         
         system_msg = """Eres un conversor de texto a JSON. Responde únicamente con el objeto JSON, sin marcadores de código ni explicaciones."""
         
-        user_msg = f"""Convierte estas preguntas a JSON válido:
-
-{texto_preguntas}
+        # Instrucciones fijas primero: el estado KV de este prefijo se reutiliza entre llamadas
+        instrucciones = f"""Convierte a JSON válido las preguntas que aparecen al final.
 
 Formato esperado:
 {{
@@ -408,9 +515,13 @@ Reglas:
 - respuesta_correcta en múltiple: solo letra (A, B, C, D)
 - verdadero/falso: usa "verdadero" o "falso"
 - NO uses marcadores ```json o ```
-- Responde SOLO el JSON puro, comenzando con {{"""
+- Responde SOLO el JSON puro, comenzando con {{
+
+PREGUNTAS A CONVERTIR:
+"""
         
-        prompt = self._formatear_prompt_llama(system_msg, user_msg)
+        prompt = self._formatear_prompt_llama(system_msg, instrucciones + texto_preguntas)
+        registrar_prefijo(prompt[:prompt.index(instrucciones) + len(instrucciones)])
         
         if log_file:
             self._escribir_log(log_file, "\n" + "="*80)
@@ -421,8 +532,17 @@ Reglas:
         
         print(f"📝 PASO 2: Formateando preguntas a JSON...")
         
-        respuesta = self.llm(
+        # El paso 1 puede haber escrito menos preguntas de algún tipo: se limita el total, no cada tipo
+        esquema = None
+        if self.salida_estructurada:
+            cupo = {tipo: num_preguntas.get(tipo, 0) for tipo in self.TIPOS_PASO2}
+            esquema = esquema_preguntas(cupo, self.TIPOS_PASO2, exacto=False) or ESQUEMA_JSON_LIBRE
+        
+        json_texto = self._completar(
             prompt,
+            usar_cache=usar_cache,
+            esquema=esquema,
+            llm=llm,
             max_tokens=max_tokens,
             temperature=temperature,
             top_p=0.9,
@@ -430,8 +550,6 @@ Reglas:
             stop=["<|eot_id|>", "<|end_of_text|>"]
         )
         
-        json_texto = respuesta['choices'][0]['text'].strip()
-        
         print(f"✅ PASO 2 completado")
         print(f"\n{'='*60}")
         print("📋 JSON GENERADO (primeros 500 caracteres):")
@@ -531,7 +649,11 @@ Reglas:
             if log_file:
                 self._escribir_log(log_file, f"\n❌ ERROR extrayendo preguntas: {e}")
         
-        # FILTRAR PREGUNTAS POR TIPO Y CANTIDAD SOLICITADA
+        return self._filtrar_preguntas(preguntas, num_preguntas, log_file)
+    
+    def _filtrar_preguntas(self, preguntas: List[PreguntaExamen], num_preguntas: Dict[str, int],
+                           log_file: Path = None) -> List[PreguntaExamen]:
+        """Filtra preguntas por tipo y cantidad solicitada"""
         preguntas_filtradas = []
         contador_por_tipo = {}
         
@@ -784,10 +906,11 @@ Reglas:
     def generar_examen(self, contenido: str, num_preguntas: Dict[str, int], 
                       ajustes_modelo: dict = None, callback_progreso=None,
                       archivos: list = None, session_id: str = None,
-                      sin_prompt_sistema: bool = False) -> List[PreguntaExamen]:
+                      sin_prompt_sistema: bool = False, usar_cache: bool = True) -> List[PreguntaExamen]:
         """
         Método principal: Genera examen usando el proceso de DOS PASOS
         sin_prompt_sistema: Si es True, usa el contenido directamente sin agregar instrucciones
+        usar_cache: Si es False genera preguntas nuevas aunque el prompt ya se haya respondido
         """
         # Crear archivo de log para esta sesión
         log_file = self._crear_log_archivo(session_id)
@@ -804,37 +927,51 @@ Reglas:
         if callback_progreso:
             callback_progreso(10, "Iniciando generación en dos pasos...")
         
-        # PASO 1: Generar preguntas naturales
-        if callback_progreso:
-            callback_progreso(20, "PASO 1: Generando preguntas...")
-        
-        texto_preguntas = self.paso1_generar_preguntas_naturales(
-            contenido, num_preguntas, ajustes_modelo, archivos, log_file, sin_prompt_sistema
-        )
-        
-        if not texto_preguntas:
-            print("❌ No se generaron preguntas en el Paso 1")
-            self._escribir_log(log_file, "\n❌ ERROR: No se generaron preguntas en el Paso 1")
-            return []
-        
-        # PASO 2: Formatear a JSON
-        if callback_progreso:
-            callback_progreso(60, "PASO 2: Formateando a JSON...")
-        
-        json_texto = self.paso2_formatear_a_json(
-            texto_preguntas, num_preguntas, ajustes_modelo, log_file
-        )
-        
-        if not json_texto:
-            print("❌ No se generó JSON en el Paso 2")
-            self._escribir_log(log_file, "\n❌ ERROR: No se generó JSON en el Paso 2")
-            return []
-        
-        # Extraer preguntas del JSON
-        if callback_progreso:
-            callback_progreso(80, "Extrayendo preguntas...")
-        
-        preguntas = self._extraer_preguntas_del_json(json_texto, num_preguntas, log_file)
+        formateador = self._formateador()
+        if formateador is not None:
+            preguntas = self._generar_en_paralelo(
+                contenido, num_preguntas, ajustes_modelo, callback_progreso, archivos, log_file,
+                sin_prompt_sistema, usar_cache, formateador
+            )
+            if preguntas is None:
+                return []
+        else:
+            # PASO 1: Generar preguntas naturales
+            if callback_progreso:
+                callback_progreso(20, "PASO 1: Generando preguntas...")
+            
+            inicio = time.monotonic()
+            texto_preguntas = self.paso1_generar_preguntas_naturales(
+                contenido, num_preguntas, ajustes_modelo, archivos, log_file, sin_prompt_sistema,
+                usar_cache=usar_cache
+            )
+            segundos_paso1 = time.monotonic() - inicio
+            
+            if not texto_preguntas:
+                print("❌ No se generaron preguntas en el Paso 1")
+                self._escribir_log(log_file, "\n❌ ERROR: No se generaron preguntas en el Paso 1")
+                return []
+            
+            # PASO 2: Formatear a JSON
+            if callback_progreso:
+                callback_progreso(60, "PASO 2: Formateando a JSON...")
+            
+            json_texto = self.paso2_formatear_a_json(
+                texto_preguntas, num_preguntas, ajustes_modelo, log_file, usar_cache=usar_cache
+            )
+            self._registrar_tiempos(log_file, segundos_paso1, time.monotonic() - inicio - segundos_paso1,
+                                    time.monotonic() - inicio)
+            
+            if not json_texto:
+                print("❌ No se generó JSON en el Paso 2")
+                self._escribir_log(log_file, "\n❌ ERROR: No se generó JSON en el Paso 2")
+                return []
+            
+            # Extraer preguntas del JSON
+            if callback_progreso:
+                callback_progreso(80, "Extrayendo preguntas...")
+            
+            preguntas = self._extraer_preguntas_del_json(json_texto, num_preguntas, log_file)
         
         # Finalizar log
         self._escribir_log(log_file, "\n" + "="*80)
@@ -850,6 +987,96 @@ Reglas:
         
         return preguntas
     
+    # Inicio de cada pregunta numerada del paso 1 ("1.", "2)", "**3.**")
+    _INICIO_PREGUNTA = re.compile(r'^\W*\d+[.)]', re.MULTILINE)
+    
+    def _generar_en_paralelo(self, contenido: str, num_preguntas: Dict[str, int], ajustes_modelo: dict,
+                             callback_progreso, archivos: list, log_file: Path, sin_prompt_sistema: bool,
+                             usar_cache: bool, formateador) -> List[PreguntaExamen]:
+        """Pasos 1 y 2 solapados: en cuanto el paso 1 termina de escribir un lote de
+        PREGUNTAS_POR_LOTE preguntas numeradas, la instancia de formateo lo convierte a JSON
+        mientras el paso 1 sigue con el siguiente. None si el paso 1 no generó nada."""
+        texto: List[str] = []
+        estado = {'consumido': 0, 'lotes': 0, 'formateados': 0, 'segundos_paso2': 0.0}
+        pendientes = []
+        
+        def formatear(n: int, lote: str) -> List[PreguntaExamen]:
+            inicio_lote = time.monotonic()
+            try:
+                json_texto = self.paso2_formatear_a_json(lote, num_preguntas, ajustes_modelo, log_file,
+                                                         usar_cache=usar_cache, llm=formateador)
+                return self._extraer_preguntas_del_json(json_texto, num_preguntas, log_file) if json_texto else []
+            except Exception as e:
+                print(f"⚠️ PASO 2: el lote {n} falló: {e}")
+                self._escribir_log(log_file, f"\n⚠️ PASO 2: el lote {n} falló: {e}")
+                return []
+            finally:
+                # Un solo hilo de formateo: sin carreras en estado
+                estado['segundos_paso2'] += time.monotonic() - inicio_lote
+                estado['formateados'] += 1
+                if callback_progreso:
+                    callback_progreso(min(85, 25 + 10 * estado['formateados']),
+                                      f"PASO 2: lote {n} formateado")
+        
+        def enviar_lotes(final: bool = False):
+            acumulado = ''.join(texto)
+            while True:
+                inicios = [m.start() for m in self._INICIO_PREGUNTA.finditer(acumulado, estado['consumido'])]
+                if len(inicios) <= self.PREGUNTAS_POR_LOTE:
+                    break
+                corte = inicios[self.PREGUNTAS_POR_LOTE]
+                enviar(acumulado[estado['consumido']:corte])
+                estado['consumido'] = corte
+            if final and acumulado[estado['consumido']:].strip():
+                enviar(acumulado[estado['consumido']:])
+                estado['consumido'] = len(acumulado)
+        
+        def enviar(lote: str):
+            estado['lotes'] += 1
+            print(f"📦 Lote {estado['lotes']} del paso 1 listo ({len(lote)} caracteres): formateando en paralelo")
+            pendientes.append(pool.submit(formatear, estado['lotes'], lote))
+        
+        def al_generar(fragmento: str):
+            texto.append(fragmento)
+            if '\n' in fragmento:
+                enviar_lotes()
+        
+        if callback_progreso:
+            callback_progreso(20, "PASO 1 y PASO 2 en paralelo: generando preguntas...")
+        
+        inicio = time.monotonic()
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix="paso2") as pool:
+            texto_preguntas = self.paso1_generar_preguntas_naturales(
+                contenido, num_preguntas, ajustes_modelo, archivos, log_file, sin_prompt_sistema,
+                usar_cache=usar_cache, al_generar=al_generar
+            )
+            segundos_paso1 = time.monotonic() - inicio
+            if texto_preguntas:
+                enviar_lotes(final=True)
+            resultados = [futuro.result() for futuro in pendientes]
+        segundos_total = time.monotonic() - inicio
+        
+        if not texto_preguntas:
+            print("❌ No se generaron preguntas en el Paso 1")
+            self._escribir_log(log_file, "\n❌ ERROR: No se generaron preguntas en el Paso 1")
+            return None
+        
+        self._registrar_tiempos(log_file, segundos_paso1, estado['segundos_paso2'], segundos_total, estado['lotes'])
+        if callback_progreso:
+            callback_progreso(90, "Uniendo lotes...")
+        return self._filtrar_preguntas([p for lote in resultados for p in lote], num_preguntas, log_file)
+    
+    def _registrar_tiempos(self, log_file: Path, segundos_paso1: float, segundos_paso2: float,
+                           segundos_total: float, lotes: int = None):
+        """Duración de cada paso; en paralelo, cuánto del paso 2 quedó oculto tras el paso 1"""
+        detalle = f"Paso 1: {segundos_paso1:.1f}s · Paso 2: {segundos_paso2:.1f}s"
+        if lotes is not None:
+            oculto = max(0.0, segundos_paso2 - (segundos_total - segundos_paso1))
+            detalle += f" en {lotes} lote(s), {oculto:.1f}s en paralelo con el paso 1"
+        detalle += f" · Total: {segundos_total:.1f}s"
+        print(f"⏱️  {detalle}")
+        self._escribir_log(log_file, f"\n⏱️ TIEMPOS: {detalle}")
+    
     def evaluar_respuesta(self, pregunta: PreguntaExamen, respuesta_usuario: str) -> tuple[int, str]:
         """Evalúa una respuesta del usuario usando el modelo de IA para análisis semántico"""
         # Preguntas de opción múltiple: evaluación directa
@@ -3,17 +3,55 @@ Adaptador para usar Ollama o llama-cpp-python de forma transparente
 """
 from pathlib import Path
 from typing import List, Dict, Optional
+import asyncio
 import json
-import requests
+import os
+import threading
+import time
+import httpx
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, nullcontext
 from datetime import datetime
 from generador_examenes import PreguntaExamen
+from cliente_ollama import obtener_cliente, obtener_cliente_sync, ErrorOllama
+from parser_incremental import ParserPreguntasIncremental, PLACEHOLDERS
+from escaner_json import spans_json, primer_json
+from proceso_llama import LlamaRemoto
+from prefijos_kv import completar, registrar_prefijo
+from presupuesto_tokens import obtener_contador, ContadorTokens, Presupuesto, TOKENS_MINIMOS_CONTENIDO
+from particion_contenido import dividir_en_partes, repartir_preguntas
+from duplicados import IndiceSimilitud, texto_pregunta
+from esquemas_json import (esquema_preguntas, esquema_practica, argumentos_restriccion, json_estricto,
+                           obtener_estadisticas_parseo, ESQUEMA_JSON_LIBRE)
+from plan_practica import planificar, prompt_grupo, tokens_grupo
+from cache_llm import (obtener_cache_respuestas, obtener_cache_evaluaciones, digest_archivo,
+                       hash_clave, normalizar_texto)
+
+
+@asynccontextmanager
+async def _sin_turno():
+    yield
+
+
+# Digest de cada modelo de Ollama (nombre → digest), para no pedir /api/tags en cada clave
+_digests_ollama: Dict[str, str] = {}
+_lock_digests = threading.Lock()
+
+
+def olvidar_digests_ollama():
+    """Descarta los digests guardados (al cambiar, instalar o eliminar modelos de Ollama)"""
+    with _lock_digests:
+        _digests_ollama.clear()
 
 
 class GeneradorUnificado:
     """Generador que puede usar Ollama o llama-cpp-python"""
     
+    TIMEOUT_CALENTAMIENTO = 300
+    
     def __init__(self, usar_ollama: bool = True, modelo_ollama: str = "llama3.2:3b", 
-                 modelo_path_gguf: str = None, n_gpu_layers: int = 35):
+                 modelo_path_gguf: str = None, n_gpu_layers: int = 35, n_ctx: int = 8192,
+                 gguf_en_proceso_separado: bool = False):
         self.usar_ollama = usar_ollama
         self.modelo_ollama = modelo_ollama
         # Convertir path relativo a absoluto
@@ -25,32 +63,89 @@ class GeneradorUnificado:
         else:
             self.modelo_path_gguf = None
         self.n_gpu_layers = n_gpu_layers
+        self.n_ctx = n_ctx
         self.llm = None
-        
-        # Sistema de logging detallado
+        # True: el GGUF se carga en un proceso hijo (proceso_llama.LlamaRemoto), como en el servidor
+        self.gguf_en_proceso_separado = gguf_en_proceso_separado
+        
+        # Residencia del modelo: keep_alive de Ollama (None = valor por defecto de Ollama)
+        self.keep_alive = None
+        # Salida restringida al esquema JSON de las preguntas (format de Ollama / gramática de llama-cpp)
+        self.salida_estructurada = True
+        # Casos de estudio en dos fases (casos_estudio.MotorCasosEstudio): escenario cacheado
+        # y campos en paralelo, en lugar de cada caso completo en la respuesta de la parte
+        self.casos_en_dos_fases = True
+        self._motor_casos = None
+        # Tipos reading de una práctica derivados de un pasaje compartido por parte (lecturas.MotorLecturas)
+        self.lecturas_compartidas = True
+        self._motor_lecturas = None
+        self.calentado = False
+        self.segundos_calentamiento = None
+        
+        # Sistema de logging detallado (estado por hilo: la instancia se comparte entre requests)
         self.log_dir = Path("logs_practicas_detallado")
         self.log_dir.mkdir(exist_ok=True)
-        self.current_log_file = None
-        self.log_data = {}
+        self._log_hilo = threading.local()
         
         if usar_ollama:
             self._verificar_ollama()
         else:
             self._cargar_modelo_gguf()
     
+    def calentar(self) -> bool:
+        """Precarga el modelo con un prompt mínimo para que los requests no paguen la carga en frío"""
+        inicio = time.monotonic()
+        try:
+            if self.usar_ollama:
+                # Mismas opciones de GPU que los requests reales: si cambian, Ollama recarga el modelo
+                opciones = {"num_predict": 1}
+                if self.n_gpu_layers <= 0:
+                    opciones["num_gpu"] = 0
+                obtener_cliente_sync().generar(
+                    self.modelo_ollama, "Hola", opciones,
+                    timeout=self.TIMEOUT_CALENTAMIENTO, keep_alive=self.keep_alive
+                )
+            elif self.llm is not None:
+                self.llm("Hola", max_tokens=1)
+            else:
+                return False
+        except Exception as e:
+            print(f"⚠️ No se pudo precargar el modelo: {e}")
+            return False
+        
+        self.calentado = True
+        self.segundos_calentamiento = round(time.monotonic() - inicio, 2)
+        motor = self.modelo_ollama if self.usar_ollama else Path(self.modelo_path_gguf).name
+        print(f"🔥 Modelo {motor} precargado en {self.segundos_calentamiento}s (keep_alive={self.keep_alive})")
+        return True
+    
+    @property
+    def log_data(self) -> dict:
+        return getattr(self._log_hilo, 'datos', {})
+    
+    @log_data.setter
+    def log_data(self, valor: dict):
+        self._log_hilo.datos = valor
+    
+    @property
+    def current_log_file(self) -> Optional[Path]:
+        return getattr(self._log_hilo, 'archivo', None)
+    
+    @current_log_file.setter
+    def current_log_file(self, valor: Optional[Path]):
+        self._log_hilo.archivo = valor
+    
     def _verificar_ollama(self):
         """Verifica que Ollama esté disponible"""
         try:
-            response = requests.get("http://localhost:11434/api/tags", timeout=2)
-            if response.status_code == 200:
-                modelos = response.json().get('models', [])
-                print(f"✅ Ollama activo - {len(modelos)} modelos")
-                if not any(m['name'].startswith(self.modelo_ollama.split(':')[0]) for m in modelos):
-                    print(f"⚠️ Modelo {self.modelo_ollama} no encontrado")
-                    print(f"   Ejecuta: ollama pull {self.modelo_ollama}")
-            else:
-                print("⚠️ Ollama no responde")
-                self.usar_ollama = False
+            modelos = obtener_cliente_sync().tags()
+            print(f"✅ Ollama activo - {len(modelos)} modelos")
+            if not any(m['name'].startswith(self.modelo_ollama.split(':')[0]) for m in modelos):
+                print(f"⚠️ Modelo {self.modelo_ollama} no encontrado")
+                print(f"   Ejecuta: ollama pull {self.modelo_ollama}")
+        except ErrorOllama:
+            print("⚠️ Ollama no responde")
+            self.usar_ollama = False
         except Exception as e:
             print(f"❌ Ollama no disponible: {e}")
             print("💡 Usando llama-cpp-python como fallback")
@@ -65,11 +160,14 @@ class GeneradorUnificado:
             return
         
         try:
-            from llama_cpp import Llama
+            if self.gguf_en_proceso_separado:
+                Llama = LlamaRemoto
+            else:
+                from llama_cpp import Llama
             print(f"🔄 Cargando GGUF: {self.modelo_path_gguf}")
             self.llm = Llama(
                 model_path=self.modelo_path_gguf,
-                n_ctx=8192,
+                n_ctx=self.n_ctx,
                 n_threads=6,
                 n_gpu_layers=self.n_gpu_layers,
                 verbose=False
@@ -258,106 +356,133 @@ class GeneradorUnificado:
         except Exception as e:
             print(f"❌ Error guardando log: {e}")
     
-    def _generar_ollama(self, prompt: str, max_tokens: int, temperature: float) -> str:
-        """Genera con Ollama"""
-        try:
-            # Detectar modelos lentos y ajustar solo el timeout
-            es_deepseek = 'deepseek' in self.modelo_ollama.lower()
-            
-            # Determinar si se usa GPU basado en n_gpu_layers
-            usar_gpu = self.n_gpu_layers > 0
-            modo_gpu = "GPU activada" if usar_gpu else "Solo CPU"
-            
-            print(f"\n{'='*60}")
-            print(f"🎮 Modelo Ollama: {self.modelo_ollama}")
-            print(f"⚙️  Configuración:")
-            print(f"   • Modo: {modo_gpu}")
-            print(f"   • Temperature: {temperature}")
-            print(f"   • Max tokens: {max_tokens}")
-            print(f"   • Prompt length: {len(prompt)} caracteres")
-            
-            if es_deepseek:
-                print(f"   • Modelo de razonamiento: DeepSeek-R1")
-                print(f"   • Genera razonamiento interno antes de responder")
-            print(f"{'='*60}\n")
-            
-            # Debug: mostrar inicio del prompt
-            print(f"📝 INICIO DEL PROMPT (primeros 500 chars):")
-            print(f"{prompt[:500]}")
-            print(f"...\n")
-            
-            # Timeout ajustado según modelo (sin cambiar max_tokens)
-            if es_deepseek:
-                timeout_segundos = 1800  # 30 minutos para DeepSeek-R1
-                print(f"⏱️  Timeout configurado: {timeout_segundos} segundos (30 minutos)")
-                print(f"💡 DeepSeek-R1 hace razonamiento complejo y puede tardar mucho")
-                print(f"💡 Vale la pena esperar por la calidad de sus respuestas...")
-            else:
-                timeout_segundos = 600  # 10 minutos para otros modelos
-                print(f"⏱️  Timeout configurado: {timeout_segundos} segundos (10 minutos)")
-                print(f"💡 Modelos grandes pueden tardar varios minutos...")
+    def _preparar_ollama(self, prompt: str, max_tokens: int, temperature: float, esquema=None):
+        """Muestra la configuración y arma (prompt_final, opciones, timeout) para /api/generate
+        esquema: salida restringida (se envía como format); no hace falta pedir el JSON al final"""
+        # Detectar modelos lentos y ajustar solo el timeout
+        es_deepseek = 'deepseek' in self.modelo_ollama.lower()
+        
+        # Determinar si se usa GPU basado en n_gpu_layers
+        usar_gpu = self.n_gpu_layers > 0
+        modo_gpu = "GPU activada" if usar_gpu else "Solo CPU"
+        
+        print(f"\n{'='*60}")
+        print(f"🎮 Modelo Ollama: {self.modelo_ollama}")
+        print(f"⚙️  Configuración:")
+        print(f"   • Modo: {modo_gpu}")
+        print(f"   • Temperature: {temperature}")
+        print(f"   • Max tokens: {max_tokens}")
+        print(f"   • Prompt length: {len(prompt)} caracteres")
+        
+        if es_deepseek:
+            print(f"   • Modelo de razonamiento: DeepSeek-R1")
+            print(f"   • Genera razonamiento interno antes de responder")
+        print(f"{'='*60}\n")
+        
+        # Debug: mostrar inicio del prompt
+        print(f"📝 INICIO DEL PROMPT (primeros 500 chars):")
+        print(f"{prompt[:500]}")
+        print(f"...\n")
+        
+        # Timeout ajustado según modelo (sin cambiar max_tokens)
+        if es_deepseek:
+            timeout_segundos = 1800  # 30 minutos para DeepSeek-R1
+            print(f"⏱️  Timeout configurado: {timeout_segundos} segundos (30 minutos)")
+            print(f"💡 DeepSeek-R1 hace razonamiento complejo y puede tardar mucho")
+            print(f"💡 Vale la pena esperar por la calidad de sus respuestas...")
+        else:
+            timeout_segundos = 600  # 10 minutos para otros modelos
+            print(f"⏱️  Timeout configurado: {timeout_segundos} segundos (10 minutos)")
             print(f"💡 Modelos grandes pueden tardar varios minutos...")
-            print(f"🚀 Enviando request a Ollama...\n")
-            
-            # Ajustar prompt para DeepSeek-R1 (permitir razonamiento, pero pedir JSON al final)
-            prompt_final = prompt
-            if es_deepseek:
-                # DeepSeek-R1 es un modelo de razonamiento - dejarlo razonar pero pedir JSON al final
-                prompt_final = f"""{prompt}
+        print(f"🚀 Enviando request a Ollama...\n")
+        
+        # Ajustar prompt para DeepSeek-R1 (permitir razonamiento, pero pedir JSON al final)
+        prompt_final = prompt
+        if es_deepseek and not esquema:
+            # DeepSeek-R1 es un modelo de razonamiento - dejarlo razonar pero pedir JSON al final
+            prompt_final = f"""{prompt}
 
 IMPORTANTE: Después de tu análisis, DEBES generar el JSON válido con la estructura solicitada.
 El JSON debe comenzar con {{ y terminar con }}.
 Puedes razonar primero, pero al final SIEMPRE incluye el JSON completo."""
-                print(f"📝 Prompt adaptado para DeepSeek-R1 (permite razonamiento + JSON al final)\n")
-            
-            # Configurar opciones según modo GPU/CPU
-            opciones = {
-                "temperature": temperature,
-                "num_predict": max_tokens,
-                "stop": ["<|eot_id|>", "<|end_of_text|>", "\n\n\n"]
-            }
-            
-            # Si n_gpu_layers es 0, forzar uso de CPU
-            if not usar_gpu:
-                opciones["num_gpu"] = 0
-                print(f"🔷 Modo CPU forzado (num_gpu=0)\n")
-            
-            response = requests.post(
-                "http://localhost:11434/api/generate",
-                json={
-                    "model": self.modelo_ollama,
-                    "prompt": prompt_final,
-                    "stream": False,
-                    "options": opciones
-                },
-                timeout=timeout_segundos
+            print(f"📝 Prompt adaptado para DeepSeek-R1 (permite razonamiento + JSON al final)\n")
+        
+        # Configurar opciones según modo GPU/CPU
+        opciones = {
+            "temperature": temperature,
+            "num_predict": max_tokens,
+            "stop": ["<|eot_id|>", "<|end_of_text|>", "\n\n\n"]
+        }
+        if esquema:
+            # Con format el JSON no se corta solo: los saltos de línea son espacio válido dentro de él
+            opciones["stop"] = ["<|eot_id|>", "<|end_of_text|>"]
+        
+        # Si n_gpu_layers es 0, forzar uso de CPU
+        if not usar_gpu:
+            opciones["num_gpu"] = 0
+            print(f"🔷 Modo CPU forzado (num_gpu=0)\n")
+        
+        return prompt_final, opciones, timeout_segundos
+    
+    def _procesar_respuesta_ollama(self, respuesta_json: dict) -> str:
+        """Extrae el texto de una respuesta de /api/generate"""
+        modo_gpu = "GPU activada" if self.n_gpu_layers > 0 else "Solo CPU"
+        print(f"✅ Generación completada ({modo_gpu})\n")
+        respuesta_completa = respuesta_json.get('response', '')
+        
+        if not respuesta_completa:
+            print(f"⚠️ ADVERTENCIA: Respuesta vacía")
+            print(f"   JSON completo: {respuesta_json}")
+            return None
+        
+        # Debug: Guardar respuesta completa
+        print(f"📝 Longitud de respuesta: {len(respuesta_completa)} caracteres")
+        print(f"📄 Primeros 500 caracteres:\n{respuesta_completa[:500]}\n")
+        if len(respuesta_completa) > 500:
+            print(f"📄 Últimos 500 caracteres:\n{respuesta_completa[-500:]}\n")
+        
+        return respuesta_completa
+    
+    def _generar_ollama(self, prompt: str, max_tokens: int, temperature: float, esquema=None) -> str:
+        """Genera con Ollama (síncrono, usa el pool compartido)"""
+        timeout_segundos = None
+        try:
+            prompt_final, opciones, timeout_segundos = self._preparar_ollama(prompt, max_tokens, temperature, esquema)
+            respuesta_json = obtener_cliente_sync().generar(
+                self.modelo_ollama, prompt_final, opciones, timeout=timeout_segundos, keep_alive=self.keep_alive,
+                format=esquema
             )
-            
-            print(f"📬 Response status: {response.status_code}")
-            
-            if response.status_code == 200:
-                print(f"✅ Generación completada ({modo_gpu})\n")
-                respuesta_json = response.json()
-                respuesta_completa = respuesta_json.get('response', '')
-                
-                if not respuesta_completa:
-                    print(f"⚠️ ADVERTENCIA: Respuesta vacía")
-                    print(f"   JSON completo: {respuesta_json}")
-                    return None
-                
-                # Debug: Guardar respuesta completa
-                print(f"📝 Longitud de respuesta: {len(respuesta_completa)} caracteres")
-                print(f"📄 Primeros 500 caracteres:\n{respuesta_completa[:500]}\n")
-                if len(respuesta_completa) > 500:
-                    print(f"📄 Últimos 500 caracteres:\n{respuesta_completa[-500:]}\n")
-                
-                return respuesta_completa
-            else:
-                error_detail = response.text if response.text else "Sin detalles"
-                print(f"❌ Error Ollama {response.status_code}")
-                print(f"   Detalles: {error_detail[:500]}")
-                return None
-        except requests.exceptions.Timeout:
+            return self._procesar_respuesta_ollama(respuesta_json)
+        except ErrorOllama as e:
+            print(f"❌ Error Ollama {e.status_code}")
+            print(f"   Detalles: {e.detalle[:500]}")
+            return None
+        except httpx.TimeoutException:
+            print(f"⏱️ TIMEOUT: La generación excedió {timeout_segundos} segundos")
+            print(f"   Considera usar menos preguntas o un modelo más pequeño")
+            return None
+        except Exception as e:
+            print(f"❌ Error Ollama: {type(e).__name__}: {e}")
+            import traceback
+            traceback.print_exc()
+            return None
+    
+    async def _generar_ollama_async(self, prompt: str, max_tokens: int, temperature: float,
+                                    esquema=None) -> str:
+        """Genera con Ollama sin bloquear el event loop (cancelable)"""
+        timeout_segundos = None
+        try:
+            prompt_final, opciones, timeout_segundos = self._preparar_ollama(prompt, max_tokens, temperature, esquema)
+            respuesta_json = await obtener_cliente().generar(
+                self.modelo_ollama, prompt_final, opciones, timeout=timeout_segundos, keep_alive=self.keep_alive,
+                format=esquema
+            )
+            return self._procesar_respuesta_ollama(respuesta_json)
+        except ErrorOllama as e:
+            print(f"❌ Error Ollama {e.status_code}")
+            print(f"   Detalles: {e.detalle[:500]}")
+            return None
+        except httpx.TimeoutException:
             print(f"⏱️ TIMEOUT: La generación excedió {timeout_segundos} segundos")
             print(f"   Considera usar menos preguntas o un modelo más pequeño")
             return None
@@ -367,84 +492,105 @@ Puedes razonar primero, pero al final SIEMPRE incluye el JSON completo."""
             traceback.print_exc()
             return None
     
+    def _preparar_ollama_chat(self, messages: list, max_tokens: int, temperature: float):
+        """Muestra la configuración y arma (opciones, timeout) para /api/chat"""
+        # Determinar si se usa GPU basado en n_gpu_layers
+        usar_gpu = self.n_gpu_layers > 0
+        modo_gpu = "GPU activada" if usar_gpu else "Solo CPU"
+        
+        print(f"\n{'='*60}")
+        print(f"💬 CHAT CON CONTEXTO - Modelo Ollama: {self.modelo_ollama}")
+        print(f"⚙️  Configuración:")
+        print(f"   • Modo: {modo_gpu}")
+        print(f"   • Temperature: {temperature}")
+        print(f"   • Max tokens: {max_tokens}")
+        print(f"   • Mensajes en historial: {len(messages)}")
+        print(f"{'='*60}\n")
+        
+        # Debug: mostrar estructura de mensajes
+        print(f"📜 Estructura del chat:")
+        for i, msg in enumerate(messages):
+            role = msg.get('role', 'unknown')
+            content_preview = msg.get('content', '')[:100]
+            print(f"   {i+1}. {role}: {content_preview}...")
+        print()
+        
+        # Timeout más largo para modelos grandes
+        timeout_segundos = 600  # 10 minutos
+        print(f"⏱️  Timeout configurado: {timeout_segundos} segundos")
+        print(f"🚀 Enviando request a Ollama API de chat...\n")
+        
+        # Configurar opciones según modo GPU/CPU
+        opciones = {
+            "temperature": temperature,
+            "num_predict": max_tokens,
+            "stop": ["<|eot_id|>", "<|end_of_text|>"]
+        }
+        
+        # Si n_gpu_layers es 0, forzar uso de CPU
+        if not usar_gpu:
+            opciones["num_gpu"] = 0
+            print(f"🔷 Modo CPU forzado (num_gpu=0)\n")
+        
+        return opciones, timeout_segundos
+    
+    def _procesar_respuesta_ollama_chat(self, respuesta_json: dict) -> str:
+        """Extrae el texto de una respuesta de /api/chat"""
+        modo_gpu = "GPU activada" if self.n_gpu_layers > 0 else "Solo CPU"
+        print(f"✅ Generación completada ({modo_gpu} y contexto)\n")
+        
+        # La API de chat devuelve el mensaje en un formato diferente
+        mensaje_respuesta = respuesta_json.get('message', {})
+        respuesta_completa = mensaje_respuesta.get('content', '')
+        
+        if not respuesta_completa:
+            print(f"⚠️ ADVERTENCIA: Respuesta vacía")
+            print(f"   JSON completo: {respuesta_json}")
+            return None
+        
+        # Debug: Guardar respuesta completa
+        print(f"📝 Longitud de respuesta: {len(respuesta_completa)} caracteres")
+        print(f"📄 Primeros 300 caracteres:\n{respuesta_completa[:300]}\n")
+        
+        return respuesta_completa
+    
     def _generar_ollama_chat(self, messages: list, max_tokens: int, temperature: float) -> str:
         """Genera con Ollama usando API de chat (mantiene historial/contexto)"""
+        timeout_segundos = None
         try:
-            # Determinar si se usa GPU basado en n_gpu_layers
-            usar_gpu = self.n_gpu_layers > 0
-            modo_gpu = "GPU activada" if usar_gpu else "Solo CPU"
-            
-            print(f"\n{'='*60}")
-            print(f"💬 CHAT CON CONTEXTO - Modelo Ollama: {self.modelo_ollama}")
-            print(f"⚙️  Configuración:")
-            print(f"   • Modo: {modo_gpu}")
-            print(f"   • Temperature: {temperature}")
-            print(f"   • Max tokens: {max_tokens}")
-            print(f"   • Mensajes en historial: {len(messages)}")
-            print(f"{'='*60}\n")
-            
-            # Debug: mostrar estructura de mensajes
-            print(f"📜 Estructura del chat:")
-            for i, msg in enumerate(messages):
-                role = msg.get('role', 'unknown')
-                content_preview = msg.get('content', '')[:100]
-                print(f"   {i+1}. {role}: {content_preview}...")
-            print()
-            
-            # Timeout más largo para modelos grandes
-            timeout_segundos = 600  # 10 minutos
-            print(f"⏱️  Timeout configurado: {timeout_segundos} segundos")
-            print(f"🚀 Enviando request a Ollama API de chat...\n")
-            
-            # Configurar opciones según modo GPU/CPU
-            opciones = {
-                "temperature": temperature,
-                "num_predict": max_tokens,
-                "stop": ["<|eot_id|>", "<|end_of_text|>"]
-            }
-            
-            # Si n_gpu_layers es 0, forzar uso de CPU
-            if not usar_gpu:
-                opciones["num_gpu"] = 0
-                print(f"🔷 Modo CPU forzado (num_gpu=0)\n")
-            
-            response = requests.post(
-                "http://localhost:11434/api/chat",
-                json={
-                    "model": self.modelo_ollama,
-                    "messages": messages,
-                    "stream": False,
-                    "options": opciones
-                },
-                timeout=timeout_segundos
+            opciones, timeout_segundos = self._preparar_ollama_chat(messages, max_tokens, temperature)
+            respuesta_json = obtener_cliente_sync().chat(
+                self.modelo_ollama, messages, opciones, timeout=timeout_segundos, keep_alive=self.keep_alive
             )
-            
-            print(f"📬 Response status: {response.status_code}")
-            
-            if response.status_code == 200:
-                print(f"✅ Generación completada ({modo_gpu} y contexto)\n")
-                respuesta_json = response.json()
-                
-                # La API de chat devuelve el mensaje en un formato diferente
-                mensaje_respuesta = respuesta_json.get('message', {})
-                respuesta_completa = mensaje_respuesta.get('content', '')
-                
-                if not respuesta_completa:
-                    print(f"⚠️ ADVERTENCIA: Respuesta vacía")
-                    print(f"   JSON completo: {respuesta_json}")
-                    return None
-                
-                # Debug: Guardar respuesta completa
-                print(f"📝 Longitud de respuesta: {len(respuesta_completa)} caracteres")
-                print(f"📄 Primeros 300 caracteres:\n{respuesta_completa[:300]}\n")
-                
-                return respuesta_completa
-            else:
-                error_detail = response.text if response.text else "Sin detalles"
-                print(f"❌ Error Ollama {response.status_code}")
-                print(f"   Detalles: {error_detail[:500]}")
-                return None
-        except requests.exceptions.Timeout:
+            return self._procesar_respuesta_ollama_chat(respuesta_json)
+        except ErrorOllama as e:
+            print(f"❌ Error Ollama {e.status_code}")
+            print(f"   Detalles: {e.detalle[:500]}")
+            return None
+        except httpx.TimeoutException:
+            print(f"⏱️ TIMEOUT: La generación excedió {timeout_segundos} segundos")
+            print(f"   Considera reducir el historial o usar un modelo más pequeño")
+            return None
+        except Exception as e:
+            print(f"❌ Error Ollama Chat: {type(e).__name__}: {e}")
+            import traceback
+            traceback.print_exc()
+            return None
+    
+    async def _generar_ollama_chat_async(self, messages: list, max_tokens: int, temperature: float) -> str:
+        """Versión asíncrona de _generar_ollama_chat (no bloquea el event loop, cancelable)"""
+        timeout_segundos = None
+        try:
+            opciones, timeout_segundos = self._preparar_ollama_chat(messages, max_tokens, temperature)
+            respuesta_json = await obtener_cliente().chat(
+                self.modelo_ollama, messages, opciones, timeout=timeout_segundos, keep_alive=self.keep_alive
+            )
+            return self._procesar_respuesta_ollama_chat(respuesta_json)
+        except ErrorOllama as e:
+            print(f"❌ Error Ollama {e.status_code}")
+            print(f"   Detalles: {e.detalle[:500]}")
+            return None
+        except httpx.TimeoutException:
             print(f"⏱️ TIMEOUT: La generación excedió {timeout_segundos} segundos")
             print(f"   Considera reducir el historial o usar un modelo más pequeño")
             return None
@@ -454,26 +600,247 @@ Puedes razonar primero, pero al final SIEMPRE incluye el JSON completo."""
             traceback.print_exc()
             return None
     
+    async def chat_stream_async(self, messages: list, max_tokens: int, temperature: float,
+                                top_p: float = 0.9, repeat_penalty: float = 1.15,
+                                usar_ollama: bool = None):
+        """Chat token a token (Ollama o GGUF)
+        
+        Produce {'texto': str} por cada fragmento y al final
+        {'fin': True, 'tokens_prompt': int, 'tokens_respuesta': int}.
+        Cerrar el generador (cliente desconectado) corta la generación del motor.
+        """
+        if usar_ollama is None:
+            usar_ollama = self.usar_ollama
+        
+        if usar_ollama:
+            opciones, timeout_segundos = self._preparar_ollama_chat(messages, max_tokens, temperature)
+            tokens_prompt = tokens_respuesta = 0
+            async for fragmento in obtener_cliente().chat_stream(
+                self.modelo_ollama, messages, opciones, timeout=timeout_segundos, keep_alive=self.keep_alive
+            ):
+                texto = fragmento.get('message', {}).get('content', '')
+                if texto:
+                    yield {'texto': texto}
+                if fragmento.get('done'):
+                    tokens_prompt = fragmento.get('prompt_eval_count', 0)
+                    tokens_respuesta = fragmento.get('eval_count', 0)
+            yield {'fin': True, 'tokens_prompt': tokens_prompt, 'tokens_respuesta': tokens_respuesta}
+            return
+        
+        if self.llm is None:
+            raise RuntimeError("No hay modelo GGUF cargado")
+        
+        # llama-cpp itera en un hilo y entrega los tokens por una cola al event loop
+        loop = asyncio.get_running_loop()
+        cola: asyncio.Queue = asyncio.Queue()
+        cancelado = threading.Event()
+        FIN = object()
+        
+        def entregar(item):
+            try:
+                loop.call_soon_threadsafe(cola.put_nowait, item)
+            except RuntimeError:
+                pass  # El event loop ya se cerró
+        
+        def producir():
+            try:
+                for chunk in self.llm.create_chat_completion(
+                    messages=messages,
+                    max_tokens=max_tokens,
+                    temperature=temperature,
+                    top_p=top_p,
+                    repeat_penalty=repeat_penalty,
+                    stop=["\n\nHuman:", "\n\nUser:", "</s>"],
+                    stream=True
+                ):
+                    if cancelado.is_set():
+                        print("🛑 Generación GGUF cancelada (cliente desconectado)")
+                        break
+                    texto = chunk['choices'][0].get('delta', {}).get('content')
+                    if texto:
+                        entregar(texto)
+            except Exception as e:
+                entregar(e)
+            finally:
+                entregar(FIN)
+        
+        hilo = threading.Thread(target=producir, daemon=True)
+        hilo.start()
+        
+        tokens_respuesta = 0
+        try:
+            while True:
+                item = await cola.get()
+                if item is FIN:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                tokens_respuesta += 1
+                yield {'texto': item}
+        finally:
+            cancelado.set()
+        
+        try:
+            texto_prompt = "\n".join(m.get('content', '') for m in messages)
+            tokens_prompt = len(self.llm.tokenize(texto_prompt.encode('utf-8')))
+        except Exception:
+            tokens_prompt = 0
+        yield {'fin': True, 'tokens_prompt': tokens_prompt, 'tokens_respuesta': tokens_respuesta}
+    
     def _generar_gguf(self, prompt: str, max_tokens: int, temperature: float, 
-                     top_p: float, repeat_penalty: float) -> str:
-        """Genera con llama-cpp-python"""
+                     top_p: float, repeat_penalty: float, esquema=None) -> str:
+        """Genera con llama-cpp-python (esquema: salida restringida por gramática)"""
         if not self.llm:
             return None
         
         try:
-            resp = self.llm(
+            resp = completar(
+                self.llm,
                 prompt,
                 max_tokens=max_tokens,
                 temperature=temperature,
                 top_p=top_p,
                 repeat_penalty=repeat_penalty,
-                stop=["<|eot_id|>", "<|end_of_text|>", "```"]
+                stop=["<|eot_id|>", "<|end_of_text|>", "```"],
+                **argumentos_restriccion(self.llm, esquema)
             )
             return resp['choices'][0]['text']
         except Exception as e:
             print(f"❌ Error GGUF: {e}")
             return None
     
+    async def _generar_gguf_async(self, prompt: str, max_tokens: int, temperature: float,
+                                  top_p: float, repeat_penalty: float, esquema=None) -> str:
+        """Ejecuta _generar_gguf en un hilo para no bloquear el event loop"""
+        return await asyncio.to_thread(
+            self._generar_gguf, prompt, max_tokens, temperature, top_p, repeat_penalty, esquema
+        )
+    
+    def _stream_ollama(self, prompt: str, max_tokens: int, temperature: float, esquema=None):
+        """Itera el texto de /api/generate a medida que llega
+        
+        Corta (sin error) al superar el timeout total; cerrar el iterador aborta la petición.
+        """
+        prompt_final, opciones, timeout_segundos = self._preparar_ollama(prompt, max_tokens, temperature, esquema)
+        limite = time.monotonic() + timeout_segundos
+        stream = obtener_cliente_sync().generar_stream(
+            self.modelo_ollama, prompt_final, opciones, timeout=timeout_segundos, keep_alive=self.keep_alive,
+            format=esquema
+        )
+        try:
+            for fragmento in stream:
+                texto = fragmento.get('response', '')
+                if texto:
+                    yield texto
+                if time.monotonic() > limite:
+                    print(f"⏱️ TIMEOUT: La generación excedió {timeout_segundos} segundos - se conserva lo generado")
+                    return
+        finally:
+            stream.close()
+    
+    def _stream_gguf(self, prompt: str, max_tokens: int, temperature: float,
+                     top_p: float, repeat_penalty: float, esquema=None):
+        """Itera el texto de llama-cpp-python a medida que se genera"""
+        stream = completar(
+            self.llm,
+            prompt,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            top_p=top_p,
+            repeat_penalty=repeat_penalty,
+            stop=["<|eot_id|>", "<|end_of_text|>", "```"],
+            stream=True,
+            **argumentos_restriccion(self.llm, esquema)
+        )
+        try:
+            for chunk in stream:
+                texto = chunk['choices'][0].get('text', '')
+                if texto:
+                    yield texto
+        finally:
+            stream.close()
+    
+    def generar_texto(self, prompt: str, max_tokens: int = 400, temperature: float = 0.3,
+                      top_p: float = 0.9, repeat_penalty: float = 1.1, timeout: float = 120) -> str:
+        """Completado corto con el motor activo (evaluaciones y utilidades).
+        No agrega instrucciones al prompt. Lanza excepción si el motor falla"""
+        if self.usar_ollama:
+            opciones = {"temperature": temperature, "top_p": top_p,
+                        "repeat_penalty": repeat_penalty, "num_predict": max_tokens}
+            respuesta_json = obtener_cliente_sync().generar(
+                self.modelo_ollama, prompt, opciones, timeout=timeout, keep_alive=self.keep_alive
+            )
+            return respuesta_json.get('response', '')
+        
+        if not self.llm:
+            raise RuntimeError("No hay modelo GGUF cargado")
+        resp = completar(
+            self.llm,
+            prompt,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            top_p=top_p,
+            repeat_penalty=repeat_penalty
+        )
+        return resp['choices'][0]['text']
+    
+    async def generar_texto_async(self, prompt: str, max_tokens: int = 400, temperature: float = 0.3,
+                                  top_p: float = 0.9, repeat_penalty: float = 1.1, timeout: float = 120) -> str:
+        """Versión asíncrona de generar_texto"""
+        if self.usar_ollama:
+            opciones = {"temperature": temperature, "top_p": top_p,
+                        "repeat_penalty": repeat_penalty, "num_predict": max_tokens}
+            respuesta_json = await obtener_cliente().generar(
+                self.modelo_ollama, prompt, opciones, timeout=timeout, keep_alive=self.keep_alive
+            )
+            return respuesta_json.get('response', '')
+        
+        return await asyncio.to_thread(
+            self.generar_texto, prompt, max_tokens, temperature, top_p, repeat_penalty, timeout
+        )
+    
+    def generar_json(self, prompt: str, esquema: dict, ajustes_modelo: dict, usar_cache: bool = True) -> Optional[dict]:
+        """Completado corto que devuelve el primer objeto JSON de la respuesta (o None)
+
+        esquema restringe la salida si salida_estructurada está activa. Las respuestas que
+        parsean se guardan en la caché de respuestas; usar_cache=False no la consulta.
+        """
+        esquema = esquema if self.salida_estructurada else None
+        clave_cache = self._clave_cache(prompt, ajustes_modelo, esquema)
+        cache = obtener_cache_respuestas()
+        if usar_cache:
+            guardada = cache.obtener(clave_cache)
+            if guardada is not None:
+                datos = primer_json(guardada)
+                if datos is not None:
+                    return datos
+
+        max_tokens = ajustes_modelo.get('max_tokens', 700)
+        temperature = ajustes_modelo.get('temperature', 0.4)
+        if self.usar_ollama:
+            respuesta = self._generar_ollama(prompt, max_tokens, temperature, esquema)
+        else:
+            respuesta = self._generar_gguf(prompt, max_tokens, temperature, ajustes_modelo.get('top_p', 0.9),
+                                           ajustes_modelo.get('repeat_penalty', 1.15), esquema)
+        datos = primer_json(respuesta or "")
+        if datos is not None:
+            cache.guardar(clave_cache, respuesta)
+        return datos
+
+    def motor_casos(self):
+        """MotorCasosEstudio de este generador (uno por instancia: comparte los locks de escenario)"""
+        if self._motor_casos is None:
+            from casos_estudio import MotorCasosEstudio
+            self._motor_casos = MotorCasosEstudio(self)
+        return self._motor_casos
+
+    def motor_lecturas(self):
+        """MotorLecturas de este generador (uno por instancia: comparte los locks de pasaje)"""
+        if self._motor_lecturas is None:
+            from lecturas import MotorLecturas
+            self._motor_lecturas = MotorLecturas(self)
+        return self._motor_lecturas
+
     def generar_examen(self, contenido_documento: str, 
                       num_preguntas: Dict[str, int] = None,
                       callback_progreso = None,
@@ -481,10 +848,24 @@ Puedes razonar primero, pero al final SIEMPRE incluye el JSON completo."""
                       archivos: list = None,
                       session_id: str = None,
                       sin_prompt_sistema: bool = False,
-                      tipo_caso: str = None) -> List[PreguntaExamen]:
+                      tipo_caso: str = None,
+                      streaming: bool = False,
+                      callback_pregunta = None,
+                      usar_cache: bool = True,
+                      evitar: List[str] = None,
+                      esquema_personalizado: dict = None) -> List[PreguntaExamen]:
         """Genera examen usando Ollama o GGUF
         sin_prompt_sistema: Si es True, usa el contenido directamente sin agregar instrucciones
         tipo_caso: Para casos de estudio, especifica el tipo (descriptivo, analitico, resolucion, etc.)
+        streaming: Parsea las preguntas a medida que se generan, corta al completar la cantidad
+                   pedida y conserva lo generado si hay timeout
+        callback_pregunta: Con streaming, se llama con cada PreguntaExamen en cuanto se completa
+        usar_cache: Si es False no reutiliza respuestas anteriores para el mismo prompt (preguntas nuevas)
+        evitar: Generación complementaria: enunciados ya incluidos en el examen; el prompt pide
+                solo num_preguntas y sobre contenido distinto al de esas preguntas
+        esquema_personalizado: Esquema JSON de la respuesta con prompt personalizado (por defecto JSON libre)
+        Si la respuesta queda corta (p. ej. cortada por max_tokens) se devuelven las preguntas
+        completas y lo que falta de cada tipo queda en ultimos_faltantes (del mismo hilo)
         """
         
         # INICIAR LOG DETALLADO
@@ -523,9 +904,11 @@ Puedes razonar primero, pero al final SIEMPRE incluye el JSON completo."""
             self._guardar_log()
             raise TypeError(f"contenido_documento debe ser string, recibido: {type(contenido_documento)}")
         
-        # Crear prompt
-        contenido_corto = contenido_documento[:8000]
+        # Crear prompt: el contenido ocupa lo que deja libre la ventana del modelo tras
+        # las instrucciones y los tokens reservados para la respuesta
         total = sum(num_preguntas.values())
+        presupuesto = Presupuesto(self.contador_tokens(), ajustes_modelo.get('max_tokens', 3000))
+        contenido_corto = contenido_documento
         
         # IMPORTANTE: Si hay casos de estudio, SIEMPRE usar _crear_prompt
         # porque necesita las instrucciones detalladas del tipo de caso
@@ -538,36 +921,110 @@ Puedes razonar primero, pero al final SIEMPRE incluye el JSON completo."""
                 # El prompt del usuario tiene formato "prompt_personalizado\n\nCONTENIDO:\ncontenido_real"
                 partes = contenido_documento.split("CONTENIDO:", 1)
                 if len(partes) > 1:
-                    contenido_corto = partes[1].strip()[:8000]
+                    contenido_corto = partes[1].strip()
             
-            prompt = self._crear_prompt(contenido_corto, num_preguntas, total, tipo_caso)
+            presupuesto.consumir('instrucciones', self._crear_prompt("", num_preguntas, total, tipo_caso, evitar))
+            contenido_corto = presupuesto.recortar('contenido', contenido_corto, minimo=TOKENS_MINIMOS_CONTENIDO)
+            prompt = self._crear_prompt(contenido_corto, num_preguntas, total, tipo_caso, evitar)
             print(f"🎯 CASOS DE ESTUDIO DETECTADOS: Usando prompt estructurado con tipo '{tipo_caso}'")
             print(f"   Contenido extraído: {len(contenido_corto)} caracteres")
         elif sin_prompt_sistema:
             # Modo prompt personalizado: usar contenido directamente (solo si NO hay casos de estudio)
-            prompt = contenido_corto
+            # Las cantidades del prompt del usuario son las del examen completo: una generación
+            # complementaria las reemplaza al final con las que faltan
+            nota = self._nota_complemento(num_preguntas, evitar) if evitar is not None else ""
+            presupuesto.consumir('instrucciones', nota)
+            prompt = presupuesto.recortar('contenido', contenido_corto, minimo=TOKENS_MINIMOS_CONTENIDO) + nota
             print(f"🎯 MODO PROMPT PERSONALIZADO: Usando prompt del usuario directamente")
         else:
             # Modo normal: agregar formato del sistema
-            prompt = self._crear_prompt(contenido_corto, num_preguntas, total, tipo_caso)
+            presupuesto.consumir('instrucciones', self._crear_prompt("", num_preguntas, total, tipo_caso, evitar))
+            contenido_corto = presupuesto.recortar('contenido', contenido_corto, minimo=TOKENS_MINIMOS_CONTENIDO)
+            prompt = self._crear_prompt(contenido_corto, num_preguntas, total, tipo_caso, evitar)
+        
+        # El prompt del sistema fija el formato de cada tipo; uno personalizado trae el suyo
+        esquema = self._esquema_salida(num_preguntas, personalizado=sin_prompt_sistema and not tiene_casos,
+                                       esquema_personalizado=esquema_personalizado)
         
         # Registrar prompt
         self._agregar_log('prompt_enviado', prompt)
+        self._agregar_log('presupuesto_tokens', presupuesto.resumen())
+        self._agregar_log('salida_estructurada', esquema is not None)
         
         if callback_progreso:
             motor = "Ollama + GPU" if self.usar_ollama else "llama-cpp-python"
             callback_progreso(25, f"Generando con {motor}...")
         
+        # Caché de respuestas: mismo modelo + mismo prompt + mismas opciones = misma respuesta
+        cache = obtener_cache_respuestas()
+        clave_cache = self._clave_cache(prompt, ajustes_modelo, esquema)
+        respuesta_cacheada = cache.obtener(clave_cache) if usar_cache else None
+        self._agregar_log('cache', {'usar_cache': usar_cache, 'acierto': respuesta_cacheada is not None})
+        
         # Generar
         print(f"\n{'='*60}")
-        print(f"🤖 Generando {total} preguntas con IA...")
+        if respuesta_cacheada:
+            print(f"♻️ Reutilizando respuesta en caché ({len(respuesta_cacheada)} caracteres)")
+        else:
+            print(f"🤖 Generando {total} preguntas con IA...")
         print(f"{'='*60}")
         
-        if self.usar_ollama:
+        if streaming:
+            preguntas, respuesta, motivo_fin = self._generar_streaming(
+                prompt, num_preguntas, ajustes_modelo, callback_progreso, callback_pregunta,
+                texto_cacheado=respuesta_cacheada, esquema=esquema
+            )
+            if respuesta:
+                self._agregar_log('respuesta_modelo', respuesta)
+            # Solo una respuesta recién generada y no interrumpida cuenta para la tasa de fallos
+            medir = not respuesta_cacheada and motivo_fin in ('completado', 'cupo')
+            
+            if preguntas:
+                if medir:
+                    self._registrar_parseo(esquema, respuesta, preguntas, truncada=motivo_fin == 'cupo')
+                self._agregar_log('preguntas_parseadas', [p.to_dict() for p in preguntas])
+                if num_preguntas and any(v > 0 for v in num_preguntas.values()):
+                    preguntas = self._filtrar_preguntas(preguntas, num_preguntas)
+                # Una respuesta incompleta no se guarda: repetir la petición debe intentarlo de nuevo
+                faltantes = self._informar_faltantes(preguntas, num_preguntas)
+                if not respuesta_cacheada and motivo_fin in ('completado', 'cupo') and not faltantes:
+                    cache.guardar(clave_cache, respuesta)
+                self._agregar_log('resultado_final', [p.to_dict() for p in preguntas])
+                self._guardar_log()
+                if callback_progreso:
+                    callback_progreso(100, f"¡{len(preguntas)} preguntas generadas!")
+                return preguntas
+            
+            if not respuesta:
+                error_msg = "No se obtuvo respuesta del modelo"
+                print(f"❌ {error_msg}")
+                self._agregar_log('errores', error_msg)
+                self._informar_faltantes([], num_preguntas)
+                self._guardar_log()
+                return []
+            
+            # El parser incremental no reconoció el formato: extracción clásica sobre el texto completo
+            print(f"💡 Sin preguntas en streaming, usando extracción sobre la respuesta completa")
+            if callback_progreso:
+                callback_progreso(70, "Procesando respuesta...")
+            preguntas = self._extraer_preguntas(respuesta, num_preguntas)
+            if medir:
+                self._registrar_parseo(esquema, respuesta, preguntas)
+            faltantes = self._informar_faltantes(preguntas, num_preguntas)
+            if preguntas and not respuesta_cacheada and motivo_fin == 'completado' and not faltantes:
+                cache.guardar(clave_cache, respuesta)
+            if callback_progreso:
+                callback_progreso(100, f"¡{len(preguntas)} preguntas generadas!")
+            return preguntas
+        
+        if respuesta_cacheada:
+            respuesta = respuesta_cacheada
+        elif self.usar_ollama:
             respuesta = self._generar_ollama(
                 prompt, 
                 ajustes_modelo['max_tokens'], 
-                ajustes_modelo['temperature']
+                ajustes_modelo['temperature'],
+                esquema
             )
         else:
             respuesta = self._generar_gguf(
@@ -575,13 +1032,15 @@ Puedes razonar primero, pero al final SIEMPRE incluye el JSON completo."""
                 ajustes_modelo['max_tokens'],
                 ajustes_modelo['temperature'],
                 ajustes_modelo['top_p'],
-                ajustes_modelo['repeat_penalty']
+                ajustes_modelo['repeat_penalty'],
+                esquema
             )
         
         if not respuesta:
             error_msg = "No se obtuvo respuesta del modelo"
             print(f"❌ {error_msg}")
             self._agregar_log('errores', error_msg)
+            self._informar_faltantes([], num_preguntas)
             self._guardar_log()
             return []
         
@@ -593,15 +1052,477 @@ Puedes razonar primero, pero al final SIEMPRE incluye el JSON completo."""
         
         # Parsear JSON
         preguntas = self._extraer_preguntas(respuesta, num_preguntas)
+        if not respuesta_cacheada:
+            self._registrar_parseo(esquema, respuesta, preguntas)
+        faltantes = self._informar_faltantes(preguntas, num_preguntas)
+        if preguntas and not respuesta_cacheada and not faltantes:
+            cache.guardar(clave_cache, respuesta)
         
         if callback_progreso:
             callback_progreso(100, f"¡{len(preguntas)} preguntas generadas!")
         
         return preguntas
     
-    def _crear_prompt(self, contenido: str, num_preguntas: Dict[str, int], total: int, tipo_caso: str = None) -> str:
+    def contador_tokens(self, usar_ollama: bool = None) -> ContadorTokens:
+        """Tokenizador y ventana de contexto del motor (medidos una vez por modelo)"""
+        if usar_ollama is None:
+            usar_ollama = self.usar_ollama
+        if usar_ollama:
+            return obtener_contador('ollama', self.modelo_ollama)
+        return obtener_contador('gguf', self.modelo_path_gguf, llm=self.llm, ventana=self.n_ctx)
+
+    # Generación por partes: partes de una misma petición en curso a la vez (el turno
+    # del planificador limita además cuántas llegan al motor)
+    PARTES_SIMULTANEAS = 8
+    # Generación complementaria de lo que falta (tipos que el modelo no entregó, partes
+    # fallidas, casi duplicadas descartadas): rondas como máximo, y ninguna empieza
+    # pasados SEGUNDOS_REPOSICION desde el final de la primera pasada
+    RONDAS_REPOSICION = 2
+    SEGUNDOS_REPOSICION = 120
+
+    def tokens_contenido_por_parte(self, num_preguntas: Dict[str, int], ajustes_modelo: dict,
+                                   encabezado: str = "", sin_prompt_sistema: bool = False,
+                                   tipo_caso: str = None) -> int:
+        """Tokens de contenido que caben en una llamada a generar_examen (mismo reparto que ella)"""
+        presupuesto = Presupuesto(self.contador_tokens(), ajustes_modelo.get('max_tokens', 3000))
+        if sin_prompt_sistema and not num_preguntas.get('case_study', 0):
+            presupuesto.consumir('instrucciones', f"{encabezado}\n\nCONTENIDO:\n" if encabezado else "")
+        else:
+            presupuesto.consumir('instrucciones', self._crear_prompt(
+                "", num_preguntas, sum(num_preguntas.values()), tipo_caso))
+        return max(presupuesto.restante, TOKENS_MINIMOS_CONTENIDO)
+
+    def generar_examen_por_partes(self, contenido_documento: str,
+                                  num_preguntas: Dict[str, int],
+                                  encabezado: str = "",
+                                  ajustes_modelo: dict = None,
+                                  sin_prompt_sistema: bool = False,
+                                  tipo_caso: str = None,
+                                  callback_progreso=None,
+                                  callback_pregunta=None,
+                                  turno=None,
+                                  indice_similitud: IndiceSimilitud = None,
+                                  **opciones) -> List[PreguntaExamen]:
+        """generar_examen sobre documentos de cualquier longitud (map-reduce)
+
+        El contenido se divide en partes que caben en la ventana del modelo, cortadas en
+        los límites de sección; las cantidades por tipo se reparten entre las partes a lo
+        largo de todo el documento y cada parte se genera por separado, varias a la vez.
+        Al final se unen respetando el cupo de cada tipo.
+        Las preguntas casi duplicadas (entre partes, o de indice_similitud: p. ej. exámenes
+        anteriores de la carpeta) se descartan antes de publicarse. Lo que falte de cada tipo
+        (descartadas, respuestas cortas, partes fallidas) se pide en generaciones pequeñas
+        solo con esos tipos, sobre las partes que menos aportaron y evitando las preguntas
+        ya incluidas (RONDAS_REPOSICION, SEGUNDOS_REPOSICION).
+        Con casos_en_dos_fases, los case_study no van en las partes: MotorCasosEstudio los
+        genera a la vez que ellas (escenario cacheado por contenido, campos en paralelo).
+        encabezado: prompt del usuario que precede a cada parte ("...\\n\\nCONTENIDO:\\n<parte>")
+        turno: fábrica de context managers que envuelve cada llamada al modelo
+        (p. ej. planificador.turno_sync). opciones: resto de argumentos de generar_examen.
+        """
+        if ajustes_modelo is None:
+            ajustes_modelo = {'temperature': 0.25, 'max_tokens': 3000, 'top_p': 0.9, 'repeat_penalty': 1.15}
+        turno = turno or nullcontext
+        cupo = self._cupo_por_tipo(num_preguntas)
+        indice = indice_similitud if indice_similitud is not None else IndiceSimilitud()
+        num_casos = cupo.pop('case_study', 0) if self.casos_en_dos_fases else 0
+
+        contador = self.contador_tokens()
+        max_tokens = self.tokens_contenido_por_parte(cupo or {'case_study': num_casos}, ajustes_modelo,
+                                                     encabezado, sin_prompt_sistema, tipo_caso)
+        if contador.contar(contenido_documento) <= max_tokens:
+            partes = [contenido_documento]
+        else:
+            partes = dividir_en_partes(contenido_documento, max_tokens, contador)
+        tamanos = [len(p) for p in partes]
+
+        # Veredicto de duplicado por pregunta: se decide una vez, al publicarla en streaming
+        # o al unir los resultados (se guarda la pregunta para que su id no se reutilice)
+        veredictos: Dict[int, tuple] = {}
+        lock_veredictos = threading.Lock()
+
+        def aceptar(pregunta: PreguntaExamen) -> bool:
+            with lock_veredictos:
+                if id(pregunta) not in veredictos:
+                    veredictos[id(pregunta)] = (pregunta, indice.agregar_si_nueva(texto_pregunta(pregunta)))
+                return veredictos[id(pregunta)][1]
+
+        def publicar(pregunta: PreguntaExamen):
+            if aceptar(pregunta) and callback_pregunta:
+                callback_pregunta(pregunta)
+
+        casos = None
+        if num_casos:
+            # Los casos de estudio van en dos fases, a la vez que las partes del resto de tipos
+            pool_casos = ThreadPoolExecutor(max_workers=1, thread_name_prefix="casos-estudio")
+            casos = pool_casos.submit(
+                self.motor_casos().generar, contenido_documento, num_casos, tipo_caso,
+                max_tokens_contenido=max_tokens, turno=turno,
+                usar_cache=opciones.get('usar_cache', True), callback_pregunta=publicar
+            )
+            pool_casos.shutdown(wait=False)
+            if not cupo:
+                return [c for c in casos.result() if aceptar(c)]
+
+        def ejecutar(tareas: List[tuple], etiqueta: str, opciones_llamada: dict) -> List:
+            progreso = [0] * len(tareas)
+            lock_progreso = threading.Lock()
+
+            def generar_parte(n: int, parte: str, cantidades: Dict[str, int]):
+                def al_progresar(valor: int, mensaje: str):
+                    if len(tareas) == 1 and not etiqueta:
+                        callback_progreso(valor, mensaje)
+                        return
+                    with lock_progreso:
+                        progreso[n] = valor
+                        total = 10 + int(0.85 * sum(progreso) / len(progreso))
+                    callback_progreso(total, f"{etiqueta}Parte {n + 1}/{len(tareas)}: {mensaje}")
+
+                texto = f"{encabezado}\n\nCONTENIDO:\n{parte}" if encabezado else parte
+                try:
+                    with turno():
+                        return self.generar_examen(
+                            texto, cantidades,
+                            callback_progreso=al_progresar if callback_progreso else None,
+                            callback_pregunta=publicar,
+                            ajustes_modelo=ajustes_modelo,
+                            sin_prompt_sistema=sin_prompt_sistema,
+                            tipo_caso=tipo_caso,
+                            **opciones_llamada
+                        )
+                except Exception as e:
+                    if len(tareas) == 1 and not etiqueta:
+                        raise
+                    # Una parte fallida no descarta las demás
+                    print(f"⚠️ {etiqueta}Parte {n + 1}/{len(tareas)} falló: {e}")
+                    return e
+
+            with ThreadPoolExecutor(max_workers=max(1, min(len(tareas), self.PARTES_SIMULTANEAS)),
+                                    thread_name_prefix="parte-examen") as pool:
+                return list(pool.map(lambda t: generar_parte(t[0], *t[1][1:]), enumerate(tareas)))
+
+        def asignar(cantidades_por_tipo: Dict[str, int], pesos: List[float]) -> List[tuple]:
+            # (índice de la parte, parte, cantidades) de las partes con preguntas asignadas
+            return [(i, parte, cantidades) for i, (parte, cantidades)
+                    in enumerate(zip(partes, repartir_preguntas(cantidades_por_tipo, pesos))) if cantidades]
+
+        tareas = asignar(cupo, tamanos)
+        if len(partes) > 1:
+            print(f"📚 Contenido dividido en {len(partes)} partes de hasta {max_tokens} tokens; "
+                  f"{len(tareas)} con preguntas asignadas")
+        resultados = ejecutar(tareas, "", opciones)
+        errores = [r for r in resultados if isinstance(r, Exception)]
+        if errores and len(errores) == len(resultados):
+            raise errores[0]
+
+        # Reduce: primero lo que cada parte aportó dentro de su cupo, luego sus excedentes
+        propias, excedentes = [], []
+        aportes = [0] * len(partes)
+
+        def unir(tareas: List[tuple], resultados: List):
+            for (i, _, cantidades), preguntas in zip(tareas, resultados):
+                if isinstance(preguntas, Exception):
+                    continue
+                usados: Dict[str, int] = {}
+                for pregunta in preguntas:
+                    tipo = self.MAPEO_TIPOS.get(pregunta.tipo, pregunta.tipo)
+                    usados[tipo] = usados.get(tipo, 0) + 1
+                    if not aceptar(pregunta):
+                        continue
+                    aportes[i] += 1
+                    (propias if usados[tipo] <= cantidades.get(tipo, 0) else excedentes).append(pregunta)
+
+        unir(tareas, resultados)
+
+        limite = time.monotonic() + self.SEGUNDOS_REPOSICION
+        for ronda in range(1, self.RONDAS_REPOSICION + 1):
+            hueco = self.faltantes_por_tipo(propias + excedentes, cupo)
+            if not hueco:
+                break
+            if time.monotonic() >= limite:
+                print(f"⏱️ Sin tiempo para completar {sum(hueco.values())} pregunta(s): {hueco}")
+                break
+            print(f"🔁 Completando {sum(hueco.values())} pregunta(s) que faltan (ronda {ronda}): {hueco}")
+            # El hueco va a las partes que menos preguntas aportaron (o que no tenían asignadas)
+            tareas = asignar(hueco, [tamano / (1 + aporte) for tamano, aporte in zip(tamanos, aportes)])
+            evitar = [texto_pregunta(p) for p in propias + excedentes]
+            # Sin caché: la misma respuesta traería las mismas preguntas
+            unir(tareas, ejecutar(tareas, "Completando · ", dict(opciones, usar_cache=False, evitar=evitar)))
+
+        preguntas = self._filtrar_preguntas(propias + excedentes, cupo)
+        if casos is not None:
+            preguntas += [c for c in casos.result() if aceptar(c)]
+        print(f"🧩 {len(preguntas)} preguntas unidas de {len(resultados) - len(errores)} partes "
+              f"({indice.descartadas} casi duplicadas descartadas)")
+        return preguntas
+
+    def generar_practica_por_grupos(self, contenido_documento: str,
+                                    num_preguntas: Dict[str, int],
+                                    encabezado: str,
+                                    ajustes_modelo: dict = None,
+                                    callback_progreso=None,
+                                    **opciones) -> List[PreguntaExamen]:
+        """Práctica con prompt personalizado dividida en generaciones por grupo de tipos
+
+        Pedir muchos tipos a la vez (flashcards, reading, writing, casos...) con una salida
+        de miles de tokens hace que los modelos chicos omitan tipos o corten el JSON. Cada
+        grupo de plan_practica recibe solo las secciones de formato de sus tipos, su propio
+        max_tokens y el esquema {"questions": [...]} de sus tipos; los grupos corren a la vez
+        (el turno del planificador limita cuántos llegan al motor) y se unen en el orden del plan.
+        Con lecturas_compartidas, los grupos reading no piden un texto por ejercicio: usan un
+        pasaje por parte del contenido y derivan de él cada tipo (lecturas.MotorLecturas).
+        opciones: resto de argumentos de generar_examen_por_partes (turno, indice_similitud...).
+        """
+        if ajustes_modelo is None:
+            ajustes_modelo = {'temperature': 0.7, 'max_tokens': 4000, 'top_p': 0.9, 'repeat_penalty': 1.15}
+        grupos = planificar(self._cupo_por_tipo(num_preguntas))
+
+        def generar_lecturas(cantidades: Dict[str, int], al_progresar):
+            return self.motor_lecturas().generar(
+                contenido_documento, cantidades, encabezado, ajustes_modelo,
+                turno=opciones.get('turno'), usar_cache=opciones.get('usar_cache', True),
+                indice_similitud=opciones.get('indice_similitud'),
+                callback_pregunta=opciones.get('callback_pregunta'), callback_progreso=al_progresar
+            )
+
+        def con_lecturas(cantidades: Dict[str, int]) -> bool:
+            return self.lecturas_compartidas and self.motor_lecturas().aplicable(cantidades, encabezado)
+
+        if len(grupos) == 1 and con_lecturas(grupos[0]):
+            return generar_lecturas(grupos[0], callback_progreso)
+        if len(grupos) <= 1:
+            return self.generar_examen_por_partes(
+                contenido_documento, num_preguntas, encabezado=encabezado, ajustes_modelo=ajustes_modelo,
+                sin_prompt_sistema=True, callback_progreso=callback_progreso, **opciones
+            )
+
+        print(f"🧭 Práctica dividida en {len(grupos)} generaciones por grupo de tipos:")
+        for n, cantidades in enumerate(grupos, 1):
+            print(f"   {n}. {cantidades} (max_tokens {tokens_grupo(cantidades, ajustes_modelo['max_tokens'])})")
+        if opciones.get('indice_similitud') is None:
+            opciones['indice_similitud'] = IndiceSimilitud()  # duplicadas también entre grupos
+
+        progreso = [0] * len(grupos)
+        lock_progreso = threading.Lock()
+
+        def generar_grupo(n: int, cantidades: Dict[str, int]):
+            def al_progresar(valor: int, mensaje: str):
+                with lock_progreso:
+                    progreso[n] = valor
+                    total = int(sum(progreso) / len(progreso))
+                callback_progreso(total, f"Grupo {n + 1}/{len(grupos)}: {mensaje}")
+
+            try:
+                if con_lecturas(cantidades):
+                    return generar_lecturas(cantidades, al_progresar if callback_progreso else None)
+                return self.generar_examen_por_partes(
+                    contenido_documento, cantidades,
+                    encabezado=prompt_grupo(encabezado, cantidades),
+                    ajustes_modelo=dict(ajustes_modelo, max_tokens=tokens_grupo(cantidades, ajustes_modelo['max_tokens'])),
+                    sin_prompt_sistema=True,
+                    callback_progreso=al_progresar if callback_progreso else None,
+                    esquema_personalizado=esquema_practica(cantidades),
+                    **opciones
+                )
+            except Exception as e:
+                # Un grupo fallido no descarta los demás
+                print(f"⚠️ Grupo {n + 1}/{len(grupos)} ({', '.join(cantidades)}) falló: {e}")
+                return e
+
+        with ThreadPoolExecutor(max_workers=len(grupos), thread_name_prefix="grupo-practica") as pool:
+            resultados = list(pool.map(lambda t: generar_grupo(*t), enumerate(grupos)))
+        errores = [r for r in resultados if isinstance(r, Exception)]
+        if len(errores) == len(resultados):
+            raise errores[0]
+
+        preguntas = [p for r in resultados if not isinstance(r, Exception) for p in r]
+        print(f"🧭 {len(preguntas)} preguntas de {len(grupos) - len(errores)}/{len(grupos)} grupos")
+        return preguntas
+
+    def _digest_modelo(self) -> str:
+        """Identidad del modelo para la caché: digest de Ollama o tamaño/fecha del GGUF"""
+        if not self.usar_ollama:
+            return digest_archivo(self.modelo_path_gguf) if self.modelo_path_gguf else ""
+        with _lock_digests:
+            digest = _digests_ollama.get(self.modelo_ollama)
+        if digest is not None:
+            return digest
+        try:
+            for m in obtener_cliente_sync().tags():
+                if m.get('name') in (self.modelo_ollama, f"{self.modelo_ollama}:latest"):
+                    with _lock_digests:
+                        _digests_ollama[self.modelo_ollama] = m.get('digest', '')
+                    return m.get('digest', '')
+        except Exception:
+            pass
+        return ""
+    
+    def _clave_cache(self, prompt: str, ajustes_modelo: dict, esquema=None) -> dict:
+        """Clave de la caché de respuestas (el prompt y el esquema van como hash)"""
+        clave = {
+            'motor': 'ollama' if self.usar_ollama else 'gguf',
+            'modelo': self.modelo_ollama if self.usar_ollama else self.modelo_path_gguf,
+            'digest': self._digest_modelo(),
+            'n_gpu_layers': self.n_gpu_layers,
+            'prompt': hash_clave({'prompt': prompt}),
+            'opciones': {
+                k: ajustes_modelo.get(k) for k in ('temperature', 'max_tokens', 'top_p', 'repeat_penalty')
+            }
+        }
+        if esquema:
+            clave['esquema'] = hash_clave({'esquema': esquema})
+        return clave
+    
+    def _esquema_salida(self, num_preguntas: Dict[str, int], personalizado: bool = False,
+                        esquema_personalizado: dict = None):
+        """Restricción de la salida: esquema de cada tipo pedido, o JSON libre si el prompt es
+        personalizado (define sus propios campos) salvo que se indique su esquema.
+        None con salida_estructurada desactivada"""
+        if not self.salida_estructurada:
+            return None
+        if personalizado:
+            return esquema_personalizado or ESQUEMA_JSON_LIBRE
+        return esquema_preguntas(self._cupo_por_tipo(num_preguntas)) or ESQUEMA_JSON_LIBRE
+    
+    def _registrar_parseo(self, esquema, respuesta: str, preguntas: list, truncada: bool = False):
+        """Cuenta la respuesta para la tasa de fallos de parseo del modo usado
+        truncada: el streaming se cortó al completar el cupo; lo recibido no puede cerrar el
+        JSON, así que basta con que empiece directamente con él (sin razonamiento ni texto)"""
+        if truncada:
+            json_valido = respuesta.lstrip().startswith(('{', '['))
+        else:
+            json_valido = json_estricto(respuesta) is not None
+        obtener_estadisticas_parseo().registrar(esquema is not None, json_valido, bool(preguntas))
+        self._agregar_log('parseo', {'restringida': esquema is not None, 'json_valido': json_valido,
+                                     'preguntas': len(preguntas)})
+    
+    def faltantes_por_tipo(self, preguntas: List[PreguntaExamen], num_preguntas: Dict[str, int]) -> Dict[str, int]:
+        """Cuántas preguntas faltan de cada tipo pedido (tipos normalizados; solo los incompletos)"""
+        obtenidas = {}
+        for pregunta in preguntas:
+            tipo = self.MAPEO_TIPOS.get(pregunta.tipo, pregunta.tipo)
+            obtenidas[tipo] = obtenidas.get(tipo, 0) + 1
+        return {tipo: n - obtenidas.get(tipo, 0)
+                for tipo, n in self._cupo_por_tipo(num_preguntas).items() if obtenidas.get(tipo, 0) < n}
+    
+    @property
+    def ultimos_faltantes(self) -> Dict[str, int]:
+        """Faltantes por tipo de la última generación de este hilo (ver generar_examen)"""
+        return dict(self.log_data.get('faltantes') or {})
+    
+    def _informar_faltantes(self, preguntas: List[PreguntaExamen], num_preguntas: Dict[str, int]) -> Dict[str, int]:
+        """Registra qué tipos quedaron cortos: solo esos hace falta volver a generar"""
+        faltantes = self.faltantes_por_tipo(preguntas, num_preguntas)
+        self._agregar_log('faltantes', faltantes)
+        if faltantes:
+            detalle = ", ".join(f"{tipo}: {n}" for tipo, n in faltantes.items())
+            print(f"⚠️ Faltan preguntas ({detalle}) - solo esas necesitan regenerarse")
+        return faltantes
+    
+    def _cupo_por_tipo(self, num_preguntas: Dict[str, int]) -> Dict[str, int]:
+        """Cantidades solicitadas con los tipos normalizados"""
+        cupo = {}
+        for tipo, cantidad in (num_preguntas or {}).items():
+            if cantidad > 0:
+                tipo_normalizado = self.MAPEO_TIPOS.get(tipo, tipo)
+                cupo[tipo_normalizado] = cupo.get(tipo_normalizado, 0) + cantidad
+        return cupo
+    
+    def _generar_streaming(self, prompt: str, num_preguntas: Dict[str, int], ajustes_modelo: dict,
+                           callback_progreso=None, callback_pregunta=None,
+                           texto_cacheado: str = None, esquema=None) -> tuple:
+        """Genera en streaming y parsea cada pregunta en cuanto se completa
+        
+        Se detiene en cuanto se cumple la cantidad pedida de cada tipo. Ante timeout
+        o error conserva las preguntas ya recibidas. Con texto_cacheado no llama al
+        modelo: reprocesa esa respuesta por el mismo camino.
+        Retorna (preguntas, texto_generado, motivo_fin)
+        """
+        parser = ParserPreguntasIncremental()
+        cupo = self._cupo_por_tipo(num_preguntas)
+        total = sum(cupo.values())
+        partes = []
+        preguntas = []
+        contador_por_tipo = {}
+        motivo_fin = 'completado'
+        
+        if texto_cacheado:
+            fuente = (texto for texto in [texto_cacheado])
+        elif self.usar_ollama:
+            fuente = self._stream_ollama(prompt, ajustes_modelo['max_tokens'], ajustes_modelo['temperature'], esquema)
+        else:
+            if not self.llm:
+                return [], "", 'error'
+            fuente = self._stream_gguf(
+                prompt,
+                ajustes_modelo['max_tokens'],
+                ajustes_modelo['temperature'],
+                ajustes_modelo['top_p'],
+                ajustes_modelo['repeat_penalty'],
+                esquema
+            )
+        
+        inicio = time.monotonic()
+        try:
+            for texto in fuente:
+                partes.append(texto)
+                for datos in parser.alimentar(texto):
+                    try:
+                        pregunta = PreguntaExamen.from_dict(datos)
+                    except Exception as e:
+                        error_msg = f"Error en pregunta {len(preguntas)+1}: {e}"
+                        print(f"❌ {error_msg}")
+                        self._agregar_log('errores', error_msg)
+                        continue
+                    
+                    preguntas.append(pregunta)
+                    tipo = self.MAPEO_TIPOS.get(pregunta.tipo, pregunta.tipo)
+                    contador_por_tipo[tipo] = contador_por_tipo.get(tipo, 0) + 1
+                    dentro_del_cupo = not cupo or contador_por_tipo[tipo] <= cupo.get(tipo, 0)
+                    print(f"✅ Pregunta {len(preguntas)} recibida ({time.monotonic() - inicio:.1f}s): "
+                          f"{pregunta.tipo} - {pregunta.pregunta[:50]}...")
+                    
+                    if dentro_del_cupo:
+                        if callback_pregunta:
+                            callback_pregunta(pregunta)
+                        if callback_progreso and total:
+                            listas = sum(min(contador_por_tipo.get(t, 0), n) for t, n in cupo.items())
+                            callback_progreso(25 + int(60 * listas / total), f"Pregunta {listas}/{total} generada")
+                
+                if cupo and all(contador_por_tipo.get(t, 0) >= n for t, n in cupo.items()):
+                    motivo_fin = 'cupo'
+                    print(f"✂️ Cantidad solicitada completa ({total}) - deteniendo la generación")
+                    break
+        except ErrorOllama as e:
+            motivo_fin = 'error'
+            print(f"❌ Error Ollama {e.status_code}")
+            print(f"   Detalles: {e.detalle[:500]}")
+        except httpx.TimeoutException:
+            motivo_fin = 'timeout'
+            print(f"⏱️ TIMEOUT: Ollama dejó de responder - se conservan {len(preguntas)} preguntas")
+        except Exception as e:
+            motivo_fin = 'error'
+            print(f"❌ Error en generación streaming: {type(e).__name__}: {e}")
+        finally:
+            fuente.close()
+        
+        respuesta = "".join(partes)
+        self._agregar_log('streaming', {
+            'motivo_fin': motivo_fin,
+            'segundos': round(time.monotonic() - inicio, 2),
+            'caracteres': len(respuesta),
+            'preguntas_recibidas': len(preguntas),
+            'objetos_descartados': parser.objetos_descartados,
+            'contador_por_tipo': contador_por_tipo
+        })
+        print(f"📡 Streaming finalizado ({motivo_fin}): {len(preguntas)} preguntas, {len(respuesta)} caracteres")
+        return preguntas, respuesta, motivo_fin
+    
+    def _crear_prompt(self, contenido: str, num_preguntas: Dict[str, int], total: int, tipo_caso: str = None,
+                      evitar: List[str] = None) -> str:
         """Crea el prompt optimizado
         tipo_caso: Para casos de estudio, especifica el tipo (descriptivo, analitico, resolucion, etc.)
+        evitar: preguntas ya incluidas en el examen (generación complementaria, ver generar_examen)
         """
         # Construir lista detallada de tipos de preguntas (USANDO NOMBRES NORMALIZADOS)
         tipos_detalle = []
@@ -670,16 +1591,53 @@ Puedes razonar primero, pero al final SIEMPRE incluye el JSON completo."""
         
         json_ejemplos_str = ",\n".join(json_ejemplos)
         
-        return f"""Eres un experto en crear exámenes educativos. Tu tarea es generar EXACTAMENTE {total} preguntas REALES basadas en el contenido proporcionado.
-
+        # Prefijo fijo (instrucciones y formato) + sufijo variable (contenido y cantidades):
+        # con llama-cpp el estado KV del prefijo se reutiliza entre exámenes (prefijos_kv)
+        prefijo = self.INSTRUCCIONES_EXAMEN
+        if caso_estudio_prompt:
+            prefijo += f"""
+FORMATO PARA LOS CASOS DE ESTUDIO ({tipo_caso}):
+{caso_estudio_prompt}
+"""
+        registrar_prefijo(prefijo)
+        
+        return prefijo + f"""
 CONTENIDO A EVALUAR:
 {contenido}
 
-IMPORTANTE - DEBES GENERAR {total} PREGUNTAS COMPLETAS:
+IMPORTANTE - DEBES GENERAR EXACTAMENTE {total} PREGUNTAS COMPLETAS:
 {tipos_str}
+{self._bloque_evitar(evitar)}
+AHORA GENERA LAS {total} PREGUNTAS COMPLETAS CON DATOS REALES:"""
+    
+    # Enunciados ya incluidos que se muestran al modelo en una generación complementaria
+    PREGUNTAS_A_EVITAR = 40
+
+    def _bloque_evitar(self, evitar: List[str] = None) -> str:
+        """Lista de preguntas que el modelo no debe repetir (vacío si no hay)"""
+        if not evitar:
+            return ""
+        lineas = "\n".join(f"- {' '.join(texto.split())[:120]}" for texto in evitar[-self.PREGUNTAS_A_EVITAR:])
+        return f"""
+YA ESTÁN EN EL EXAMEN (NO las repitas ni las parafrasees; pregunta sobre otros conceptos del contenido):
+{lineas}
+"""
+
+    def _nota_complemento(self, num_preguntas: Dict[str, int], evitar: List[str]) -> str:
+        """Cierre de un prompt personalizado en una generación complementaria"""
+        cupo = self._cupo_por_tipo(num_preguntas)
+        tipos = "\n".join(f'- {n} de tipo "{tipo}"' for tipo, n in cupo.items())
+        return f"""
+
+IMPORTANTE - GENERACIÓN COMPLEMENTARIA: ignora las cantidades indicadas arriba y genera SOLO estas {sum(cupo.values())} preguntas, con el mismo formato:
+{tipos}
+{self._bloque_evitar(evitar)}"""
+
+    # Parte fija del prompt de _crear_prompt (no depende del contenido ni de las cantidades)
+    INSTRUCCIONES_EXAMEN = """Eres un experto en crear exámenes educativos. Tu tarea es generar preguntas REALES basadas en el contenido proporcionado al final, en la cantidad exacta que se indica después del contenido.
 
 ⚠️ REGLAS CRÍTICAS:
-1. Genera EXACTAMENTE {total} preguntas COMPLETAS con contenido REAL
+1. Genera EXACTAMENTE la cantidad de preguntas indicada, COMPLETAS y con contenido REAL
 2. NO uses placeholders como "...", "[...]", "puntos: ..."
 3. CADA pregunta debe estar COMPLETAMENTE llena con:
    - "tipo": uno de estos valores exactos: "mcq", "true_false", "short_answer", "open_question"
@@ -692,25 +1650,24 @@ IMPORTANTE - DEBES GENERAR {total} PREGUNTAS COMPLETAS:
 6. Responde SOLO con JSON válido, sin código markdown, sin explicaciones adicionales
 
 FORMATO JSON VÁLIDO (con datos REALES, NO placeholders):
-{{
+{
   "preguntas": [
-    {{
+    {
       "tipo": "mcq",
       "pregunta": "¿Según el contenido, cuál es la diferencia principal entre arte y diseño?",
       "opciones": ["A) El arte es un sustantivo y el diseño es un verbo", "B) No hay diferencia", "C) El arte es comercial", "D) El diseño no comunica"],
       "respuesta_correcta": "A",
       "puntos": 3
-    }},
-    {{
+    },
+    {
       "tipo": "short_answer",
       "pregunta": "Explica brevemente qué significa HCI según la clase",
       "respuesta_correcta": "HCI significa Human-Computer Interaction (Interacción Humano-Computadora), que estudia cómo las personas interactúan con la tecnología",
       "puntos": 3
-    }}
+    }
   ]
-}}
-
-AHORA GENERA LAS {total} PREGUNTAS COMPLETAS CON DATOS REALES:"""
+}
+"""
     
     def _obtener_prompt_caso_estudio(self, tipo_caso: str) -> str:
         """Retorna el formato JSON específico para cada tipo de caso de estudio
@@ -721,6 +1678,37 @@ AHORA GENERA LAS {total} PREGUNTAS COMPLETAS CON DATOS REALES:"""
         - Todos los arrays deben tener 4-6 elementos detallados
         """
     
+    # Mapeo de tipos nuevos a tipos del sistema
+    MAPEO_TIPOS = {
+        'flashcard': 'flashcard',
+        'mcq': 'mcq', 
+        'true_false': 'true_false',
+        'verdadero_falso': 'true_false',
+        'cloze': 'cloze',
+        'short_answer': 'short_answer',
+        'respuesta_corta': 'short_answer',
+        'open_question': 'open_question',
+        'desarrollo': 'open_question',
+        'case_study': 'case_study',
+        'caso_estudio': 'case_study',
+        'reading_comprehension': 'reading_comprehension',
+        'reading_true_false': 'reading_true_false',
+        'reading_cloze': 'reading_cloze',
+        'reading_skill': 'reading_skill',
+        'reading_matching': 'reading_matching',
+        'reading_sequence': 'reading_sequence',
+        'writing_short': 'writing_short',
+        'writing_paraphrase': 'writing_paraphrase',
+        'writing_correction': 'writing_correction',
+        'writing_transformation': 'writing_transformation',
+        'writing_essay': 'writing_essay',
+        'writing_sentence_builder': 'writing_sentence_builder',
+        'writing_picture_description': 'writing_picture_description',
+        'writing_email': 'writing_email',
+        'multiple': 'mcq',
+        'corta': 'short_answer'
+    }
+    
     def _filtrar_preguntas(self, preguntas: List[PreguntaExamen], num_preguntas: Dict[str, int]) -> List[PreguntaExamen]:
         """Filtra preguntas por tipo y cantidad solicitada
         
@@ -732,36 +1720,7 @@ AHORA GENERA LAS {total} PREGUNTAS COMPLETAS CON DATOS REALES:"""
         contador_por_tipo = {}
         preguntas_sobrantes = []
         
-        # Mapeo de tipos nuevos a tipos del sistema
-        mapeo_tipos = {
-            'flashcard': 'flashcard',
-            'mcq': 'mcq', 
-            'true_false': 'true_false',
-            'verdadero_falso': 'true_false',
-            'cloze': 'cloze',
-            'short_answer': 'short_answer',
-            'respuesta_corta': 'short_answer',
-            'open_question': 'open_question',
-            'desarrollo': 'open_question',
-            'case_study': 'case_study',
-            'caso_estudio': 'case_study',
-            'reading_comprehension': 'reading_comprehension',
-            'reading_true_false': 'reading_true_false',
-            'reading_cloze': 'reading_cloze',
-            'reading_skill': 'reading_skill',
-            'reading_matching': 'reading_matching',
-            'reading_sequence': 'reading_sequence',
-            'writing_short': 'writing_short',
-            'writing_paraphrase': 'writing_paraphrase',
-            'writing_correction': 'writing_correction',
-            'writing_transformation': 'writing_transformation',
-            'writing_essay': 'writing_essay',
-            'writing_sentence_builder': 'writing_sentence_builder',
-            'writing_picture_description': 'writing_picture_description',
-            'writing_email': 'writing_email',
-            'multiple': 'mcq',
-            'corta': 'short_answer'
-        }
+        mapeo_tipos = self.MAPEO_TIPOS
         
         # FASE 1: Seleccionar preguntas según cantidades solicitadas por tipo
         for pregunta in preguntas:
@@ -1018,6 +1977,30 @@ AHORA GENERA LAS {total} PREGUNTAS COMPLETAS CON DATOS REALES:"""
         
         return formatos_casos.get(tipo_caso, formatos_casos["descriptivo"])
     
+    @staticmethod
+    def _lista_preguntas(datos) -> Optional[list]:
+        """La lista de {"preguntas": [...]} / {"questions": [...]} / [...], o None"""
+        lista = datos.get('preguntas', datos.get('questions')) if isinstance(datos, dict) else datos
+        return lista if isinstance(lista, list) else None
+    
+    def _convertir_preguntas(self, lista: list, num_preguntas: Dict[str, int] = None) -> List[PreguntaExamen]:
+        """PreguntaExamen de cada dict de la lista, filtradas por la cantidad pedida"""
+        preguntas = []
+        for i, p in enumerate(lista):
+            try:
+                preguntas.append(PreguntaExamen.from_dict(p))
+            except Exception as e:
+                error_msg = f"Error en pregunta {i+1}: {e}"
+                print(f"❌ {error_msg}")
+                self._agregar_log('errores', error_msg)
+        self._agregar_log('preguntas_parseadas', [p.to_dict() for p in preguntas])
+        
+        if num_preguntas and any(v > 0 for v in num_preguntas.values()):
+            preguntas = self._filtrar_preguntas(preguntas, num_preguntas)
+        self._agregar_log('resultado_final', [p.to_dict() for p in preguntas])
+        self._guardar_log()
+        return preguntas
+    
     def _extraer_preguntas(self, respuesta: str, num_preguntas: Dict[str, int] = None) -> List[PreguntaExamen]:
         """Extrae preguntas del JSON"""
         try:
@@ -1025,45 +2008,28 @@ AHORA GENERA LAS {total} PREGUNTAS COMPLETAS CON DATOS REALES:"""
             print(f"🔍 EXTRAYENDO JSON DE LA RESPUESTA")
             print(f"{'='*60}")
             
-            # Estrategia mejorada para DeepSeek-R1: buscar TODOS los bloques JSON potenciales
-            # Buscar todas las apariciones de { que puedan ser inicio de JSON
-            posibles_jsons = []
+            # Salida restringida (o respuesta limpia): se usa tal cual. Las reparaciones de
+            # abajo solo hacen falta con salida libre
+            lista = self._lista_preguntas(json_estricto(respuesta))
+            if lista is not None:
+                print(f"✅ JSON válido: {len(lista)} preguntas sin necesidad de reparar la respuesta")
+                return self._convertir_preguntas(lista, num_preguntas)
             
-            for i, char in enumerate(respuesta):
-                if char == '{':
-                    # Encontrar el cierre balanceado del JSON desde esta posición
-                    nivel = 0
-                    fin = i
-                    en_string = False
-                    escape = False
-                    
-                    for j in range(i, len(respuesta)):
-                        c = respuesta[j]
-                        
-                        if escape:
-                            escape = False
-                            continue
-                        
-                        if c == '\\':
-                            escape = True
-                            continue
-                        
-                        if c == '"':
-                            en_string = not en_string
-                            continue
-                        
-                        if not en_string:
-                            if c == '{':
-                                nivel += 1
-                            elif c == '}':
-                                nivel -= 1
-                                if nivel == 0:
-                                    fin = j + 1
-                                    json_candidato = respuesta[i:fin]
-                                    # Solo considerar JSONs que parezcan razonables (> 50 chars)
-                                    if len(json_candidato) > 50:
-                                        posibles_jsons.append((i, fin, json_candidato))
-                                    break
+            # Respuesta cortada por num_predict o con errores de formato: se rescatan todas las
+            # preguntas que llegaron completas (el parser de streaming tolera lo demás)
+            parser = ParserPreguntasIncremental()
+            rescatadas = parser.alimentar(respuesta)
+            if rescatadas:
+                descartadas = f", {parser.objetos_descartados} descartadas" if parser.objetos_descartados else ""
+                print(f"🛟 JSON incompleto o inválido: {len(rescatadas)} preguntas completas rescatadas{descartadas}")
+                self._agregar_log('rescate', {'preguntas': len(rescatadas),
+                                              'descartadas': parser.objetos_descartados})
+                return self._convertir_preguntas(rescatadas, num_preguntas)
+            
+            # Todos los objetos balanceados (también los anidados) en una sola pasada: la
+            # respuesta puede traer razonamiento (DeepSeek-R1) o markdown alrededor del JSON.
+            # Solo se consideran los que parecen razonables (> 50 caracteres)
+            posibles_jsons = [(i, fin, respuesta[i:fin]) for i, fin in spans_json(respuesta) if fin - i > 50]
             
             print(f"🔍 Encontrados {len(posibles_jsons)} bloques JSON potenciales")
             
@@ -1076,42 +2042,28 @@ AHORA GENERA LAS {total} PREGUNTAS COMPLETAS CON DATOS REALES:"""
             posibles_jsons.sort(key=lambda x: len(x[2]), reverse=True)
             
             # FASE 1: Buscar JSON con array de preguntas completo
-            for idx, (start, end, candidato) in enumerate(posibles_jsons):
-                print(f"  📦 Candidato {idx+1}: posición {start}-{end}, tamaño {len(candidato)} chars")
-                print(f"     Inicio: {candidato[:80]}...")
-                
+            descartados_placeholders = 0
+            for start, end, candidato in posibles_jsons:
                 # PRIORIDAD 1: JSON con "preguntas" o "questions" (array completo)
                 if '"preguntas"' in candidato or '"questions"' in candidato:
                     # RECHAZAR si contiene placeholders COMO VALORES (no en texto de preguntas)
-                    tiene_placeholders = False
-                    if ('"puntos": ...' in candidato or 
-                        '"puntos":...' in candidato or
-                        '"opciones": [...]' in candidato or
-                        '"pregunta": "..."' in candidato or
-                        '": "..."' in candidato):
-                        print(f"     ⚠️ Contiene placeholders COMO VALORES, descartando")
-                        tiene_placeholders = True
-                    
-                    if not tiene_placeholders:
-                        print(f"     ✅ Contiene array de preguntas y NO tiene placeholders")
-                        json_str = candidato
-                        inicio = start
-                        fin = end
-                        break
-                else:
-                    print(f"     ⏭️ No contiene array 'preguntas', continuando búsqueda...")
+                    if any(p in candidato for p in PLACEHOLDERS):
+                        descartados_placeholders += 1
+                        continue
+                    print(f"  ✅ Contiene array de preguntas y NO tiene placeholders")
+                    json_str = candidato
+                    inicio = start
+                    fin = end
+                    break
+            if descartados_placeholders:
+                print(f"  ⚠️ {descartados_placeholders} candidato(s) con placeholders COMO VALORES descartados")
             
             # FASE 2: Si no encontró array completo, buscar preguntas individuales
             if json_str is None:
                 print(f"  💡 No se encontró array completo, buscando preguntas individuales...")
-                for idx, (start, end, candidato) in enumerate(posibles_jsons):
+                for start, end, candidato in posibles_jsons:
                     if '"tipo"' in candidato or '"type"' in candidato:
-                        tiene_placeholders = False
-                        if ('"puntos": ...' in candidato or 
-                            '"puntos":...' in candidato or
-                            '"opciones": [...]' in candidato or
-                            '"pregunta": "..."' in candidato or
-                            '": "..."' in candidato):
+                        if any(p in candidato for p in PLACEHOLDERS):
                             continue
                         
                         print(f"     ✅ Usando pregunta individual como fallback")
@@ -1132,26 +2084,10 @@ AHORA GENERA LAS {total} PREGUNTAS COMPLETAS CON DATOS REALES:"""
                 # Limpiar JSON de errores comunes del modelo
                 import re
                 
-                # 1. Eliminar comas antes de ] o }
+                # Eliminar comas antes de ] o } (el candidato ya está balanceado: un JSON
+                # cortado se rescató arriba pregunta por pregunta)
                 json_str = re.sub(r',(\s*[}\]])', r'\1', json_str)
                 
-                # 2. Si el JSON termina incompleto, intentar repararlo
-                # Buscar campos incompletos tipo: "explanation": "
-                json_str = re.sub(r'"\s*:\s*"[^"]*$', '": "Explicación no disponible"', json_str)
-                
-                # 3. Asegurar cierre de objetos y arrays
-                # Contar llaves y corchetes abiertos
-                count_braces = json_str.count('{') - json_str.count('}')
-                count_brackets = json_str.count('[') - json_str.count(']')
-                
-                # Cerrar los que falten
-                if count_braces > 0 or count_brackets > 0:
-                    print(f"⚠️ JSON incompleto: {count_braces} llaves, {count_brackets} corchetes sin cerrar")
-                    # Cerrar en orden inverso (primero objetos, luego arrays)
-                    json_str += '}' * count_braces
-                    json_str += ']' * count_brackets
-                    print(f"🔧 JSON reparado automáticamente")
-                
                 # Intentar parsear
                 try:
                     datos = json.loads(json_str)
@@ -1212,36 +2148,7 @@ AHORA GENERA LAS {total} PREGUNTAS COMPLETAS CON DATOS REALES:"""
                         preguntas_filtradas = []
                         contador_por_tipo = {}
                         
-                        # Mapeo de tipos nuevos a tipos del sistema
-                        mapeo_tipos = {
-                            'flashcard': 'flashcard',
-                            'mcq': 'mcq', 
-                            'true_false': 'true_false',
-                            'verdadero_falso': 'true_false',
-                            'cloze': 'cloze',
-                            'short_answer': 'short_answer',
-                            'respuesta_corta': 'short_answer',
-                            'open_question': 'open_question',
-                            'desarrollo': 'open_question',
-                            'case_study': 'case_study',
-                            'caso_estudio': 'case_study',
-                            'reading_comprehension': 'reading_comprehension',
-                            'reading_true_false': 'reading_true_false',
-                            'reading_cloze': 'reading_cloze',
-                            'reading_skill': 'reading_skill',
-                            'reading_matching': 'reading_matching',
-                            'reading_sequence': 'reading_sequence',
-                            'writing_short': 'writing_short',
-                            'writing_paraphrase': 'writing_paraphrase',
-                            'writing_correction': 'writing_correction',
-                            'writing_transformation': 'writing_transformation',
-                            'writing_essay': 'writing_essay',
-                            'writing_sentence_builder': 'writing_sentence_builder',
-                            'writing_picture_description': 'writing_picture_description',
-                            'writing_email': 'writing_email',
-                            'multiple': 'mcq',
-                            'corta': 'short_answer'
-                        }
+                        mapeo_tipos = self.MAPEO_TIPOS
                         
                         for pregunta in preguntas:
                             # DEBUG: Imprimir tipo exacto de la pregunta
@@ -1310,62 +2217,6 @@ AHORA GENERA LAS {total} PREGUNTAS COMPLETAS CON DATOS REALES:"""
                         print(f"📄 JSON problemático (primeros 500):\n{json_str[:500]}")
                         print(f"📄 Últimos 200 caracteres:\n{json_str[-200:]}")
                         
-                        # INTENTO DE REPARACIÓN AGRESIVA
-                        print(f"\n🔧 Intentando reparación agresiva del JSON...")
-                        
-                        # Eliminar texto después del último } válido
-                        ultimo_cierre = json_str.rfind('}')
-                        if ultimo_cierre > 0:
-                            json_str_cortado = json_str[:ultimo_cierre + 1]
-                            
-                            # Asegurar que cierra el array de preguntas
-                            if '"preguntas"' in json_str_cortado and not json_str_cortado.strip().endswith(']}'):
-                                json_str_cortado = json_str_cortado.rstrip() + ']}'
-                            
-                            try:
-                                datos = json.loads(json_str_cortado)
-                                print(f"✅ JSON reparado exitosamente cortando al último }}")
-                                
-                                # Continuar con el procesamiento normal
-                                campo_preguntas = None
-                                if 'preguntas' in datos:
-                                    campo_preguntas = 'preguntas'
-                                elif 'questions' in datos:
-                                    campo_preguntas = 'questions'
-                                
-                                if campo_preguntas:
-                                    lista_preguntas = datos[campo_preguntas]
-                                    if isinstance(lista_preguntas, list):
-                                        # Convertir a objetos PreguntaExamen
-                                        preguntas = []
-                                        preguntas_parseadas_log = []
-                                        
-                                        for i, pregunta_dict in enumerate(lista_preguntas):
-                                            try:
-                                                pregunta_obj = PreguntaExamen.from_dict(pregunta_dict)
-                                                preguntas.append(pregunta_obj)
-                                                print(f"✅ Pregunta {i+1}: {pregunta_obj.tipo} - {pregunta_obj.pregunta[:50]}...")
-                                                preguntas_parseadas_log.append(pregunta_obj.to_dict())
-                                            except Exception as e:
-                                                error_msg = f"Error en pregunta {i+1}: {e}"
-                                                print(f"❌ {error_msg}")
-                                                self._agregar_log('errores', error_msg)
-                                                continue
-                                        
-                                        self._agregar_log('preguntas_parseadas', preguntas_parseadas_log)
-                                        print(f"\n✅ Total: {len(preguntas)} preguntas generadas exitosamente")
-                                        
-                                        # Aplicar filtrado si es necesario
-                                        if num_preguntas and any(v > 0 for v in num_preguntas.values()):
-                                            preguntas = self._filtrar_preguntas(preguntas, num_preguntas)
-                                        
-                                        resultado_final = [p.to_dict() if hasattr(p, 'to_dict') else str(p) for p in preguntas]
-                                        self._agregar_log('resultado_final', resultado_final)
-                                        self._guardar_log()
-                                        return preguntas
-                            except:
-                                pass
-                        
                         self._agregar_log('errores', error_msg)
                         self._agregar_log('json_extraido', json_str[:1000])
                         self._guardar_log()
@@ -1410,14 +2261,18 @@ AHORA GENERA LAS {total} PREGUNTAS COMPLETAS CON DATOS REALES:"""
             self._guardar_log()
             return []
     
-    def evaluar_respuesta(self, pregunta: PreguntaExamen, respuesta_usuario) -> dict:
-        """Evalúa una respuesta del usuario"""
-        resultado = {
-            "correcta": False,
-            "puntos_obtenidos": 0,
-            "feedback": ""
-        }
-        
+    # Tipos que se evalúan con IA (el resto de tipos desconocidos también cae en IA)
+    TIPOS_EVALUACION_IA = ["corta", "desarrollo", "short_answer", "open_question", "case_study",
+                           "flashcard", "cloze",
+                           "reading_comprehension", "reading_true_false", "reading_cloze", 
+                           "reading_skill", "reading_matching", "reading_sequence",
+                           "writing_short", "writing_paraphrase", "writing_correction",
+                           "writing_transformation", "writing_essay", "writing_sentence_builder",
+                           "writing_picture_description", "writing_email"]
+    
+    @staticmethod
+    def _normalizar_respuesta_usuario(respuesta_usuario) -> str:
+        """Convierte la respuesta del usuario a string"""
         # Convertir lista a string si es necesario
         if isinstance(respuesta_usuario, list):
             respuesta_usuario = respuesta_usuario[0] if respuesta_usuario else ""
@@ -1425,6 +2280,16 @@ AHORA GENERA LAS {total} PREGUNTAS COMPLETAS CON DATOS REALES:"""
         # Validar que respuesta_usuario sea string
         if not isinstance(respuesta_usuario, str):
             respuesta_usuario = str(respuesta_usuario)
+        return respuesta_usuario
+    
+    def _evaluar_sin_ia(self, pregunta: PreguntaExamen, respuesta_usuario: str) -> Optional[dict]:
+        """Evalúa respuestas vacías, MCQ y verdadero/falso.
+        Retorna None si la pregunta requiere evaluación con IA"""
+        resultado = {
+            "correcta": False,
+            "puntos_obtenidos": 0,
+            "feedback": ""
+        }
         
         if not respuesta_usuario or respuesta_usuario.strip() == "":
             resultado["feedback"] = "No se proporcionó respuesta"
@@ -1446,8 +2311,9 @@ AHORA GENERA LAS {total} PREGUNTAS COMPLETAS CON DATOS REALES:"""
                 resultado["feedback"] = "¡Correcto!"
             else:
                 resultado["feedback"] = f"Incorrecto. La respuesta correcta es: {pregunta.respuesta_correcta}"
+            return resultado
         
-        elif pregunta.tipo == "verdadero_falso" or pregunta.tipo == "true_false":
+        if pregunta.tipo == "verdadero_falso" or pregunta.tipo == "true_false":
             # Extraer respuesta correcta de metadata si existe
             respuesta_correcta_display = pregunta.respuesta_correcta
             if hasattr(pregunta, 'metadata') and pregunta.metadata:
@@ -1462,28 +2328,217 @@ AHORA GENERA LAS {total} PREGUNTAS COMPLETAS CON DATOS REALES:"""
                 resultado["feedback"] = "¡Correcto!"
             else:
                 resultado["feedback"] = f"Incorrecto. La respuesta correcta es: {respuesta_correcta_display}"
+            return resultado
         
-        elif pregunta.tipo in ["corta", "desarrollo", "short_answer", "open_question", "case_study",
-                               "flashcard", "cloze",
-                               "reading_comprehension", "reading_true_false", "reading_cloze", 
-                               "reading_skill", "reading_matching", "reading_sequence",
-                               "writing_short", "writing_paraphrase", "writing_correction",
-                               "writing_transformation", "writing_essay", "writing_sentence_builder",
-                               "writing_picture_description", "writing_email"]:
+        if pregunta.tipo in self.TIPOS_EVALUACION_IA:
             # Para todos los demás tipos, usar IA para evaluar
             print(f"\n🤖 Evaluando respuesta de tipo '{pregunta.tipo}' con IA...")
-            resultado = self._evaluar_con_ia(pregunta, respuesta_usuario)
-        
         else:
             # Tipo desconocido - evaluar con IA por defecto
             print(f"\n⚠️ Tipo de pregunta desconocido: '{pregunta.tipo}' - usando evaluación con IA")
-            resultado = self._evaluar_con_ia(pregunta, respuesta_usuario)
-        
-        return resultado
+        return None
     
-    def _evaluar_con_ia(self, pregunta: PreguntaExamen, respuesta_usuario: str) -> dict:
-        """Evalúa una respuesta de desarrollo/corta usando IA"""
+    def evaluar_respuesta(self, pregunta: PreguntaExamen, respuesta_usuario) -> dict:
+        """Evalúa una respuesta del usuario"""
+        respuesta_usuario = self._normalizar_respuesta_usuario(respuesta_usuario)
+        resultado = self._evaluar_sin_ia(pregunta, respuesta_usuario)
+        if resultado is not None:
+            return resultado
+        return self._evaluar_con_ia(pregunta, respuesta_usuario)
+    
+    async def evaluar_respuesta_async(self, pregunta: PreguntaExamen, respuesta_usuario) -> dict:
+        """Versión asíncrona de evaluar_respuesta (no bloquea el event loop)"""
+        respuesta_usuario = self._normalizar_respuesta_usuario(respuesta_usuario)
+        resultado = self._evaluar_sin_ia(pregunta, respuesta_usuario)
+        if resultado is not None:
+            return resultado
+        return await self._evaluar_con_ia_async(pregunta, respuesta_usuario)
+    
+    # Evaluaciones con IA simultáneas: igual a los slots paralelos del servidor Ollama
+    PARALELISMO_EVALUACION = int(os.environ.get("OLLAMA_NUM_PARALLEL", 4))
+    
+    async def evaluar_respuestas_async(self, pares: List[tuple], paralelismo: int = None,
+                                       en_lote: bool = False, turno=None) -> List[dict]:
+        """Evalúa una lista de (pregunta, respuesta_usuario) y retorna los resultados en el mismo orden
+        
+        Vacías, MCQ y verdadero/falso se resuelven al instante; las que necesitan IA se
+        lanzan a la vez con un máximo de `paralelismo` llamadas en curso. Cada resultado
+        incluye latencia_ms (tiempo de evaluación, sin contar la espera por un slot).
+        Con en_lote=True las abiertas se agrupan en pocas llamadas (ver _evaluar_lote_async)
+        y solo las que el lote no puntuó se evalúan una a una.
+        turno: fábrica de context managers async que envuelve cada llamada al modelo
+        (p. ej. el planificador del servidor).
+        """
+        paralelismo = max(1, int(paralelismo or self.PARALELISMO_EVALUACION))
+        turno = turno or _sin_turno
+        resultados: List[Optional[dict]] = [None] * len(pares)
+        pendientes = []
+        
+        for i, (pregunta, respuesta_usuario) in enumerate(pares):
+            inicio = time.perf_counter()
+            respuesta_usuario = self._normalizar_respuesta_usuario(respuesta_usuario)
+            resultado = self._evaluar_sin_ia(pregunta, respuesta_usuario)
+            if resultado is None:
+                pendientes.append((i, pregunta, respuesta_usuario))
+            else:
+                resultados[i] = dict(resultado, latencia_ms=round((time.perf_counter() - inicio) * 1000, 2))
+        
+        semaforo = asyncio.Semaphore(paralelismo)
         
+        if en_lote and pendientes:
+            pendientes = await self._evaluar_en_lotes(pendientes, resultados, semaforo, turno)
+        
+        async def evaluar(i: int, pregunta: PreguntaExamen, respuesta_usuario: str):
+            async with semaforo, turno():
+                inicio = time.perf_counter()
+                resultado = await self._evaluar_con_ia_async(pregunta, respuesta_usuario)
+                resultados[i] = dict(resultado, latencia_ms=round((time.perf_counter() - inicio) * 1000, 2))
+        
+        if pendientes:
+            print(f"🤖 Evaluando {len(pendientes)} respuestas con IA (paralelismo {paralelismo})")
+            await asyncio.gather(*(evaluar(*p) for p in pendientes))
+        return resultados
+    
+    # Evaluación en lote: tokens reservados para la salida de cada pregunta y máximo
+    # de preguntas por llamada (la ventana es la del modelo activo)
+    TOKENS_RESPUESTA_LOTE = 220
+    MAX_PREGUNTAS_LOTE = 8
+    TIMEOUT_EVALUACION_LOTE = 180
+    
+    def _armar_lotes(self, pendientes: List[tuple], contador: ContadorTokens) -> List[List[tuple]]:
+        """Agrupa (i, pregunta, respuesta) en lotes que caben en el contexto"""
+        base = contador.contar(self._prompt_evaluacion_lote([]))
+        lotes, actual, tokens = [], [], base
+        for item in pendientes:
+            _, pregunta, respuesta_usuario = item
+            costo = (contador.contar(self._bloque_evaluacion(0, pregunta, respuesta_usuario))
+                     + self.TOKENS_RESPUESTA_LOTE)
+            if actual and (tokens + costo > contador.ventana or len(actual) >= self.MAX_PREGUNTAS_LOTE):
+                lotes.append(actual)
+                actual, tokens = [], base
+            actual.append(item)
+            tokens += costo
+        if actual:
+            lotes.append(actual)
+        return lotes
+    
+    async def _evaluar_en_lotes(self, pendientes: List[tuple], resultados: List[Optional[dict]],
+                                semaforo: asyncio.Semaphore, turno=_sin_turno) -> List[tuple]:
+        """Evalúa las pendientes en lotes y retorna las que quedaron sin puntuar"""
+        sin_cache = []
+        for i, pregunta, respuesta_usuario in pendientes:
+            inicio = time.perf_counter()
+            resultado = self._evaluacion_cacheada(self._clave_evaluacion(pregunta, respuesta_usuario))
+            if resultado is None:
+                sin_cache.append((i, pregunta, respuesta_usuario))
+            else:
+                resultados[i] = dict(resultado, latencia_ms=round((time.perf_counter() - inicio) * 1000, 2))
+        
+        lotes = self._armar_lotes(sin_cache, await asyncio.to_thread(self.contador_tokens)) if sin_cache else []
+        if lotes:
+            print(f"📦 Evaluando {len(sin_cache)} respuestas en {len(lotes)} lote(s)")
+        
+        async def evaluar_lote(lote: List[tuple]):
+            async with semaforo, turno():
+                inicio = time.perf_counter()
+                evaluados = await self._evaluar_lote_async(lote)
+                latencia = round((time.perf_counter() - inicio) * 1000, 2)
+            for i, resultado in evaluados.items():
+                resultados[i] = dict(resultado, latencia_ms=latencia)
+        
+        await asyncio.gather(*(evaluar_lote(lote) for lote in lotes))
+        
+        restantes = [item for item in sin_cache if resultados[item[0]] is None]
+        if restantes:
+            print(f"⚠️ {len(restantes)} respuesta(s) sin puntuar en el lote, se evalúan individualmente")
+        return restantes
+    
+    def _bloque_evaluacion(self, id_item: int, pregunta: PreguntaExamen, respuesta_usuario: str) -> str:
+        return f"""### id {id_item}
+PREGUNTA: {pregunta.pregunta}
+RESPUESTA MODELO: {self._respuesta_modelo_texto(pregunta)}
+RESPUESTA DEL ESTUDIANTE: {respuesta_usuario}
+PUNTOS MÁXIMOS: {pregunta.puntos}
+"""
+    
+    def _prompt_evaluacion_lote(self, lote: List[tuple]) -> str:
+        """Prompt con varias evaluaciones y salida en array JSON (un objeto por id)"""
+        bloques = "\n".join(
+            self._bloque_evaluacion(id_item, pregunta, respuesta_usuario)
+            for id_item, (_, pregunta, respuesta_usuario) in enumerate(lote)
+        )
+        return registrar_prefijo(self.INSTRUCCIONES_EVALUACION_LOTE) + f"""EVALUACIONES:
+{bloques}
+JSON:"""
+    
+    INSTRUCCIONES_EVALUACION_LOTE = """Eres un profesor evaluando varias respuestas de estudiantes. En cada evaluación compara la respuesta del estudiante con la respuesta modelo y proporciona retroalimentación específica.
+
+INSTRUCCIONES DE EVALUACIÓN (para cada id por separado):
+1. Identifica los CONCEPTOS CLAVE en la respuesta modelo
+2. Verifica cuáles están presentes en la respuesta del estudiante y cuáles FALTAN
+3. Asigna puntos proporcionales a los conceptos presentes, sin superar PUNTOS MÁXIMOS
+4. Proporciona retroalimentación ESPECÍFICA sobre qué falta comprender
+
+Responde ÚNICAMENTE con un array JSON con un objeto por cada id de las evaluaciones de abajo, en este formato exacto:
+[
+  {"id": 0, "puntos": <número decimal>, "conceptos_correctos": ["concepto1"], "conceptos_faltantes": ["concepto2"], "feedback": "Retroalimentación específica"}
+]
+
+"""
+    
+    @staticmethod
+    def _extraer_array_json(texto: str) -> Optional[list]:
+        """Primer array JSON válido del texto"""
+        return primer_json(texto, aperturas='[')
+    
+    async def _evaluar_lote_async(self, lote: List[tuple]) -> Dict[int, dict]:
+        """Una sola llamada para todo el lote. Retorna {índice original: resultado}
+        solo para las preguntas que el modelo puntuó correctamente"""
+        prompt = self._prompt_evaluacion_lote(lote)
+        opciones = dict(self.OPCIONES_EVALUACION,
+                        num_predict=self.TOKENS_RESPUESTA_LOTE * len(lote) + 100)
+        try:
+            if self.usar_ollama:
+                respuesta_json = await obtener_cliente().generar(
+                    self.modelo_ollama, prompt, opciones,
+                    timeout=self.TIMEOUT_EVALUACION_LOTE, keep_alive=self.keep_alive
+                )
+                texto = respuesta_json.get('response', '')
+            else:
+                # GGUF: mismo prompt con completar (seguro entre hilos) vía generar_texto_async
+                texto = await self.generar_texto_async(
+                    prompt, max_tokens=opciones['num_predict'], temperature=opciones['temperature']
+                )
+        except Exception as e:
+            print(f"⚠️ Error en evaluación por lote: {e}")
+            return {}
+        
+        datos = self._extraer_array_json(texto or '')
+        if datos is None:
+            print("⚠️ El lote no devolvió un array JSON")
+            return {}
+        
+        evaluados = {}
+        for evaluacion in datos:
+            if not isinstance(evaluacion, dict):
+                continue
+            try:
+                id_item = int(evaluacion.get('id'))
+                puntos = float(evaluacion.get('puntos'))
+            except (TypeError, ValueError):
+                continue
+            if not 0 <= id_item < len(lote) or lote[id_item][0] in evaluados:
+                continue
+            i, pregunta, respuesta_usuario = lote[id_item]
+            evaluacion['puntos'] = min(max(puntos, 0.0), float(pregunta.puntos))
+            resultado = self._resultado_evaluacion(pregunta, evaluacion)
+            obtener_cache_evaluaciones().guardar(self._clave_evaluacion(pregunta, respuesta_usuario), resultado)
+            evaluados[i] = resultado
+        return evaluados
+    
+    @staticmethod
+    def _respuesta_modelo_texto(pregunta: PreguntaExamen) -> str:
+        """Texto de la respuesta esperada según el tipo de pregunta"""
         # Extraer respuesta correcta dependiendo del tipo
         respuesta_modelo = pregunta.respuesta_correcta
         
@@ -1510,10 +2565,13 @@ AHORA GENERA LAS {total} PREGUNTAS COMPLETAS CON DATOS REALES:"""
         # Si aún es None o vacío, usar un placeholder
         if not respuesta_modelo or respuesta_modelo == 'None':
             respuesta_modelo = "No hay respuesta modelo definida para esta pregunta"
+        return respuesta_modelo
+    
+    def _prompt_evaluacion(self, pregunta: PreguntaExamen, respuesta_usuario: str) -> str:
+        """Prompt de evaluación de una respuesta abierta"""
+        respuesta_modelo = self._respuesta_modelo_texto(pregunta)
         
-        prompt = f"""Eres un profesor evaluando una respuesta de estudiante. Compara la respuesta del estudiante con la respuesta modelo y proporciona retroalimentación específica.
-
-PREGUNTA:
+        return registrar_prefijo(self.INSTRUCCIONES_EVALUACION) + f"""PREGUNTA:
 {pregunta.pregunta}
 
 RESPUESTA MODELO (lo que se esperaba):
@@ -1524,154 +2582,225 @@ RESPUESTA DEL ESTUDIANTE:
 
 PUNTOS MÁXIMOS: {pregunta.puntos}
 
+JSON:"""
+    
+    # Parte fija del prompt de evaluación: va primero para reutilizar su KV-cache
+    INSTRUCCIONES_EVALUACION = """Eres un profesor evaluando una respuesta de estudiante. Compara la respuesta del estudiante con la respuesta modelo y proporciona retroalimentación específica.
+
 INSTRUCCIONES DE EVALUACIÓN:
 1. Identifica los CONCEPTOS CLAVE en la respuesta modelo
 2. Verifica cuáles de esos conceptos están presentes en la respuesta del estudiante
 3. Identifica qué conceptos FALTAN o están INCOMPLETOS
-4. Asigna puntos proporcionales a los conceptos presentes
+4. Asigna puntos proporcionales a los conceptos presentes, de 0 a PUNTOS MÁXIMOS
 5. Proporciona retroalimentación ESPECÍFICA sobre qué falta comprender
 
 Responde ÚNICAMENTE con JSON en este formato exacto:
-{{
-  "puntos": <número decimal de 0 a {pregunta.puntos}>,
+{
+  "puntos": <número decimal de 0 a PUNTOS MÁXIMOS>,
   "conceptos_correctos": ["concepto1", "concepto2"],
   "conceptos_faltantes": ["concepto3", "concepto4"],
   "feedback": "Retroalimentación específica explicando qué conceptos domina y cuáles le faltan comprender"
-}}
-
-JSON:"""
+}
 
+"""
+    
+    # Opciones de Ollama para evaluación
+    OPCIONES_EVALUACION = {
+        "temperature": 0.3,  # Más determinístico
+        "num_predict": 400   # Más tokens para retroalimentación detallada
+    }
+    TIMEOUT_EVALUACION = 60
+    
+    def _interpretar_evaluacion(self, pregunta: PreguntaExamen, respuesta_ia: str) -> Optional[dict]:
+        """Convierte la respuesta JSON del modelo en el resultado de evaluación.
+        Retorna None si no se encontró un objeto JSON válido"""
+        print(f"📝 Respuesta IA (primeros 300 chars): {respuesta_ia[:300]}")
+        
+        evaluacion = primer_json(respuesta_ia)
+        if evaluacion is None:
+            return None
+        return self._resultado_evaluacion(pregunta, evaluacion)
+    
+    def _resultado_evaluacion(self, pregunta: PreguntaExamen, evaluacion: dict) -> dict:
+        """Resultado de evaluación a partir del JSON del modelo (puntos, conceptos, feedback)"""
+        puntos = float(evaluacion.get('puntos', 0))
+        conceptos_correctos = evaluacion.get('conceptos_correctos', [])
+        conceptos_faltantes = evaluacion.get('conceptos_faltantes', [])
+        feedback_base = evaluacion.get('feedback', 'Sin evaluación')
+        
+        # Construir feedback detallado
+        feedback = feedback_base
+        if conceptos_correctos:
+            feedback += f"\\n\\n✅ Conceptos que dominas: {', '.join(conceptos_correctos)}"
+        if conceptos_faltantes:
+            feedback += f"\\n\\n❌ Conceptos que te faltan comprender: {', '.join(conceptos_faltantes)}"
+        
+        print(f"✅ Evaluación: {puntos}/{pregunta.puntos} puntos")
+        print(f"✅ Conceptos correctos: {conceptos_correctos}")
+        print(f"❌ Conceptos faltantes: {conceptos_faltantes}")
+        
+        return {
+            "correcta": puntos >= pregunta.puntos * 0.6,  # 60% o más es correcto
+            "puntos_obtenidos": puntos,
+            "feedback": feedback,
+            "conceptos_correctos": conceptos_correctos,
+            "conceptos_faltantes": conceptos_faltantes
+        }
+    
+    def _evaluacion_fallback(self, pregunta: PreguntaExamen, respuesta_usuario: str) -> dict:
+        """Evaluación simple por palabras clave cuando no hay respuesta de la IA"""
+        print("⚠️ Usando evaluación fallback")
+        
+        # Extraer texto de respuesta correcta (puede ser dict en flashcards)
+        respuesta_modelo = pregunta.respuesta_correcta
+        if isinstance(respuesta_modelo, dict):
+            respuesta_modelo = respuesta_modelo.get('answer', str(respuesta_modelo))
+        if not isinstance(respuesta_modelo, str):
+            respuesta_modelo = str(respuesta_modelo)
+        
+        palabras_correctas = set(respuesta_modelo.lower().split())
+        palabras_usuario = set(respuesta_usuario.lower().split())
+        coincidencias = len(palabras_correctas.intersection(palabras_usuario))
+        similitud = coincidencias / len(palabras_correctas) if palabras_correctas else 0
+        
+        puntos = pregunta.puntos * similitud
+        
+        if similitud >= 0.7:
+            feedback = "¡Excelente! Respuesta muy completa."
+        elif similitud >= 0.5:
+            feedback = "Bien, pero podrías agregar más detalles."
+        elif similitud >= 0.3:
+            feedback = "Parcialmente correcto, faltan conceptos clave."
+        else:
+            feedback = f"Incompleto. Respuesta esperada: {respuesta_modelo}"
+        
+        return {
+            "correcta": similitud >= 0.6,
+            "puntos_obtenidos": round(puntos, 1),
+            "feedback": feedback
+        }
+    
+    def _evaluacion_error(self, pregunta: PreguntaExamen, error: Exception) -> dict:
+        """Resultado cuando la evaluación con IA lanzó una excepción"""
+        print(f"❌ Error evaluando con IA: {error}")
+        import traceback
+        traceback.print_exc()
+        
+        # Extraer respuesta modelo para fallback
+        respuesta_modelo = pregunta.respuesta_correcta
+        if isinstance(respuesta_modelo, dict):
+            respuesta_modelo = respuesta_modelo.get('answer', 'No disponible')
+        if not isinstance(respuesta_modelo, str):
+            respuesta_modelo = str(respuesta_modelo)
+        
+        # Fallback
+        return {
+            "correcta": False,
+            "puntos_obtenidos": 0,
+            "feedback": f"Error en evaluación. Respuesta esperada: {respuesta_modelo}"
+        }
+    
+    def _clave_evaluacion(self, pregunta: PreguntaExamen, respuesta_usuario: str) -> dict:
+        """Clave de la caché de evaluaciones: modelo que evalúa (motor, nombre o archivo y
+        digest), pregunta, respuesta modelo y respuesta normalizada"""
+        return {
+            'motor': 'ollama' if self.usar_ollama else 'gguf',
+            'modelo': self.modelo_ollama if self.usar_ollama else self.modelo_path_gguf,
+            'digest': self._digest_modelo(),
+            'tipo': pregunta.tipo,
+            'pregunta': pregunta.pregunta,
+            'puntos': pregunta.puntos,
+            'respuesta_modelo': self._respuesta_modelo_texto(pregunta),
+            'respuesta': normalizar_texto(respuesta_usuario)
+        }
+    
+    def _evaluacion_cacheada(self, clave: dict) -> Optional[dict]:
+        resultado = obtener_cache_evaluaciones().obtener(clave)
+        if resultado is not None:
+            print(f"⚡ Evaluación desde caché: {resultado.get('puntos_obtenidos')} puntos")
+            return dict(resultado)
+        return None
+    
+    def _evaluar_con_ia(self, pregunta: PreguntaExamen, respuesta_usuario: str) -> dict:
+        """Evalúa una respuesta de desarrollo/corta usando IA"""
+        clave = self._clave_evaluacion(pregunta, respuesta_usuario)
+        resultado = self._evaluacion_cacheada(clave)
+        if resultado is not None:
+            return resultado
+        prompt = self._prompt_evaluacion(pregunta, respuesta_usuario)
+        
         try:
+            texto = None
             if self.usar_ollama:
                 # Evaluar con Ollama
-                response = requests.post(
-                    "http://localhost:11434/api/generate",
-                    json={
-                        "model": self.modelo_ollama,
-                        "prompt": prompt,
-                        "stream": False,
-                        "options": {
-                            "temperature": 0.3,  # Más determinístico
-                            "num_predict": 400   # Más tokens para retroalimentación detallada
-                        }
-                    },
-                    timeout=60
-                )
-                
-                if response.status_code == 200:
-                    respuesta_ia = response.json()['response']
-                    print(f"📝 Respuesta IA (primeros 300 chars): {respuesta_ia[:300]}")
-                    
-                    # Extraer JSON balanceado
-                    inicio = respuesta_ia.find('{')
-                    if inicio >= 0:
-                        nivel = 0
-                        fin = inicio
-                        en_string = False
-                        escape = False
-                        
-                        for i in range(inicio, len(respuesta_ia)):
-                            char = respuesta_ia[i]
-                            
-                            if escape:
-                                escape = False
-                                continue
-                            
-                            if char == '\\':
-                                escape = True
-                                continue
-                            
-                            if char == '"':
-                                en_string = not en_string
-                                continue
-                            
-                            if not en_string:
-                                if char == '{':
-                                    nivel += 1
-                                elif char == '}':
-                                    nivel -= 1
-                                    if nivel == 0:
-                                        fin = i + 1
-                                        break
-                        
-                        if fin > inicio:
-                            json_str = respuesta_ia[inicio:fin]
-                            evaluacion = json.loads(json_str)
-                            
-                            puntos = float(evaluacion.get('puntos', 0))
-                            conceptos_correctos = evaluacion.get('conceptos_correctos', [])
-                            conceptos_faltantes = evaluacion.get('conceptos_faltantes', [])
-                            feedback_base = evaluacion.get('feedback', 'Sin evaluación')
-                            
-                            # Construir feedback detallado
-                            feedback = feedback_base
-                            if conceptos_correctos:
-                                feedback += f"\\n\\n✅ Conceptos que dominas: {', '.join(conceptos_correctos)}"
-                            if conceptos_faltantes:
-                                feedback += f"\\n\\n❌ Conceptos que te faltan comprender: {', '.join(conceptos_faltantes)}"
-                            
-                            print(f"✅ Evaluación: {puntos}/{pregunta.puntos} puntos")
-                            print(f"✅ Conceptos correctos: {conceptos_correctos}")
-                            print(f"❌ Conceptos faltantes: {conceptos_faltantes}")
-                            
-                            return {
-                                "correcta": puntos >= pregunta.puntos * 0.6,  # 60% o más es correcto
-                                "puntos_obtenidos": puntos,
-                                "feedback": feedback,
-                                "conceptos_correctos": conceptos_correctos,
-                                "conceptos_faltantes": conceptos_faltantes
-                            }
+                try:
+                    texto = obtener_cliente_sync().generar(
+                        self.modelo_ollama, prompt, self.OPCIONES_EVALUACION,
+                        timeout=self.TIMEOUT_EVALUACION, keep_alive=self.keep_alive
+                    )['response']
+                except ErrorOllama as e:
+                    print(f"⚠️ {e}")
+            elif self.llm:
+                # Evaluar con el GGUF cargado
+                try:
+                    texto = self.generar_texto(
+                        prompt, max_tokens=self.OPCIONES_EVALUACION['num_predict'],
+                        temperature=self.OPCIONES_EVALUACION['temperature']
+                    )
+                except Exception as e:
+                    print(f"⚠️ Error evaluando con GGUF: {e}")
+            if texto is not None:
+                resultado = self._interpretar_evaluacion(pregunta, texto)
+                if resultado is not None:
+                    # Solo se guardan evaluaciones reales de la IA, nunca el fallback
+                    obtener_cache_evaluaciones().guardar(clave, resultado)
+                    return resultado
             
             # Fallback: evaluación simple por palabras clave
-            print("⚠️ Usando evaluación fallback")
-            
-            # Extraer texto de respuesta correcta (puede ser dict en flashcards)
-            respuesta_modelo = pregunta.respuesta_correcta
-            if isinstance(respuesta_modelo, dict):
-                respuesta_modelo = respuesta_modelo.get('answer', str(respuesta_modelo))
-            if not isinstance(respuesta_modelo, str):
-                respuesta_modelo = str(respuesta_modelo)
-            
-            palabras_correctas = set(respuesta_modelo.lower().split())
-            palabras_usuario = set(respuesta_usuario.lower().split())
-            coincidencias = len(palabras_correctas.intersection(palabras_usuario))
-            similitud = coincidencias / len(palabras_correctas) if palabras_correctas else 0
-            
-            puntos = pregunta.puntos * similitud
-            
-            if similitud >= 0.7:
-                feedback = "¡Excelente! Respuesta muy completa."
-            elif similitud >= 0.5:
-                feedback = "Bien, pero podrías agregar más detalles."
-            elif similitud >= 0.3:
-                feedback = "Parcialmente correcto, faltan conceptos clave."
-            else:
-                feedback = f"Incompleto. Respuesta esperada: {respuesta_modelo}"
-            
-            return {
-                "correcta": similitud >= 0.6,
-                "puntos_obtenidos": round(puntos, 1),
-                "feedback": feedback
-            }
+            return self._evaluacion_fallback(pregunta, respuesta_usuario)
             
         except Exception as e:
-            print(f"❌ Error evaluando con IA: {e}")
-            import traceback
-            traceback.print_exc()
+            return self._evaluacion_error(pregunta, e)
+    
+    async def _evaluar_con_ia_async(self, pregunta: PreguntaExamen, respuesta_usuario: str) -> dict:
+        """Versión asíncrona de _evaluar_con_ia"""
+        clave = await asyncio.to_thread(self._clave_evaluacion, pregunta, respuesta_usuario)
+        resultado = self._evaluacion_cacheada(clave)
+        if resultado is not None:
+            return resultado
+        prompt = self._prompt_evaluacion(pregunta, respuesta_usuario)
+        
+        try:
+            texto = None
+            if self.usar_ollama:
+                # Evaluar con Ollama
+                try:
+                    texto = (await obtener_cliente().generar(
+                        self.modelo_ollama, prompt, self.OPCIONES_EVALUACION,
+                        timeout=self.TIMEOUT_EVALUACION, keep_alive=self.keep_alive
+                    ))['response']
+                except ErrorOllama as e:
+                    print(f"⚠️ {e}")
+            elif self.llm:
+                # Evaluar con el GGUF cargado
+                try:
+                    texto = await self.generar_texto_async(
+                        prompt, max_tokens=self.OPCIONES_EVALUACION['num_predict'],
+                        temperature=self.OPCIONES_EVALUACION['temperature']
+                    )
+                except Exception as e:
+                    print(f"⚠️ Error evaluando con GGUF: {e}")
+            if texto is not None:
+                resultado = self._interpretar_evaluacion(pregunta, texto)
+                if resultado is not None:
+                    obtener_cache_evaluaciones().guardar(clave, resultado)
+                    return resultado
             
-            # Extraer respuesta modelo para fallback
-            respuesta_modelo = pregunta.respuesta_correcta
-            if isinstance(respuesta_modelo, dict):
-                respuesta_modelo = respuesta_modelo.get('answer', 'No disponible')
-            if not isinstance(respuesta_modelo, str):
-                respuesta_modelo = str(respuesta_modelo)
+            # Fallback: evaluación simple por palabras clave
+            return self._evaluacion_fallback(pregunta, respuesta_usuario)
             
-            # Fallback
-            return {
-                "correcta": False,
-                "puntos_obtenidos": 0,
-                "feedback": f"Error en evaluación. Respuesta esperada: {respuesta_modelo}"
-            }
+        except Exception as e:
+            return self._evaluacion_error(pregunta, e)
 
 
 # Función de utilidad para verificar qué usar
@@ -1679,12 +2808,10 @@ def detectar_backend_disponible():
     """Detecta qué backend está disponible"""
     # Verificar Ollama
     try:
-        response = requests.get("http://localhost:11434/api/tags", timeout=2)
-        if response.status_code == 200:
-            modelos = response.json().get('models', [])
-            if modelos:
-                print("✅ Ollama disponible con GPU automática")
-                return "ollama", modelos[0]['name']
+        modelos = obtener_cliente_sync().tags()
+        if modelos:
+            print("✅ Ollama disponible con GPU automática")
+            return "ollama", modelos[0]['name']
     except:
         pass
     
@@ -0,0 +1,267 @@
+"""
+Lecturas compartidas para los tipos reading de una práctica
+- Fase 1: un pasaje (título y párrafos) por parte del contenido, generado una sola vez
+  por parte y guardado en la caché de respuestas; pedir ejercicios nuevos sobre el mismo
+  contenido reutiliza el pasaje, nunca lo reescribe
+- Fase 2: cada tipo reading pedido para esa parte se deriva del pasaje en una llamada
+  corta, con la sección de formato del tipo que trae el prompt del frontend. El modelo
+  no repite el texto: se inserta después en el campo que lo lleva (text,
+  text_paragraphs) y los huecos de reading_cloze se marcan sobre el pasaje
+"""
+import json
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from typing import Dict, List, Optional
+
+from cache_llm import obtener_cache_respuestas, hash_clave
+from esquemas_json import esquema_practica
+from generador_examenes import PreguntaExamen
+from particion_contenido import dividir_en_partes, repartir_preguntas
+from plan_practica import GRUPOS_TIPOS, secciones_tipos
+from prefijos_kv import registrar_prefijo
+from presupuesto_tokens import Presupuesto, TOKENS_MINIMOS_CONTENIDO
+
+
+TIPOS_LECTURA = dict(GRUPOS_TIPOS)['reading']
+
+# Campo del ejercicio que lleva el pasaje: lo completa el código, no el modelo
+CAMPO_PASAJE = {
+    'reading_comprehension': 'text',
+    'reading_true_false': 'text',
+    'reading_skill': 'text',
+    'reading_matching': 'text_paragraphs',
+    'reading_cloze': 'text_with_gaps',
+}
+HUECO = '______'
+
+AJUSTES_PASAJE = {'temperature': 0.6, 'max_tokens': 700, 'top_p': 0.9, 'repeat_penalty': 1.15}
+TOKENS_POR_EJERCICIO = 300
+TOKENS_BASE_EJERCICIOS = 150
+
+ESQUEMA_PASAJE = {
+    "type": "object",
+    "properties": {
+        "title": {"type": "string", "minLength": 1},
+        "paragraphs": {"type": "array", "items": {"type": "string", "minLength": 1},
+                       "minItems": 3, "maxItems": 5}
+    },
+    "required": ["title", "paragraphs"]
+}
+
+INSTRUCCIONES_PASAJE = """Eres un experto en crear ejercicios de comprensión lectora. Escribe un texto de lectura en inglés de 150-250 palabras, dividido en 3 a 5 párrafos, basado en el contenido proporcionado al final (datos, ideas y términos de ese contenido, sin inventar otros).
+Responde SOLO con un objeto JSON {"title": "...", "paragraphs": ["...", "..."]}, sin texto adicional.
+"""
+
+INSTRUCCIONES_EJERCICIOS = """Eres un experto en crear ejercicios de comprensión lectora. Recibes un texto de lectura ya escrito (párrafos numerados desde 0) y creas SOLO los ejercicios que se piden al final, con el formato indicado y basados únicamente en ese texto.
+Responde SOLO con un objeto JSON {"questions": [...]}, sin texto adicional.
+"""
+
+
+def _nota_pasaje(tipo: str) -> str:
+    """Qué campos del formato no genera el modelo porque salen del pasaje"""
+    campo = CAMPO_PASAJE.get(tipo)
+    if tipo == 'reading_cloze':
+        return (f'No incluyas "{campo}": en "answers" pon, en orden de aparición, las palabras exactas '
+                f'del texto que se ocultarán; los huecos se marcan sobre el texto.')
+    if campo:
+        return f'No incluyas el campo "{campo}": el texto ya está dado y se agrega después.'
+    return ""
+
+
+def _marcar_huecos(texto: str, respuestas: list) -> tuple:
+    """(texto con huecos, respuestas encontradas): cada respuesta, en orden, se busca a
+    partir del hueco anterior sin letras ni dígitos pegados (vale para C++ o 50%)"""
+    desde, encontradas, partes = 0, [], []
+    for respuesta in respuestas:
+        if not isinstance(respuesta, str) or not respuesta.strip():
+            continue
+        m = re.compile(rf'(?<!\w){re.escape(respuesta.strip())}(?!\w)').search(texto, desde)
+        if m is None:
+            continue
+        partes.append(texto[desde:m.start()] + HUECO)
+        encontradas.append(m.group(0))
+        desde = m.end()
+    return "".join(partes) + texto[desde:], encontradas
+
+
+def _texto_ejercicio(ejercicio: dict) -> str:
+    """Lo propio del ejercicio (sin el pasaje) para detectar casi duplicados"""
+    valores = []
+    for campo, valor in ejercicio.items():
+        if campo in ('type', 'difficulty', 'tags', CAMPO_PASAJE.get(ejercicio.get('type'))):
+            continue
+        valores.append(valor if isinstance(valor, str) else json.dumps(valor, ensure_ascii=False))
+    return ' '.join(valores)
+
+
+class MotorLecturas:
+    """Ejercicios reading de un GeneradorUnificado derivados de pasajes compartidos"""
+
+    def __init__(self, generador):
+        self.generador = generador
+        self._locks: Dict[str, list] = {}  # clave → [lock, peticiones que lo usan]
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def aplicable(cantidades: Dict[str, int], encabezado: str) -> bool:
+        """Solo tipos reading, y el prompt trae la sección de formato de cada uno"""
+        secciones = secciones_tipos(encabezado)
+        return bool(cantidades) and all(t in TIPOS_LECTURA and t in secciones for t in cantidades)
+
+    @contextmanager
+    def _lock_pasaje(self, clave: str):
+        """Lock por clave; la entrada se borra al salir la última petición que la usa
+        (para entonces el pasaje ya está en la caché o no se pudo generar)"""
+        with self._lock:
+            entrada = self._locks.setdefault(clave, [threading.Lock(), 0])
+            entrada[1] += 1
+        try:
+            with entrada[0]:
+                yield
+        finally:
+            with self._lock:
+                entrada[1] -= 1
+                if not entrada[1]:
+                    del self._locks[clave]
+
+    def _clave_pasaje(self, contenido: str) -> dict:
+        g = self.generador
+        return {
+            'motor': 'pasaje_lectura',
+            'modelo': g.modelo_ollama if g.usar_ollama else g.modelo_path_gguf,
+            'digest': g._digest_modelo(),
+            'contenido': hash_clave({'contenido': contenido})
+        }
+
+    def pasaje(self, contenido: str, turno=None) -> Optional[dict]:
+        """Fase 1: {"title", "paragraphs"} de la parte (de la caché si ya se generó)"""
+        clave = self._clave_pasaje(contenido)
+        cache = obtener_cache_respuestas()
+        # Dos peticiones simultáneas sobre la misma parte generan el pasaje una sola vez
+        with self._lock_pasaje(hash_clave(clave)):
+            guardado = cache.obtener(clave)
+            if isinstance(guardado, dict):
+                print(f"♻️ Pasaje de lectura reutilizado: {guardado.get('title', '')[:60]}")
+                return guardado
+
+            prompt = registrar_prefijo(INSTRUCCIONES_PASAJE) + f"""
+CONTENIDO:
+{contenido}
+
+TEXTO EN JSON:"""
+            with (turno or nullcontext)():
+                datos = self.generador.generar_json(prompt, ESQUEMA_PASAJE, AJUSTES_PASAJE, usar_cache=False)
+            parrafos = [p.strip() for p in (datos or {}).get('paragraphs') or []
+                        if isinstance(p, str) and p.strip()]
+            if not parrafos:
+                print("⚠️ El pasaje de lectura no se pudo generar")
+                return None
+            pasaje = {'title': str(datos.get('title') or '').strip(), 'paragraphs': parrafos}
+            cache.guardar(clave, pasaje)
+            print(f"📖 Pasaje de lectura: {pasaje['title'][:60]} ({len(parrafos)} párrafos)")
+            return pasaje
+
+    def _ejercicios(self, pasaje: dict, tipo: str, n: int, seccion: str, ajustes_modelo: dict,
+                    turno=None, usar_cache: bool = True) -> List[dict]:
+        """Fase 2: n ejercicios de un tipo sobre el pasaje, con el pasaje ya insertado"""
+        numerados = "\n".join(f"[{i}] {p}" for i, p in enumerate(pasaje['paragraphs']))
+        prompt = registrar_prefijo(INSTRUCCIONES_EJERCICIOS) + f"""
+TEXTO: {pasaje['title']}
+{numerados}
+
+FORMATO:
+{seccion.strip()}
+{_nota_pasaje(tipo)}
+
+Genera {n} ejercicio(s) de tipo "{tipo}" sobre el texto.
+JSON:"""
+        max_tokens = min(ajustes_modelo.get('max_tokens', 4000), TOKENS_BASE_EJERCICIOS + TOKENS_POR_EJERCICIO * n)
+        with (turno or nullcontext)():
+            datos = self.generador.generar_json(prompt, esquema_practica({tipo: n}),
+                                                dict(ajustes_modelo, max_tokens=max_tokens), usar_cache=usar_cache)
+        texto = "\n\n".join(pasaje['paragraphs'])
+        ejercicios = []
+        for ejercicio in self.generador._lista_preguntas(datos) or []:
+            if not isinstance(ejercicio, dict) or (ejercicio.get('type') or ejercicio.get('tipo')) != tipo:
+                continue
+            ejercicio = dict(ejercicio, type=tipo)
+            if tipo == 'reading_cloze':
+                ejercicio['text_with_gaps'], ejercicio['answers'] = _marcar_huecos(texto, ejercicio.get('answers') or [])
+                if not ejercicio['answers']:
+                    continue
+            elif tipo == 'reading_matching':
+                mapeo = ejercicio.get('correct_mapping') or []
+                if not all(isinstance(i, int) and 0 <= i < len(pasaje['paragraphs']) for i in mapeo):
+                    continue
+                ejercicio['text_paragraphs'] = list(pasaje['paragraphs'])
+            elif tipo in CAMPO_PASAJE:
+                ejercicio[CAMPO_PASAJE[tipo]] = texto
+            ejercicio.setdefault('context', pasaje['title'])
+            ejercicios.append(ejercicio)
+        return ejercicios[:n]
+
+    def generar(self, contenido: str, cantidades: Dict[str, int], encabezado: str, ajustes_modelo: dict,
+                turno=None, usar_cache: bool = True, indice_similitud=None, callback_pregunta=None,
+                callback_progreso=None) -> List[PreguntaExamen]:
+        """Ejercicios reading pedidos, un pasaje por parte del contenido
+
+        Las cantidades se reparten entre las partes a lo largo del documento; cada parte con
+        ejercicios asignados genera (o reutiliza) su pasaje y luego todos sus tipos a la vez.
+        """
+        secciones = secciones_tipos(encabezado)
+        contador = self.generador.contador_tokens()
+        presupuesto = Presupuesto(contador, AJUSTES_PASAJE['max_tokens'])
+        presupuesto.consumir('instrucciones', INSTRUCCIONES_PASAJE + "\nCONTENIDO:\n\nTEXTO EN JSON:")
+        max_tokens = max(presupuesto.restante, TOKENS_MINIMOS_CONTENIDO)
+        if contador.contar(contenido) <= max_tokens:
+            partes = [contenido]
+        else:
+            partes = dividir_en_partes(contenido, max_tokens, contador)
+        tareas = [(parte, reparto) for parte, reparto
+                  in zip(partes, repartir_preguntas(cantidades, [len(p) for p in partes])) if reparto]
+        print(f"📖 {sum(cantidades.values())} ejercicio(s) reading sobre {len(tareas)} pasaje(s) compartido(s): {cantidades}")
+
+        hechas = [0]
+        lock = threading.Lock()
+
+        def generar_parte(n: int, parte: str, reparto: Dict[str, int]) -> List[PreguntaExamen]:
+            pasaje = self.pasaje(parte, turno)
+            if pasaje is None:
+                return []
+            with ThreadPoolExecutor(max_workers=len(reparto), thread_name_prefix="ejercicio-lectura") as pool:
+                por_tipo = list(pool.map(
+                    lambda t: self._ejercicios(pasaje, t[0], t[1], secciones[t[0]], ajustes_modelo, turno, usar_cache),
+                    reparto.items()))
+            preguntas = []
+            for ejercicio in (e for lista in por_tipo for e in lista):
+                with lock:
+                    nueva = indice_similitud is None or indice_similitud.agregar_si_nueva(_texto_ejercicio(ejercicio))
+                if not nueva:
+                    continue
+                pregunta = PreguntaExamen.from_dict(ejercicio)
+                preguntas.append(pregunta)
+                if callback_pregunta:
+                    callback_pregunta(pregunta)
+            if callback_progreso:
+                with lock:
+                    hechas[0] += 1
+                    valor = 10 + int(85 * hechas[0] / len(tareas))
+                callback_progreso(valor, f"Pasaje {n + 1}/{len(tareas)}: {len(preguntas)} ejercicio(s)")
+            return preguntas
+
+        def generar_tarea(t):
+            try:
+                return generar_parte(t[0], *t[1])
+            except Exception as e:
+                # Un pasaje fallido no descarta los demás
+                print(f"⚠️ Pasaje {t[0] + 1}/{len(tareas)} falló: {e}")
+                return []
+
+        with ThreadPoolExecutor(max_workers=max(1, len(tareas)), thread_name_prefix="pasaje-lectura") as pool:
+            preguntas = [p for lista in pool.map(generar_tarea, enumerate(tareas)) for p in lista]
+        faltan = self.generador.faltantes_por_tipo(preguntas, cantidades)
+        if faltan:
+            print(f"⚠️ Ejercicios reading sin generar: {faltan}")
+        return preguntas
@@ -0,0 +1,115 @@
+"""
+Parser incremental de JSON para la generación de exámenes en streaming
+- ParserPreguntasIncremental: recibe el texto del modelo fragmento a fragmento y
+  entrega cada objeto de pregunta en cuanto se cierra su llave
+"""
+import json
+import re
+from typing import List, Dict
+
+
+# Valores de ejemplo que algunos modelos copian literalmente del prompt
+PLACEHOLDERS = ('"puntos": ...', '"puntos":...', '"opciones": [...]', '"pregunta": "..."', '": "..."')
+
+CLAVES_LISTA_PREGUNTAS = ('preguntas', 'questions')
+
+
+class ParserPreguntasIncremental:
+    """Escáner de una sola pasada sobre la salida del modelo
+
+    Reconoce {"preguntas": [ {...}, {...} ]}, {"questions": [...]} o un array
+    directo [ {...}, ... ]. Cada objeto hijo directo de esa lista se parsea y se
+    entrega al cerrarse, sin esperar al resto de la respuesta. El texto fuera de
+    JSON (razonamiento, markdown) se ignora.
+    """
+
+    def __init__(self):
+        self.objetos_descartados = 0
+        self._reiniciar()
+
+    def _reiniciar(self):
+        self._pila: List[tuple] = []      # (caracter_apertura, es_lista_preguntas)
+        self._en_string = False
+        self._escape = False
+        self._cadena: List[str] = []      # string JSON en curso
+        self._ultima_cadena = ""
+        self._objeto: List[str] = None    # caracteres del objeto de pregunta en curso
+        self._validar_apertura = False
+
+    def alimentar(self, fragmento: str) -> List[Dict]:
+        """Procesa un fragmento y retorna las preguntas completadas en él"""
+        completadas = []
+        for c in fragmento:
+            if self._objeto is not None:
+                self._objeto.append(c)
+
+            if self._validar_apertura:
+                # Tras la primera llave/corchete debe venir JSON, si no era texto normal
+                if c.isspace():
+                    continue
+                self._validar_apertura = False
+                apertura = self._pila[0][0]
+                validos = '"}' if apertura == '{' else '{]'
+                if c not in validos:
+                    self._reiniciar()
+                    if c not in '{[':
+                        continue
+
+            if self._en_string:
+                if self._escape:
+                    self._escape = False
+                elif c == '\\':
+                    self._escape = True
+                elif c == '"':
+                    self._en_string = False
+                    self._ultima_cadena = "".join(self._cadena)
+                    self._cadena = []
+                else:
+                    self._cadena.append(c)
+                continue
+
+            if not self._pila:
+                # Fuera de JSON: solo interesa el inicio de un objeto o array
+                if c in '{[':
+                    self._pila.append((c, c == '['))
+                    self._validar_apertura = True
+                continue
+
+            if c == '"':
+                self._en_string = True
+            elif c == '{':
+                padre, padre_es_lista = self._pila[-1]
+                if padre == '[' and padre_es_lista and self._objeto is None:
+                    self._objeto = ['{']
+                self._pila.append(('{', False))
+            elif c == '[':
+                es_lista = self._ultima_cadena in CLAVES_LISTA_PREGUNTAS and self._objeto is None
+                self._pila.append(('[', es_lista))
+            elif c in '}]':
+                self._pila.pop()
+                if c == '}' and self._objeto is not None and self._pila and self._pila[-1][1]:
+                    pregunta = self._cerrar_objeto("".join(self._objeto))
+                    self._objeto = None
+                    if pregunta is not None:
+                        completadas.append(pregunta)
+                if not self._pila:
+                    self._reiniciar()
+        return completadas
+
+    def _cerrar_objeto(self, texto: str):
+        if any(p in texto for p in PLACEHOLDERS):
+            self.objetos_descartados += 1
+            return None
+        try:
+            datos = json.loads(texto)
+        except json.JSONDecodeError:
+            # Error común del modelo: coma antes de ] o }
+            try:
+                datos = json.loads(re.sub(r',(\s*[}\]])', r'\1', texto))
+            except json.JSONDecodeError:
+                self.objetos_descartados += 1
+                return None
+        if not isinstance(datos, dict) or not ('tipo' in datos or 'type' in datos):
+            self.objetos_descartados += 1
+            return None
+        return datos
@@ -0,0 +1,117 @@
+"""
+Partición de documentos largos para generar preguntas por partes (map-reduce)
+- dividir_en_partes: agrupa las secciones de examinator.dividir_en_secciones (y los
+  documentos de una carpeta, marcados con "=== nombre ===") en partes que caben en
+  la ventana del modelo; una sección demasiado larga se corta por párrafos u oraciones
+- repartir_preguntas: distribuye las cantidades por tipo entre las partes en
+  proporción a su tamaño, repartidas a lo largo de todo el documento
+"""
+import re
+from typing import Dict, List
+
+from examinator import dividir_en_secciones
+from presupuesto_tokens import ContadorTokens
+
+
+PATRON_DOCUMENTO = re.compile(r'^=== .+ ===$', re.MULTILINE)
+
+
+def _documentos(texto: str) -> List[str]:
+    """Separa el contenido de una carpeta en sus documentos (cada uno con su marca)"""
+    inicios = [m.start() for m in PATRON_DOCUMENTO.finditer(texto)]
+    if not inicios:
+        return [texto]
+    if inicios[0] > 0:
+        inicios.insert(0, 0)
+    return [texto[a:b] for a, b in zip(inicios, inicios[1:] + [len(texto)]) if texto[a:b].strip()]
+
+
+def _secciones(texto: str) -> List[str]:
+    """Bloques de texto en el orden del documento, cortados en los títulos detectados"""
+    bloques = []
+    for documento in _documentos(texto):
+        marca = PATRON_DOCUMENTO.match(documento.lstrip())
+        cuerpo = documento.lstrip()[marca.end():] if marca else documento
+        secciones = dividir_en_secciones(cuerpo)
+        for i, seccion in enumerate(secciones):
+            titulo = '' if seccion['titulo'] == 'Inicio' else seccion['titulo'] + '\n'
+            bloque = titulo + seccion['contenido']
+            # La marca del documento encabeza su primera sección para que el modelo sepa de dónde viene
+            if marca and i == 0:
+                bloque = marca.group(0) + '\n' + bloque
+            bloques.append(bloque)
+    return bloques
+
+
+def _fragmentos(texto: str, max_tokens: int, contador: ContadorTokens) -> List[str]:
+    """Corta un texto que no cabe en una parte por párrafos, luego por oraciones y, como
+    último recurso, por palabras. Los fragmentos concatenados reproducen el texto"""
+    if contador.contar(texto) <= max_tokens:
+        return [texto]
+    for separador in (r'(?<=\n\n)', r'(?<=[.!?] )'):
+        trozos = [t for t in re.split(separador, texto) if t]
+        if len(trozos) > 1:
+            return [f for trozo in trozos for f in _fragmentos(trozo, max_tokens, contador)]
+    fragmentos = []
+    while contador.contar(texto) > max_tokens:
+        cabe = contador.recortar(texto, max_tokens)
+        fragmentos.append(cabe)
+        texto = texto[len(cabe):]
+    return fragmentos + [texto]
+
+
+def _empaquetar(fragmentos: List[str], max_tokens: int, contador: ContadorTokens, union: str) -> List[str]:
+    """Junta fragmentos consecutivos mientras quepan en max_tokens"""
+    partes, actual = [], ''
+    for fragmento in fragmentos:
+        candidato = f"{actual}{union}{fragmento}" if actual else fragmento
+        if actual and contador.contar(candidato) > max_tokens:
+            partes.append(actual)
+            candidato = fragmento
+        actual = candidato
+    if actual.strip():
+        partes.append(actual)
+    return [p.strip() for p in partes]
+
+
+def dividir_en_partes(texto: str, max_tokens: int, contador: ContadorTokens) -> List[str]:
+    """Partes consecutivas del texto de hasta max_tokens. Una sección que cabe entera
+    nunca se reparte entre dos partes; las más largas se cortan por párrafos"""
+    trozos = [t for seccion in _secciones(texto)
+              for t in _empaquetar(_fragmentos(seccion, max_tokens, contador), max_tokens, contador, '')]
+    return _empaquetar(trozos, max_tokens, contador, '\n\n')
+
+
+def repartir_preguntas(num_preguntas: Dict[str, int], tamanos: List[int]) -> List[Dict[str, int]]:
+    """Cantidades por tipo para cada parte
+
+    Cada pregunta se ubica en un punto equiespaciado del documento (medido en tamaño
+    de las partes) y va a la parte que lo contiene; los tipos se intercalan para que
+    cada uno quede repartido por todo el documento y no concentrado en las primeras partes.
+    """
+    cantidades = {tipo: n for tipo, n in num_preguntas.items() if n > 0}
+    total = sum(cantidades.values())
+    reparto: List[Dict[str, int]] = [{} for _ in tamanos]
+    if not total or not tamanos:
+        return reparto
+
+    # Secuencia de tipos intercalados: el i-ésimo de un tipo con n preguntas cae en (i + 0.5) / n
+    secuencia = sorted(
+        ((i + 0.5) / n, orden, tipo)
+        for orden, (tipo, n) in enumerate(cantidades.items()) for i in range(n)
+    )
+
+    pesos = tamanos if sum(tamanos) else [1] * len(tamanos)
+    tamano_total = sum(pesos)
+    limites, acumulado = [], 0
+    for peso in pesos:
+        acumulado += peso
+        limites.append(acumulado)
+
+    parte = 0
+    for k, (_, _, tipo) in enumerate(secuencia):
+        punto = (k + 0.5) / total * tamano_total
+        while parte < len(limites) - 1 and punto > limites[parte]:
+            parte += 1
+        reparto[parte][tipo] = reparto[parte].get(tipo, 0) + 1
+    return reparto
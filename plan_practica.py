@@ -0,0 +1,116 @@
+"""
+Plan de generación de prácticas grandes por grupos de tipos
+- planificar: reparte los tipos pedidos en grupos afines (generales, casos, reading,
+  writing) y divide los que superan MAX_PREGUNTAS_GRUPO; cada grupo es una generación
+  aparte, con salida mucho más corta que la práctica completa
+- prompt_grupo: el prompt del frontend con solo las secciones de formato de los tipos
+  del grupo y las cantidades de ese grupo
+- tokens_grupo: max_tokens de cada grupo según lo que ocupa cada tipo de pregunta
+- secciones_tipos: la sección de formato de cada tipo (p. ej. para derivar los reading
+  de un pasaje compartido, lecturas.py)
+"""
+import re
+from typing import Dict, List, Optional
+
+
+GRUPOS_TIPOS = (
+    ('generales', ('flashcard', 'mcq', 'true_false', 'cloze', 'short_answer', 'open_question')),
+    ('casos', ('case_study',)),
+    ('reading', ('reading_comprehension', 'reading_true_false', 'reading_cloze',
+                 'reading_skill', 'reading_matching', 'reading_sequence')),
+    ('writing', ('writing_short', 'writing_paraphrase', 'writing_correction', 'writing_transformation',
+                 'writing_essay', 'writing_sentence_builder', 'writing_picture_description', 'writing_email')),
+)
+
+MAX_PREGUNTAS_GRUPO = 8
+
+# Tokens de respuesta aproximados por pregunta de cada tipo (JSON del frontend)
+TOKENS_POR_PREGUNTA = {
+    'flashcard': 300, 'mcq': 200, 'true_false': 150, 'cloze': 150,
+    'short_answer': 200, 'open_question': 350, 'case_study': 1500,
+    'reading_comprehension': 600, 'writing_essay': 500,
+}
+TOKENS_POR_PREGUNTA_DEFECTO = 350
+TOKENS_BASE_GRUPO = 300
+
+# "**3 Preguntas de Opción Múltiple (MCQ)** - Formato JSON..." abre la sección de un tipo
+_SECCION = re.compile(r'^\*\*\d+ [^\n]*?\*\* - Formato JSON', re.MULTILINE)
+_TIPO_SECCION = re.compile(r'"type"\s*:\s*"(\w+)"')
+_CIERRE = "FORMATO DE RESPUESTA REQUERIDO"
+_TOTAL = re.compile(r'(Ahora genera las )\d+( preguntas)')
+
+
+def _familia(tipo: str) -> int:
+    for orden, (_, tipos) in enumerate(GRUPOS_TIPOS):
+        if tipo in tipos:
+            return orden
+    return len(GRUPOS_TIPOS)
+
+
+def planificar(cupo: Dict[str, int], max_por_grupo: int = MAX_PREGUNTAS_GRUPO) -> List[Dict[str, int]]:
+    """Cantidades por tipo de cada generación, en orden estable (familia y orden pedido)
+
+    Los tipos de una familia van juntos mientras no pasen de max_por_grupo preguntas;
+    un tipo con más preguntas que eso va solo (se reparte luego por partes del documento).
+    """
+    pedidos = [(tipo, n) for tipo, n in cupo.items() if n > 0]
+    pedidos.sort(key=lambda par: _familia(par[0]))  # sort estable: conserva el orden pedido
+    grupos: List[Dict[str, int]] = []
+    familia_actual = None
+    for tipo, n in pedidos:
+        familia = _familia(tipo)
+        grupo = grupos[-1] if grupos and familia == familia_actual else None
+        if grupo is None or sum(grupo.values()) + n > max_por_grupo:
+            grupos.append({})
+            grupo = grupos[-1]
+        grupo[tipo] = n
+        familia_actual = familia
+    return grupos
+
+
+def tokens_grupo(cantidades: Dict[str, int], max_tokens: int) -> int:
+    """max_tokens para un grupo: lo que ocupan sus preguntas, sin pasar el de la práctica"""
+    estimado = TOKENS_BASE_GRUPO + sum(TOKENS_POR_PREGUNTA.get(tipo, TOKENS_POR_PREGUNTA_DEFECTO) * n
+                                       for tipo, n in cantidades.items())
+    return min(max_tokens, estimado)
+
+
+def _secciones(prompt: str) -> Optional[tuple]:
+    """(inicio, {tipo: sección}, cierre) del prompt del frontend, o None si no tiene esa forma"""
+    aperturas = [m.start() for m in _SECCION.finditer(prompt)]
+    if not aperturas:
+        return None
+    fin_secciones = prompt.find(_CIERRE, aperturas[-1])
+    if fin_secciones < 0:
+        fin_secciones = len(prompt)
+    secciones = {}
+    for inicio, fin in zip(aperturas, aperturas[1:] + [fin_secciones]):
+        tipo = _TIPO_SECCION.search(prompt, inicio, fin)
+        if tipo is None or tipo.group(1) in secciones:
+            return None
+        secciones[tipo.group(1)] = prompt[inicio:fin]
+    return prompt[:aperturas[0]], secciones, prompt[fin_secciones:]
+
+
+def secciones_tipos(prompt: str) -> Dict[str, str]:
+    """Sección de formato de cada tipo del prompt del frontend ({} si no tiene esa forma)"""
+    partes = _secciones(prompt)
+    return partes[1] if partes is not None else {}
+
+
+def prompt_grupo(prompt: str, cantidades: Dict[str, int]) -> str:
+    """Prompt de la práctica reducido a los tipos del grupo
+
+    Si el prompt no tiene las secciones por tipo del frontend (o falta alguna) se usa
+    completo; en ambos casos se cierra con las cantidades del grupo.
+    """
+    total = sum(cantidades.values())
+    tipos = "\n".join(f'- {n} de tipo "{tipo}"' for tipo, n in cantidades.items())
+    partes = _secciones(prompt)
+    if partes is not None and all(tipo in partes[1] for tipo in cantidades):
+        inicio, secciones, cierre = partes
+        prompt = inicio + "".join(secciones[tipo] for tipo in cantidades) + _TOTAL.sub(rf'\g<1>{total}\g<2>', cierre)
+    return prompt + f"""
+
+IMPORTANTE: en esta respuesta genera SOLO estas {total} preguntas (el resto de la práctica se genera aparte):
+{tipos}"""
@@ -0,0 +1,268 @@
+"""
+Planificador de peticiones al motor de inferencia
+- Colas por prioridad: chat interactivo > evaluación > generación
+- Límite de peticiones simultáneas por motor (ollama / gguf)
+- Dentro de una misma prioridad se alterna entre clientes (round-robin) para que
+  un cliente con muchas peticiones no acapare el modelo
+- Sirve tanto a handlers async como a código síncrono que corre en hilos
+"""
+import asyncio
+import itertools
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import Callable, Deque, Dict, List, Optional
+
+
+# Clases de prioridad (menor = más prioritaria)
+CHAT = 0
+EVALUACION = 1
+GENERACION = 2
+
+NOMBRES_CLASES = {CHAT: 'chat', EVALUACION: 'evaluacion', GENERACION: 'generacion'}
+
+# Peticiones simultáneas por motor: Ollama atiende OLLAMA_NUM_PARALLEL a la vez,
+# una instancia de llama-cpp solo una
+LIMITES_POR_DEFECTO = {
+    'ollama': int(os.environ.get("OLLAMA_NUM_PARALLEL", 4)),
+    'gguf': 1
+}
+
+# Con límite > 1 la generación nunca ocupa el último slot libre: queda para el chat
+SLOTS_RESERVADOS_INTERACTIVOS = 1
+
+INTERVALO_AVISO_COLA = 1.0  # segundos entre avisos de posición en cola
+
+
+class Turno:
+    """Una petición al motor: espera en cola hasta que el planificador la despacha"""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, planificador: "PlanificadorInferencia", clase: int, motor: str, cliente: str):
+        self.id = next(self._ids)
+        self.planificador = planificador
+        self.clase = clase
+        self.motor = motor
+        self.cliente = cliente or "anonimo"
+        self.creado = time.time()
+        self.concedido: Optional[float] = None
+        self._evento = threading.Event()
+        self._terminado = threading.Event()  # se liberó (terminó o salió de la cola)
+        self._futuros: List[tuple] = []  # (loop, future) de quienes esperan en asyncio
+
+    @property
+    def espera_segundos(self) -> float:
+        return (self.concedido or time.time()) - self.creado
+
+    def posicion(self) -> int:
+        """0 = en ejecución; n = peticiones que se despacharán antes, más uno"""
+        return self.planificador.posicion(self)
+
+    def _conceder(self):
+        """Llamado por el planificador con su lock tomado"""
+        self.concedido = time.time()
+        self._evento.set()
+        for loop, futuro in self._futuros:
+            loop.call_soon_threadsafe(_resolver, futuro)
+        self._futuros.clear()
+
+    async def esperar(self, timeout: float = None) -> bool:
+        """Espera el turno sin bloquear el event loop. Retorna False si venció el timeout"""
+        loop = asyncio.get_running_loop()
+        with self.planificador._lock:
+            if self._evento.is_set():
+                return True
+            futuro = loop.create_future()
+            self._futuros.append((loop, futuro))
+        try:
+            await asyncio.wait_for(asyncio.shield(futuro), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            # Cada espera vencida (o cancelada) retira su future: quien reintenta en un
+            # bucle no acumula uno por intento hasta que se concede el turno
+            with self.planificador._lock:
+                if (loop, futuro) in self._futuros:
+                    self._futuros.remove((loop, futuro))
+
+    def esperar_sync(self, timeout: float = None) -> bool:
+        """Espera bloqueante (para handlers síncronos y hilos)"""
+        return self._evento.wait(timeout)
+
+    def esperar_fin(self, timeout: float = None) -> bool:
+        """Espera a que el turno se libere. Retorna False si venció el timeout"""
+        return self._terminado.wait(timeout)
+
+
+def _resolver(futuro: asyncio.Future):
+    if not futuro.done():
+        futuro.set_result(True)
+
+
+class PlanificadorInferencia:
+    """Despacha turnos por prioridad respetando el límite de concurrencia de cada motor"""
+
+    def __init__(self, limites: Dict[str, int] = None):
+        self.limites = dict(limites or LIMITES_POR_DEFECTO)
+        self._lock = threading.Lock()
+        # motor -> clase -> cliente -> cola de turnos (el orden de clientes rota)
+        self._colas: Dict[str, Dict[int, "OrderedDict[str, Deque[Turno]]"]] = {}
+        self._en_curso: Dict[str, Dict[int, Turno]] = {}
+        self.estadisticas_uso = {
+            'despachados': {nombre: 0 for nombre in NOMBRES_CLASES.values()},
+            'espera_total_segundos': {nombre: 0.0 for nombre in NOMBRES_CLASES.values()}
+        }
+
+    # ---------------------------------------------------------------- interno
+
+    def _colas_motor(self, motor: str) -> Dict[int, "OrderedDict[str, Deque[Turno]]"]:
+        return self._colas.setdefault(motor, {clase: OrderedDict() for clase in NOMBRES_CLASES})
+
+    def _puede_despachar(self, motor: str, clase: int) -> bool:
+        limite = max(1, self.limites.get(motor, 1))
+        en_curso = len(self._en_curso.get(motor, {}))
+        if clase == GENERACION and limite > 1:
+            limite -= SLOTS_RESERVADOS_INTERACTIVOS
+        return en_curso < limite
+
+    def _orden_de_despacho(self, motor: str) -> List[Turno]:
+        """Turnos en espera en el orden en que se despacharían"""
+        orden = []
+        for clase, clientes in sorted(self._colas_motor(motor).items()):
+            # Simula el round-robin: una petición por cliente en cada vuelta
+            colas = [list(cola) for cola in clientes.values()]
+            for vuelta in range(max((len(c) for c in colas), default=0)):
+                orden.extend(c[vuelta] for c in colas if vuelta < len(c))
+        return orden
+
+    def _despachar(self, motor: str):
+        """Concede turnos mientras haya slots libres (con el lock tomado)"""
+        for clase, clientes in sorted(self._colas_motor(motor).items()):
+            while clientes and self._puede_despachar(motor, clase):
+                cliente, cola = next(iter(clientes.items()))
+                turno = cola.popleft()
+                del clientes[cliente]
+                if cola:
+                    clientes[cliente] = cola  # pasa al final de la rotación
+                self._en_curso.setdefault(motor, {})[turno.id] = turno
+                turno._conceder()
+                nombre = NOMBRES_CLASES[clase]
+                self.estadisticas_uso['despachados'][nombre] += 1
+                self.estadisticas_uso['espera_total_segundos'][nombre] += turno.espera_segundos
+            if clientes:
+                # Las clases de menor prioridad no adelantan a una que espera
+                break
+
+    # ------------------------------------------------------------------- API
+
+    def solicitar(self, clase: int, motor: str, cliente: str = None) -> Turno:
+        """Encola una petición; si hay slot libre queda concedida de inmediato"""
+        turno = Turno(self, clase, motor, cliente)
+        with self._lock:
+            self._colas_motor(motor)[clase].setdefault(turno.cliente, deque()).append(turno)
+            self._despachar(motor)
+        return turno
+
+    def liberar(self, turno: Turno):
+        """Devuelve el slot (o retira el turno de la cola si aún no se había concedido)"""
+        with self._lock:
+            turno._terminado.set()
+            if self._en_curso.get(turno.motor, {}).pop(turno.id, None) is None:
+                clientes = self._colas_motor(turno.motor)[turno.clase]
+                cola = clientes.get(turno.cliente)
+                if cola and turno in cola:
+                    cola.remove(turno)
+                    if not cola:
+                        del clientes[turno.cliente]
+            self._despachar(turno.motor)
+
+    def turnos_activos(self, motor: str) -> List[Turno]:
+        """Turnos del motor en ejecución o en cola"""
+        with self._lock:
+            return list(self._en_curso.get(motor, {}).values()) + self._orden_de_despacho(motor)
+
+    def posicion(self, turno: Turno) -> int:
+        with self._lock:
+            if turno.id in self._en_curso.get(turno.motor, {}):
+                return 0
+            orden = self._orden_de_despacho(turno.motor)
+            return orden.index(turno) + 1 if turno in orden else 0
+
+    def configurar_limite(self, motor: str, limite: int):
+        with self._lock:
+            self.limites[motor] = max(1, int(limite))
+            self._despachar(motor)
+
+    @asynccontextmanager
+    async def turno(self, clase: int, motor: str, cliente: str = None,
+                    al_esperar: Callable[[int], None] = None):
+        """async with planificador.turno(CHAT, 'ollama', ip): ...
+        al_esperar(posicion) se llama periódicamente mientras la petición está en cola"""
+        turno = self.solicitar(clase, motor, cliente)
+        try:
+            while not await turno.esperar(INTERVALO_AVISO_COLA):
+                if al_esperar:
+                    al_esperar(turno.posicion())
+            yield turno
+        finally:
+            self.liberar(turno)
+
+    @contextmanager
+    def turno_sync(self, clase: int, motor: str, cliente: str = None,
+                   al_esperar: Callable[[int], None] = None):
+        """Versión bloqueante de turno() para handlers síncronos"""
+        turno = self.solicitar(clase, motor, cliente)
+        try:
+            while not turno.esperar_sync(INTERVALO_AVISO_COLA):
+                if al_esperar:
+                    al_esperar(turno.posicion())
+            yield turno
+        finally:
+            self.liberar(turno)
+
+    def estado(self) -> dict:
+        with self._lock:
+            motores = {}
+            for motor in set(self._colas) | set(self._en_curso) | set(self.limites):
+                en_espera = self._orden_de_despacho(motor)
+                motores[motor] = {
+                    'limite': self.limites.get(motor, 1),
+                    'en_curso': [
+                        {'id': t.id, 'clase': NOMBRES_CLASES[t.clase], 'cliente': t.cliente,
+                         'segundos': round(time.time() - t.concedido, 1)}
+                        for t in self._en_curso.get(motor, {}).values()
+                    ],
+                    'en_cola': [
+                        {'id': t.id, 'clase': NOMBRES_CLASES[t.clase], 'cliente': t.cliente,
+                         'posicion': i + 1, 'espera_segundos': round(t.espera_segundos, 1)}
+                        for i, t in enumerate(en_espera)
+                    ]
+                }
+            despachados = self.estadisticas_uso['despachados']
+            espera = self.estadisticas_uso['espera_total_segundos']
+            return {
+                'motores': motores,
+                'despachados': dict(despachados),
+                'espera_media_ms': {
+                    nombre: round(espera[nombre] / despachados[nombre] * 1000, 1) if despachados[nombre] else 0.0
+                    for nombre in despachados
+                }
+            }
+
+
+# Instancia compartida por proceso
+_planificador: Optional[PlanificadorInferencia] = None
+_lock_planificador = threading.Lock()
+
+
+def obtener_planificador() -> PlanificadorInferencia:
+    """Retorna el planificador del proceso"""
+    global _planificador
+    with _lock_planificador:
+        if _planificador is None:
+            _planificador = PlanificadorInferencia()
+        return _planificador
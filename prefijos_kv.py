@@ -0,0 +1,144 @@
+"""
+Reutilización del KV-cache de los prefijos estáticos de los prompts (llama-cpp)
+- Los generadores arman sus prompts como prefijo fijo (instrucciones) + sufijo variable
+  (contenido, cantidades) y registran el prefijo con registrar_prefijo()
+- CachePrefijosKV: la primera vez evalúa el prefijo y guarda el estado con save_state();
+  las siguientes lo restaura con load_state() y llama-cpp solo procesa el sufijo
+- completar(llm, prompt, ...) sirve tanto para Llama en el mismo proceso como para
+  LlamaRemoto (el caché vive en el proceso del worker)
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Tuple
+
+
+MIN_CARACTERES_PREFIJO = 400           # prefijos más cortos no compensan guardar el estado
+MAX_PREFIJOS_REGISTRADOS = 64
+MAX_ESTADOS = 4                        # estados KV guardados por modelo
+MAX_BYTES_ESTADOS = 1024 * 1024 * 1024  # 1 GB
+
+
+# ----------------------------------------------------------- registro de prefijos
+
+_prefijos: "OrderedDict[str, None]" = OrderedDict()
+_lock_prefijos = threading.Lock()
+
+
+def registrar_prefijo(prefijo: str) -> str:
+    """Marca el texto como prefijo estático de prompts. Retorna el mismo texto"""
+    if len(prefijo) >= MIN_CARACTERES_PREFIJO:
+        with _lock_prefijos:
+            _prefijos[prefijo] = None
+            _prefijos.move_to_end(prefijo)
+            while len(_prefijos) > MAX_PREFIJOS_REGISTRADOS:
+                _prefijos.popitem(last=False)
+    return prefijo
+
+
+def separar_prefijo(prompt: str) -> Tuple[str, str]:
+    """(prefijo registrado más largo con el que empieza el prompt, resto).
+    Sin prefijo conocido retorna ("", prompt)"""
+    with _lock_prefijos:
+        candidatos = [p for p in _prefijos if len(p) < len(prompt) and prompt.startswith(p)]
+    if not candidatos:
+        return "", prompt
+    prefijo = max(candidatos, key=len)
+    return prefijo, prompt[len(prefijo):]
+
+
+# --------------------------------------------------------------- estados KV
+
+class CachePrefijosKV:
+    """Estados KV de prefijos evaluados para una instancia de llama_cpp.Llama
+
+    No es seguro entre hilos: llama-cpp atiende una petición a la vez y el
+    planificador ya serializa el acceso al modelo GGUF.
+    """
+
+    def __init__(self, llm, max_estados: int = MAX_ESTADOS, max_bytes: int = MAX_BYTES_ESTADOS):
+        self.llm = llm
+        self.max_estados = max_estados
+        self.max_bytes = max_bytes
+        self._estados: "OrderedDict[str, tuple]" = OrderedDict()  # hash -> (tokens, estado, bytes)
+        self._bytes = 0
+        self.estadisticas_uso = {
+            'restaurados': 0,
+            'en_contexto': 0,   # el modelo ya tenía el prefijo evaluado: no hace falta restaurar
+            'evaluados': 0,
+            'tokens_ahorrados': 0
+        }
+
+    def _tokens_en_contexto(self) -> list:
+        tokens = getattr(self.llm, '_input_ids', None)
+        return list(tokens) if tokens is not None else []
+
+    def _guardar(self, h: str, tokens: list, estado):
+        tam = getattr(estado, 'llama_state_size', 0) or 0
+        if tam > self.max_bytes:
+            return
+        self._estados[h] = (tokens, estado, tam)
+        self._bytes += tam
+        while len(self._estados) > self.max_estados or self._bytes > self.max_bytes:
+            _, (_, _, tam_viejo) = self._estados.popitem(last=False)
+            self._bytes -= tam_viejo
+
+    def preparar(self, prefijo: str):
+        """Deja el prefijo evaluado en el contexto del modelo"""
+        h = hashlib.sha256(prefijo.encode('utf-8')).hexdigest()
+        guardado = self._estados.get(h)
+
+        if guardado is not None:
+            tokens, estado, _ = guardado
+            self._estados.move_to_end(h)
+            if self._tokens_en_contexto()[:len(tokens)] == tokens:
+                self.estadisticas_uso['en_contexto'] += 1
+            else:
+                self.llm.load_state(estado)
+                self.estadisticas_uso['restaurados'] += 1
+            self.estadisticas_uso['tokens_ahorrados'] += len(tokens)
+            return
+
+        tokens = self.llm.tokenize(prefijo.encode('utf-8'))
+        if len(tokens) >= self.llm.n_ctx():
+            return
+        self.llm.reset()
+        self.llm.eval(tokens)
+        self._guardar(h, list(tokens), self.llm.save_state())
+        self.estadisticas_uso['evaluados'] += 1
+        print(f"🧠 Prefijo KV evaluado y guardado ({len(tokens)} tokens)")
+
+    def completar(self, prefijo: str, sufijo: str, **kwargs):
+        """Igual que llm(prefijo + sufijo, **kwargs) partiendo del prefijo ya evaluado"""
+        try:
+            self.preparar(prefijo)
+        except Exception as e:
+            # Si el backend no soporta estados se genera igual, con prefill completo
+            print(f"⚠️ No se pudo reutilizar el prefijo KV: {e}")
+        return self.llm(prefijo + sufijo, **kwargs)
+
+    def estadisticas(self) -> dict:
+        return {
+            **self.estadisticas_uso,
+            'estados': len(self._estados),
+            'bytes': self._bytes
+        }
+
+
+def obtener_cache_prefijos(llm) -> CachePrefijosKV:
+    """Caché de prefijos asociado a una instancia de Llama (se crea al primer uso)"""
+    cache = getattr(llm, '_cache_prefijos_kv', None)
+    if cache is None:
+        cache = CachePrefijosKV(llm)
+        llm._cache_prefijos_kv = cache
+    return cache
+
+
+def completar(llm, prompt: str, **kwargs):
+    """llm(prompt, **kwargs) reutilizando el estado KV del prefijo registrado, si lo hay"""
+    prefijo, sufijo = separar_prefijo(prompt)
+    if not prefijo:
+        return llm(prompt, **kwargs)
+    if hasattr(llm, 'completar_con_prefijo'):
+        return llm.completar_con_prefijo(prefijo, sufijo, **kwargs)
+    return obtener_cache_prefijos(llm).completar(prefijo, sufijo, **kwargs)
@@ -0,0 +1,201 @@
+"""
+Presupuesto de tokens de la ventana de contexto
+- ContadorTokens: cuenta tokens según el tokenizador del modelo activo. La relación
+  caracteres/token se mide una vez por modelo con su tokenizador real (llama-cpp:
+  tokenize; Ollama: prompt_eval_count de una llamada raw) y queda en caché
+- Presupuesto: reserva los tokens de salida y reparte el resto, en orden de prioridad,
+  entre prompt de sistema, pregunta, contexto recuperado e historial
+"""
+import math
+import re
+import threading
+import time
+from typing import Dict, List, Optional
+
+from cliente_ollama import obtener_cliente_sync
+
+
+# Texto representativo (español con acentos, cifras y puntuación) para medir el tokenizador
+TEXTO_CALIBRACION = (
+    "La fotosíntesis es el proceso mediante el cual las plantas, algas y algunas bacterias "
+    "transforman la energía lumínica en energía química. Ocurre principalmente en los "
+    "cloroplastos, donde la clorofila absorbe la luz. En la fase luminosa se producen ATP y "
+    "NADPH; en el ciclo de Calvin se fija el CO2 para formar glucosa (C6H12O6). Según el "
+    "capítulo 3, entre el 1% y el 2% de la radiación solar se aprovecha. ¿Qué factores "
+    "limitan su rendimiento? La temperatura, la concentración de dióxido de carbono y la "
+    "disponibilidad de agua, entre otros."
+)
+
+CARACTERES_POR_TOKEN_POR_DEFECTO = 3.0   # conservador para español si no se puede medir
+MARGEN_SEGURIDAD = 0.10                  # los conteos se inflan un 10%: la relación es una media
+TOKENS_POR_MENSAJE = 8                   # marcas de la plantilla de chat por cada mensaje
+CONTEXTO_OLLAMA_POR_DEFECTO = 4096       # num_ctx si el modelo no lo declara en su Modelfile
+TOKENS_MINIMOS_CONTENIDO = 256           # nunca se recorta un documento por debajo de esto
+REINTENTO_MEDICION = 300                 # segundos antes de volver a medir si falló la medición
+
+
+class ContadorTokens:
+    """Conteo de tokens de un modelo y tamaño de su ventana de contexto"""
+
+    def __init__(self, ventana: int, caracteres_por_token: float = CARACTERES_POR_TOKEN_POR_DEFECTO,
+                 medido: bool = False):
+        self.ventana = ventana
+        self.caracteres_por_token = caracteres_por_token
+        self.medido = medido
+        self.creado = time.time()
+
+    def contar(self, texto: str) -> int:
+        if not texto:
+            return 0
+        return math.ceil(len(texto) / self.caracteres_por_token * (1 + MARGEN_SEGURIDAD))
+
+    def caracteres_para(self, tokens: int) -> int:
+        """Caracteres que caben en esa cantidad de tokens"""
+        return max(0, int(tokens * self.caracteres_por_token / (1 + MARGEN_SEGURIDAD)))
+
+    def recortar(self, texto: str, max_tokens: int) -> str:
+        """Prefijo del texto que cabe en max_tokens, cortado en un límite de palabra"""
+        if self.contar(texto) <= max_tokens:
+            return texto
+        limite = self.caracteres_para(max_tokens)
+        corte = texto[:limite]
+        espacio = corte.rfind(' ', int(limite * 0.9))
+        return corte[:espacio] if espacio > 0 else corte
+
+    def estado(self) -> dict:
+        return {
+            'ventana': self.ventana,
+            'caracteres_por_token': round(self.caracteres_por_token, 3),
+            'medido': self.medido
+        }
+
+
+class Presupuesto:
+    """Reparto de la ventana de un prompt
+
+    Se crea reservando los tokens de salida; cada parte consume lo que usa y las
+    siguientes se ajustan a lo que queda.
+    """
+
+    def __init__(self, contador: ContadorTokens, tokens_salida: int):
+        self.contador = contador
+        self.tokens_salida = min(tokens_salida, contador.ventana // 2)
+        self.restante = contador.ventana - self.tokens_salida
+        self.partes: Dict[str, int] = {}
+
+    def _anotar(self, parte: str, tokens: int):
+        self.partes[parte] = self.partes.get(parte, 0) + tokens
+        self.restante -= tokens
+
+    def consumir(self, parte: str, texto: str, extra: int = 0) -> int:
+        """Descuenta el texto completo (partes que no se pueden recortar)"""
+        tokens = self.contador.contar(texto) + extra
+        self._anotar(parte, tokens)
+        return tokens
+
+    def recortar(self, parte: str, texto: str, maximo: int = None, minimo: int = 0) -> str:
+        """Ajusta el texto a lo que queda (o a maximo) y lo descuenta"""
+        disponible = max(self.restante, minimo)
+        if maximo is not None:
+            disponible = min(disponible, maximo)
+        recortado = self.contador.recortar(texto or "", max(disponible, 0))
+        self._anotar(parte, self.contador.contar(recortado))
+        if len(recortado) < len(texto or ""):
+            print(f"✂️ {parte}: {len(texto)} → {len(recortado)} caracteres para caber en el contexto")
+        return recortado
+
+    def seleccionar_recientes(self, parte: str, textos: List[str], extra_por_texto: int = 0) -> int:
+        """Cuántos de los textos más recientes (al final de la lista) caben enteros"""
+        incluidos = 0
+        for texto in reversed(textos):
+            tokens = self.contador.contar(texto) + extra_por_texto
+            if tokens > self.restante:
+                break
+            self._anotar(parte, tokens)
+            incluidos += 1
+        return incluidos
+
+    def resumen(self) -> dict:
+        return {
+            'ventana': self.contador.ventana,
+            'salida': self.tokens_salida,
+            'partes': dict(self.partes),
+            'libre': self.restante
+        }
+
+
+# ----------------------------------------------------------- medición por modelo
+
+_contadores: Dict[tuple, ContadorTokens] = {}
+_lock_contadores = threading.Lock()
+
+
+def _relacion_valida(caracteres: int, tokens: int) -> Optional[float]:
+    if tokens <= 0:
+        return None
+    relacion = caracteres / tokens
+    # Fuera de este rango la medición no es creíble (p. ej. prompt servido desde caché)
+    return relacion if 1.0 <= relacion <= 8.0 else None
+
+
+def _medir_gguf(llm) -> Optional[float]:
+    tokens = llm.tokenize(TEXTO_CALIBRACION.encode('utf-8'))
+    return _relacion_valida(len(TEXTO_CALIBRACION), len(tokens) - 1)  # sin el BOS
+
+
+def _medir_ollama(modelo: str) -> Optional[float]:
+    respuesta = obtener_cliente_sync().generar(
+        modelo, TEXTO_CALIBRACION, {"num_predict": 1, "temperature": 0}, timeout=120, raw=True
+    )
+    return _relacion_valida(len(TEXTO_CALIBRACION), respuesta.get('prompt_eval_count', 0))
+
+
+def _ventana_ollama(modelo: str) -> int:
+    """num_ctx del Modelfile (o el de Ollama por defecto), sin superar el contexto del modelo"""
+    info = obtener_cliente_sync().show(modelo)
+    coincidencia = re.search(r'^num_ctx\s+(\d+)', info.get('parameters', '') or '', re.MULTILINE)
+    ventana = int(coincidencia.group(1)) if coincidencia else CONTEXTO_OLLAMA_POR_DEFECTO
+    maximo = next((v for k, v in (info.get('model_info') or {}).items()
+                   if k.endswith('.context_length') and isinstance(v, int)), None)
+    return min(ventana, maximo) if maximo else ventana
+
+
+def obtener_contador(motor: str, modelo: str, llm=None, ventana: int = None) -> ContadorTokens:
+    """Contador del modelo (se mide la primera vez y queda en caché por motor y modelo)
+
+    motor 'ollama': modelo es el nombre en Ollama. motor 'gguf': modelo es la ruta,
+    llm la instancia cargada y ventana su n_ctx.
+    """
+    clave = (motor, modelo)
+    with _lock_contadores:
+        contador = _contadores.get(clave)
+    if contador is not None and (contador.medido or time.time() - contador.creado < REINTENTO_MEDICION):
+        return contador
+
+    relacion = None
+    try:
+        if motor == 'ollama':
+            ventana = ventana or _ventana_ollama(modelo)
+            relacion = _medir_ollama(modelo)
+        elif llm is not None:
+            relacion = _medir_gguf(llm)
+    except Exception as e:
+        print(f"⚠️ No se pudo medir el tokenizador de {modelo}: {e}")
+
+    contador = ContadorTokens(
+        ventana or CONTEXTO_OLLAMA_POR_DEFECTO,
+        relacion or CARACTERES_POR_TOKEN_POR_DEFECTO,
+        medido=relacion is not None
+    )
+    print(f"📏 Tokenizador de {modelo}: {contador.caracteres_por_token:.2f} caracteres/token, "
+          f"ventana {contador.ventana} tokens{'' if contador.medido else ' (estimado)'}")
+    # Una estimación (motor sin responder) se vuelve a medir pasados REINTENTO_MEDICION segundos
+    with _lock_contadores:
+        _contadores[clave] = contador
+    return contador
+
+
+def olvidar_contador(motor: str, modelo: str):
+    """Descarta la medición (p. ej. al reemplazar el archivo del modelo)"""
+    with _lock_contadores:
+        _contadores.pop((motor, modelo), None)
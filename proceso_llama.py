@@ -0,0 +1,309 @@
+"""
+Proceso dedicado para llama-cpp-python
+- El modelo GGUF vive en un proceso hijo que atiende las peticiones de una en una
+- LlamaRemoto: fachada con la misma interfaz que llama_cpp.Llama (__call__,
+  create_chat_completion, tokenize, stream=True) usada por los generadores
+- completar_con_prefijo: los estados KV de los prefijos (prefijos_kv) se guardan en el hijo
+- esquema_json=...: salida restringida; la gramática se compila en el hijo (esquemas_json)
+- Si el proceso muere, las peticiones en curso fallan con RuntimeError y el
+  siguiente uso lo reinicia; el servidor web no se cae
+"""
+import itertools
+import multiprocessing
+import queue
+import threading
+import time
+from typing import Any, Dict, Iterator, Optional
+
+
+# Métodos de Llama que se pueden invocar desde el servidor
+METODOS_PERMITIDOS = ('__call__', 'create_chat_completion', 'tokenize', 'detokenize',
+                      'completar_con_prefijo')
+
+TIMEOUT_CARGA = 600            # segundos para cargar el modelo en el proceso hijo
+INTERVALO_VIGILANCIA = 1.0     # cada cuánto se comprueba que el proceso siga vivo
+
+
+# ------------------------------------------------------------ proceso hijo
+
+def _drenar_cancelaciones(cancelaciones, cancelados: set):
+    while True:
+        try:
+            cancelados.add(cancelaciones.get_nowait())
+        except queue.Empty:
+            return
+
+
+def _bucle_worker(parametros: dict, peticiones, respuestas, cancelaciones):
+    """Punto de entrada del proceso hijo: carga el modelo y atiende peticiones en serie"""
+    try:
+        from llama_cpp import Llama
+        from prefijos_kv import CachePrefijosKV
+        llm = Llama(**parametros)
+        cache_prefijos = CachePrefijosKV(llm)
+    except Exception as e:
+        respuestas.put({'id': None, 'tipo': 'error_carga', 'error': f"{type(e).__name__}: {e}"})
+        return
+
+    metadata = getattr(llm, 'metadata', None)
+    respuestas.put({'id': None, 'tipo': 'listo', 'metadata': dict(metadata) if metadata else {}})
+
+    cancelados = set()
+    while True:
+        peticion = peticiones.get()
+        if peticion is None:
+            break
+
+        id_peticion = peticion['id']
+        _drenar_cancelaciones(cancelaciones, cancelados)
+        if id_peticion in cancelados:
+            cancelados.discard(id_peticion)
+            respuestas.put({'id': id_peticion, 'tipo': 'fin'})
+            continue
+
+        try:
+            if peticion['metodo'] == '__call__':
+                funcion = llm
+            elif peticion['metodo'] == 'completar_con_prefijo':
+                funcion = cache_prefijos.completar
+            else:
+                funcion = getattr(llm, peticion['metodo'])
+            kwargs = peticion['kwargs']
+            if kwargs.get('esquema_json'):
+                # La gramática se compila aquí: LlamaGrammar no se puede enviar entre procesos
+                from esquemas_json import gramatica_llama
+                kwargs['grammar'] = gramatica_llama(kwargs.pop('esquema_json'))
+            if kwargs.get('stream'):
+                for chunk in funcion(*peticion['args'], **kwargs):
+                    _drenar_cancelaciones(cancelaciones, cancelados)
+                    if id_peticion in cancelados:
+                        cancelados.discard(id_peticion)
+                        break
+                    respuestas.put({'id': id_peticion, 'tipo': 'parcial', 'valor': chunk})
+                respuestas.put({'id': id_peticion, 'tipo': 'fin'})
+            else:
+                valor = funcion(*peticion['args'], **kwargs)
+                respuestas.put({'id': id_peticion, 'tipo': 'resultado', 'valor': valor})
+        except Exception as e:
+            respuestas.put({'id': id_peticion, 'tipo': 'error', 'error': f"{type(e).__name__}: {e}"})
+
+    if hasattr(llm, 'close'):
+        llm.close()
+
+
+# --------------------------------------------------------- proceso servidor
+
+class _Conexion:
+    """Colas y peticiones pendientes de una instancia del proceso hijo"""
+
+    def __init__(self, contexto, parametros: dict):
+        self.peticiones = contexto.Queue()
+        self.respuestas = contexto.Queue()
+        self.cancelaciones = contexto.Queue()
+        self.pendientes: Dict[int, queue.Queue] = {}
+        self.proceso = contexto.Process(
+            target=_bucle_worker,
+            args=(parametros, self.peticiones, self.respuestas, self.cancelaciones),
+            name="llama-worker",
+            daemon=True
+        )
+
+    def detener(self):
+        try:
+            self.peticiones.put(None)
+            self.proceso.join(5)
+        except Exception:
+            pass
+        if self.proceso.is_alive():
+            self.proceso.terminate()
+            self.proceso.join(5)
+
+
+class LlamaRemoto:
+    """Fachada de llama_cpp.Llama que delega en un proceso hijo
+
+    Acepta los mismos parámetros que Llama(...). La carga es síncrona: si el modelo
+    no se puede cargar, el constructor lanza RuntimeError igual que Llama.
+    """
+
+    def __init__(self, **parametros):
+        self.parametros = parametros
+        self.metadata: Dict[str, Any] = {}
+        self.reinicios = 0
+        self.peticiones_atendidas = 0
+        self._contexto = multiprocessing.get_context('spawn')
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._lock_reinicio = threading.Lock()  # la carga puede tardar minutos: nunca bajo _lock
+        self._conexion: Optional[_Conexion] = None
+        self._cerrado = False
+        self._conexion = self._iniciar()
+
+    # --------------------------------------------------------------- ciclo
+
+    def _iniciar(self) -> _Conexion:
+        """Lanza el proceso hijo, espera a que el modelo esté cargado y retorna su conexión"""
+        conexion = _Conexion(self._contexto, self.parametros)
+        inicio = time.time()
+        conexion.proceso.start()
+        print(f"🧩 Worker llama-cpp iniciado (pid {conexion.proceso.pid}), cargando modelo...")
+
+        limite = inicio + TIMEOUT_CARGA
+        while True:
+            try:
+                mensaje = conexion.respuestas.get(timeout=INTERVALO_VIGILANCIA)
+                break
+            except queue.Empty:
+                if not conexion.proceso.is_alive():
+                    raise RuntimeError(f"El worker de llama-cpp terminó al cargar el modelo "
+                                       f"(código {conexion.proceso.exitcode})")
+                if time.time() > limite:
+                    conexion.detener()
+                    raise RuntimeError(f"El worker de llama-cpp no cargó el modelo en {TIMEOUT_CARGA}s")
+
+        if mensaje['tipo'] == 'error_carga':
+            conexion.detener()
+            raise RuntimeError(mensaje['error'])
+
+        self.metadata = mensaje.get('metadata', {})
+        print(f"✅ Worker llama-cpp listo en {time.time() - inicio:.1f}s")
+        threading.Thread(target=self._leer_respuestas, args=(conexion,),
+                         name="llama-worker-lector", daemon=True).start()
+        return conexion
+
+    def _conexion_viva(self) -> _Conexion:
+        """Conexión con el worker; si murió lo reinicia bajo _lock_reinicio (un solo reinicio
+        aunque fallen varias peticiones a la vez) y cambia la conexión al final bajo _lock"""
+        conexion = self._conexion
+        if conexion.proceso.is_alive():
+            return conexion
+        with self._lock_reinicio:
+            if self._cerrado:
+                raise RuntimeError("El modelo GGUF fue liberado")
+            if self._conexion is not conexion:
+                return self._conexion  # otro hilo ya lo reinició
+            self.reinicios += 1
+            print(f"🔁 Reiniciando worker llama-cpp (reinicio #{self.reinicios})")
+            nueva = self._iniciar()
+            with self._lock:
+                cerrado = self._cerrado
+                if not cerrado:
+                    self._conexion = nueva
+            if cerrado:
+                nueva.detener()
+                raise RuntimeError("El modelo GGUF fue liberado")
+            return nueva
+
+    def _leer_respuestas(self, conexion: _Conexion):
+        """Hilo del servidor que reparte las respuestas del hijo a cada petición"""
+        while True:
+            try:
+                mensaje = conexion.respuestas.get(timeout=INTERVALO_VIGILANCIA)
+            except queue.Empty:
+                if conexion.proceso.is_alive():
+                    continue
+                self._fallar_pendientes(conexion, f"El worker de llama-cpp terminó inesperadamente "
+                                                  f"(código {conexion.proceso.exitcode})")
+                return
+            except (EOFError, OSError):
+                self._fallar_pendientes(conexion, "Se perdió la conexión con el worker de llama-cpp")
+                return
+            with self._lock:
+                cola = conexion.pendientes.get(mensaje['id'])
+            if cola is not None:
+                cola.put(mensaje)
+
+    def _fallar_pendientes(self, conexion: _Conexion, error: str):
+        with self._lock:
+            pendientes = list(conexion.pendientes.values())
+            conexion.pendientes.clear()
+        if not self._cerrado:
+            print(f"💥 {error} ({len(pendientes)} petición(es) en curso)")
+        for cola in pendientes:
+            cola.put({'tipo': 'error', 'error': error})
+
+    def close(self):
+        """Detiene el proceso hijo y libera el modelo"""
+        self._cerrado = True
+        if self._conexion is not None:
+            self._conexion.detener()
+
+    # ----------------------------------------------------------- peticiones
+
+    def _enviar(self, metodo: str, args: tuple, kwargs: dict) -> tuple:
+        if metodo not in METODOS_PERMITIDOS:
+            raise AttributeError(metodo)
+        if self._cerrado:
+            raise RuntimeError("El modelo GGUF fue liberado")
+        conexion = self._conexion_viva()
+        with self._lock:
+            if self._cerrado:
+                raise RuntimeError("El modelo GGUF fue liberado")
+            id_peticion = next(self._ids)
+            cola: queue.Queue = queue.Queue()
+            conexion.pendientes[id_peticion] = cola
+            self.peticiones_atendidas += 1
+        conexion.peticiones.put({'id': id_peticion, 'metodo': metodo, 'args': args, 'kwargs': kwargs})
+        return conexion, id_peticion, cola
+
+    def _llamar(self, metodo: str, *args, **kwargs):
+        conexion, id_peticion, cola = self._enviar(metodo, args, kwargs)
+        if kwargs.get('stream'):
+            return self._iterar(conexion, id_peticion, cola)
+        try:
+            mensaje = cola.get()
+        finally:
+            with self._lock:
+                conexion.pendientes.pop(id_peticion, None)
+        if mensaje['tipo'] == 'error':
+            raise RuntimeError(mensaje['error'])
+        return mensaje['valor']
+
+    def _iterar(self, conexion: _Conexion, id_peticion: int, cola: queue.Queue) -> Iterator[dict]:
+        """Chunks de una petición con stream=True. Cerrar el iterador cancela la generación"""
+        terminado = False
+        try:
+            while True:
+                mensaje = cola.get()
+                if mensaje['tipo'] == 'parcial':
+                    yield mensaje['valor']
+                elif mensaje['tipo'] == 'fin':
+                    terminado = True
+                    return
+                else:
+                    terminado = True
+                    raise RuntimeError(mensaje['error'])
+        finally:
+            if not terminado:
+                conexion.cancelaciones.put(id_peticion)
+            with self._lock:
+                conexion.pendientes.pop(id_peticion, None)
+
+    def __call__(self, *args, **kwargs):
+        return self._llamar('__call__', *args, **kwargs)
+
+    def create_chat_completion(self, *args, **kwargs):
+        return self._llamar('create_chat_completion', *args, **kwargs)
+
+    def tokenize(self, *args, **kwargs):
+        return self._llamar('tokenize', *args, **kwargs)
+
+    def completar_con_prefijo(self, prefijo: str, sufijo: str, **kwargs):
+        """llm(prefijo + sufijo) restaurando en el worker el estado KV del prefijo"""
+        return self._llamar('completar_con_prefijo', prefijo, sufijo, **kwargs)
+
+    def detokenize(self, *args, **kwargs):
+        return self._llamar('detokenize', *args, **kwargs)
+
+    def estado(self) -> dict:
+        """Foto del worker sin tomar locks (se consulta desde el bucle de eventos)"""
+        conexion = self._conexion
+        proceso = conexion.proceso if conexion else None
+        return {
+            'pid': proceso.pid if proceso else None,
+            'vivo': bool(proceso and proceso.is_alive()),
+            'reiniciando': self._lock_reinicio.locked(),
+            'reinicios': self.reinicios,
+            'peticiones_atendidas': self.peticiones_atendidas,
+            'en_curso': len(conexion.pendientes) if conexion else 0
+        }
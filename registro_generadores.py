@@ -0,0 +1,207 @@
+"""
+Registro de generadores residentes
+- Un único GeneradorUnificado por configuración (motor, modelo, capas GPU, contexto) en todo el proceso;
+  también el GeneradorDosPasos, que cuenta para la regla de un solo GGUF residente
+- Todos los endpoints reciben la instancia ya cargada; solo se recarga si cambia la configuración
+"""
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from generador_unificado import GeneradorUnificado
+from cliente_ollama import obtener_cliente_sync
+from planificador import obtener_planificador
+
+
+N_CTX_POR_DEFECTO = 8192
+# Un GGUF liberado se cierra cuando terminan los turnos gguf en curso o en cola (los
+# trabajos que lo usan); pasado este tiempo se cierra igual
+ESPERA_MAXIMA_CIERRE = 600
+
+
+class RegistroGeneradores:
+    """Caché de instancias de GeneradorUnificado compartida por todo el servidor
+
+    Las instancias de Ollama son ligeras y se conservan todas. De GGUF se mantiene
+    residente solo una: cargar otra libera la anterior para no duplicar el modelo
+    en memoria/VRAM (se cierra cuando terminan los trabajos que la usan).
+    """
+
+    def __init__(self, gguf_en_proceso_separado: bool = True):
+        # En el servidor el modelo GGUF se hospeda en un proceso hijo (ver proceso_llama)
+        self.gguf_en_proceso_separado = gguf_en_proceso_separado
+        self._instancias: Dict[tuple, GeneradorUnificado] = {}
+        self._estadisticas: Dict[tuple, dict] = {}
+        self._lock = threading.Lock()
+        self._locks_carga: Dict[tuple, threading.Lock] = {}
+        self.cargas = 0
+        self.aciertos = 0
+
+    @staticmethod
+    def clave(usar_ollama: bool, modelo_ollama: str = None, modelo_path_gguf: str = None,
+              n_gpu_layers: int = 35, n_ctx: int = N_CTX_POR_DEFECTO) -> tuple:
+        """(motor, modelo, capas GPU, contexto)"""
+        if usar_ollama:
+            return ('ollama', modelo_ollama, n_gpu_layers, n_ctx)
+        modelo = str(Path(modelo_path_gguf).resolve()) if modelo_path_gguf else None
+        return ('gguf', modelo, n_gpu_layers, n_ctx)
+
+    def obtener(self, usar_ollama: bool = True, modelo_ollama: str = "llama31-local",
+                modelo_path_gguf: str = None, n_gpu_layers: int = 35,
+                n_ctx: int = N_CTX_POR_DEFECTO) -> GeneradorUnificado:
+        """Retorna el generador residente para esta configuración (lo crea si no existe)"""
+        clave = self.clave(usar_ollama, modelo_ollama, modelo_path_gguf, n_gpu_layers, n_ctx)
+        return self._obtener(clave, lambda: GeneradorUnificado(
+            usar_ollama=usar_ollama,
+            modelo_ollama=modelo_ollama,
+            modelo_path_gguf=modelo_path_gguf,
+            n_gpu_layers=n_gpu_layers,
+            n_ctx=n_ctx,
+            gguf_en_proceso_separado=self.gguf_en_proceso_separado
+        ))
+
+    def obtener_dos_pasos(self, modelo_path: str, n_gpu_layers: int = 35):
+        """GeneradorDosPasos residente para este GGUF (cuenta como el único GGUF residente)"""
+        from generador_dos_pasos import GeneradorDosPasos
+        clave = ('dos_pasos', str(Path(modelo_path).resolve()), n_gpu_layers, GeneradorDosPasos.N_CTX)
+        return self._obtener(clave, lambda: GeneradorDosPasos(
+            modelo_path=modelo_path, n_gpu_layers=n_gpu_layers,
+            en_proceso_separado=self.gguf_en_proceso_separado
+        ))
+
+    def _obtener(self, clave: tuple, crear):
+        with self._lock:
+            lock_carga = self._locks_carga.setdefault(clave, threading.Lock())
+
+        # Un lock por clave: dos requests simultáneos no cargan dos copias del mismo modelo
+        with lock_carga:
+            generador = self._instancias.get(clave)
+            if generador is not None and not self._necesita_recarga(clave, generador):
+                with self._lock:
+                    self.aciertos += 1
+                    self._estadisticas[clave]['aciertos'] += 1
+                return generador
+
+            if clave[0] != 'ollama':
+                self._liberar_gguf(excepto=clave)
+
+            print(f"🔄 Registro: cargando generador {clave[0]} - {clave[1]} "
+                  f"(gpu_layers={clave[2]}, n_ctx={clave[3]})")
+            generador = crear()
+
+            with self._lock:
+                self._instancias[clave] = generador
+                stats = self._estadisticas.setdefault(clave, {'cargas': 0, 'aciertos': 0})
+                stats['cargas'] += 1
+                self.cargas += 1
+            return generador
+
+    def _necesita_recarga(self, clave: tuple, generador: GeneradorUnificado) -> bool:
+        """Una instancia de Ollama que cayó al fallback se recrea cuando Ollama vuelve"""
+        if clave[0] == 'ollama' and not generador.usar_ollama:
+            if obtener_cliente_sync().disponible():
+                print(f"🔁 Registro: Ollama volvió a estar disponible, recreando {clave[1]}")
+                return True
+        return False
+
+    def _liberar_gguf(self, excepto: tuple = None):
+        with self._lock:
+            claves = [c for c, g in self._instancias.items()
+                      if c != excepto and getattr(g, 'llm', None) is not None]
+            liberados = [self._instancias.pop(c) for c in claves]
+        for clave, generador in zip(claves, liberados):
+            print(f"🗑️ Registro: liberando modelo GGUF {clave[1]}")
+            _cerrar_al_terminar(generador)
+
+    def liberar(self, generador):
+        """Libera un generador que dejó de ser el activo: sale del registro (si estaba) y se
+        cierra su modelo GGUF, con su instancia de formateo si tiene"""
+        with self._lock:
+            for clave in [c for c, g in self._instancias.items() if g is generador]:
+                del self._instancias[clave]
+        _cerrar_al_terminar(generador)
+
+    def descartar(self, clave: tuple = None):
+        """Elimina una instancia (o todas) para forzar su recarga en el próximo uso"""
+        with self._lock:
+            claves = [clave] if clave else list(self._instancias.keys())
+            descartados = [self._instancias.pop(c) for c in claves if c in self._instancias]
+        for generador in descartados:
+            _cerrar_llm(generador)
+
+    def estadisticas(self) -> dict:
+        with self._lock:
+            instancias: List[dict] = [
+                {
+                    'motor': c[0],
+                    'modelo': c[1],
+                    'n_gpu_layers': c[2],
+                    'n_ctx': c[3],
+                    'residente': c in self._instancias,
+                    **stats
+                }
+                for c, stats in self._estadisticas.items()
+            ]
+            return {
+                'cargas': self.cargas,
+                'aciertos': self.aciertos,
+                'residentes': len(self._instancias),
+                'instancias': instancias
+            }
+
+
+def _cerrar_al_terminar(generador: GeneradorUnificado):
+    """Cierra el modelo cuando terminan los trabajos que pueden estar usándolo
+
+    Un examen o práctica en curso conserva su generador entre partes: cerrarlo ya lo haría
+    fallar a mitad. Mientras haya turnos gguf en curso o en cola se espera (en un hilo,
+    sin bloquear a quien libera); mientras tanto los dos modelos conviven en memoria.
+    """
+    if getattr(generador, 'llm', None) is None:
+        return
+    planificador = obtener_planificador()
+    if not planificador.turnos_activos('gguf'):
+        _cerrar_llm(generador)
+        return
+
+    def esperar_y_cerrar():
+        limite = time.monotonic() + ESPERA_MAXIMA_CIERRE
+        while (turnos := planificador.turnos_activos('gguf')) and time.monotonic() < limite:
+            for turno in turnos:
+                turno.esperar_fin(max(0.0, limite - time.monotonic()))
+        if turnos:
+            print(f"⏱️ Registro: cerrando el GGUF anterior con {len(turnos)} turno(s) aún activos")
+        _cerrar_llm(generador)
+        print("🗑️ Registro: GGUF anterior cerrado tras terminar sus trabajos")
+
+    print("⏳ Registro: el GGUF anterior se cierra al terminar los trabajos en curso")
+    threading.Thread(target=esperar_y_cerrar, daemon=True, name="cierre-gguf").start()
+
+
+def _cerrar_llm(generador: GeneradorUnificado):
+    if hasattr(generador, 'cerrar_formateador'):
+        generador.cerrar_formateador()  # GeneradorDosPasos: instancia del paso 2 en paralelo
+    llm = getattr(generador, 'llm', None)
+    if llm is None:
+        return
+    try:
+        if hasattr(llm, 'close'):
+            llm.close()
+    except Exception as e:
+        print(f"⚠️ Error liberando modelo GGUF: {e}")
+    generador.llm = None
+
+
+# Instancia compartida por proceso
+_registro: Optional[RegistroGeneradores] = None
+_lock_registro = threading.Lock()
+
+
+def obtener_registro() -> RegistroGeneradores:
+    """Retorna el registro de generadores del proceso"""
+    global _registro
+    with _lock_registro:
+        if _registro is None:
+            _registro = RegistroGeneradores()
+        return _registro
@@ -0,0 +1,264 @@
+"""
+Trabajos en segundo plano para la generación de exámenes y prácticas
+- GestorTrabajos: cola de trabajos atendida por un pool fijo de workers asyncio
+- Cada trabajo empuja su progreso a una asyncio.Queue por suscriptor (SSE), sin polling
+- Los trabajos terminados expiran tras un TTL aunque nadie haya leído el resultado
+"""
+import asyncio
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+
+# Estados de un trabajo
+EN_COLA = 'en_cola'
+EJECUTANDO = 'ejecutando'
+COMPLETADO = 'completado'
+ERROR = 'error'
+
+WORKERS_POR_DEFECTO = 2
+TTL_SEGUNDOS = 15 * 60        # tiempo que se conserva un trabajo terminado
+INTERVALO_LIMPIEZA = 60
+
+
+class Trabajo:
+    """Un trabajo y su estado. actualizar() y publicar_pregunta() se pueden llamar
+    desde cualquier hilo: los cambios se aplican en el event loop del gestor"""
+
+    def __init__(self, id_trabajo: str, tipo: str, funcion: Callable[["Trabajo"], Awaitable[Any]],
+                 loop: asyncio.AbstractEventLoop):
+        self.id = id_trabajo
+        self.tipo = tipo
+        self.funcion = funcion
+        self.estado = EN_COLA
+        self.progreso = 0
+        self.mensaje = 'En cola...'
+        self.error: Optional[str] = None
+        self.excepcion: Optional[BaseException] = None
+        self.resultado: Any = None
+        self.preguntas: List[dict] = []
+        self.creado = time.time()
+        self.iniciado: Optional[float] = None
+        self.terminado: Optional[float] = None
+        self._loop = loop
+        self._suscriptores: List[asyncio.Queue] = []
+        self._fin = asyncio.Event()
+
+    @property
+    def finalizado(self) -> bool:
+        return self.estado in (COMPLETADO, ERROR)
+
+    def _evento(self, preguntas_nuevas: List[dict] = None) -> dict:
+        """Mismo formato que /api/progreso-examen"""
+        return {
+            'trabajo_id': self.id,
+            'estado': self.estado,
+            'progreso': self.progreso,
+            'mensaje': self.mensaje,
+            'completado': self.finalizado,
+            'error': self.error,
+            'preguntas_nuevas': preguntas_nuevas or []
+        }
+
+    def _emitir(self, evento: dict):
+        for cola in self._suscriptores:
+            cola.put_nowait(evento)
+
+    # -------------------------------------------- llamadas desde el trabajo
+
+    def actualizar(self, progreso: int, mensaje: str):
+        self._loop.call_soon_threadsafe(self._aplicar_progreso, progreso, mensaje)
+
+    def publicar_pregunta(self, pregunta):
+        datos = pregunta.to_dict() if hasattr(pregunta, 'to_dict') else pregunta
+        self._loop.call_soon_threadsafe(self._aplicar_pregunta, datos)
+
+    def _aplicar_progreso(self, progreso: int, mensaje: str):
+        if self.finalizado:
+            return
+        self.progreso, self.mensaje = progreso, mensaje
+        self._emitir(self._evento())
+
+    def _aplicar_pregunta(self, datos: dict):
+        if self.finalizado:
+            return
+        self.preguntas.append(datos)
+        self._emitir(self._evento([datos]))
+
+    def _finalizar(self, resultado: Any = None, excepcion: BaseException = None):
+        self.terminado = time.time()
+        if excepcion is None:
+            self.estado = COMPLETADO
+            self.resultado = resultado
+            self.progreso = 100
+            self.mensaje = 'Completado'
+        else:
+            self.estado = ERROR
+            self.excepcion = excepcion
+            self.error = str(getattr(excepcion, 'detail', None) or excepcion)
+            self.mensaje = f'Error: {self.error}'
+        self._emitir(self._evento())
+        self._fin.set()
+
+    # ------------------------------------------------------- consumidores
+
+    def suscribir(self) -> asyncio.Queue:
+        """Cola de eventos del trabajo. El primero es el estado actual con todas
+        las preguntas ya publicadas"""
+        cola: asyncio.Queue = asyncio.Queue()
+        cola.put_nowait(self._evento(list(self.preguntas)))
+        if not self.finalizado:
+            self._suscriptores.append(cola)
+        return cola
+
+    def desuscribir(self, cola: asyncio.Queue):
+        if cola in self._suscriptores:
+            self._suscriptores.remove(cola)
+
+    async def esperar(self) -> Any:
+        """Espera a que termine y retorna el resultado (o relanza la excepción del trabajo)"""
+        await self._fin.wait()
+        if self.excepcion is not None:
+            raise self.excepcion
+        return self.resultado
+
+    def resumen(self, incluir_resultado: bool = False) -> dict:
+        datos = {
+            'trabajo_id': self.id,
+            'tipo': self.tipo,
+            'estado': self.estado,
+            'progreso': self.progreso,
+            'mensaje': self.mensaje,
+            'error': self.error,
+            'preguntas_publicadas': len(self.preguntas),
+            'creado': self.creado,
+            'espera_segundos': round((self.iniciado or time.time()) - self.creado, 2),
+            'duracion_segundos': round((self.terminado or time.time()) - self.iniciado, 2) if self.iniciado else None
+        }
+        if incluir_resultado and self.estado == COMPLETADO:
+            datos['resultado'] = self.resultado
+        return datos
+
+
+class GestorTrabajos:
+    """Pool de workers asyncio que ejecuta los trabajos en orden de llegada"""
+
+    def __init__(self, workers: int = WORKERS_POR_DEFECTO, ttl_segundos: float = TTL_SEGUNDOS):
+        self.num_workers = workers
+        self.ttl_segundos = ttl_segundos
+        self._trabajos: Dict[str, Trabajo] = {}
+        self._registrados: Dict[str, asyncio.Event] = {}  # avisos a quien espera un id aún no enviado
+        self._cola: Optional[asyncio.Queue] = None
+        self._tareas: List[asyncio.Task] = []
+        self.expirados = 0
+
+    def iniciar(self):
+        """Arranca los workers y la limpieza periódica (llamar dentro del event loop)"""
+        if self._tareas:
+            return
+        self._cola = asyncio.Queue()
+        self._tareas = [asyncio.create_task(self._worker()) for _ in range(self.num_workers)]
+        self._tareas.append(asyncio.create_task(self._limpieza()))
+        print(f"🧵 Gestor de trabajos iniciado con {self.num_workers} workers")
+
+    async def detener(self):
+        for tarea in self._tareas:
+            tarea.cancel()
+        await asyncio.gather(*self._tareas, return_exceptions=True)
+        self._tareas = []
+
+    def enviar(self, tipo: str, funcion: Callable[[Trabajo], Awaitable[Any]],
+               id_trabajo: str = None) -> Trabajo:
+        """Encola un trabajo. funcion(trabajo) es una corrutina que retorna el resultado"""
+        self.iniciar()
+        id_trabajo = id_trabajo or str(uuid.uuid4())
+        anterior = self._trabajos.get(id_trabajo)
+        if anterior is not None and not anterior.finalizado:
+            raise ValueError(f"Ya hay un trabajo en curso con id {id_trabajo}")
+
+        trabajo = Trabajo(id_trabajo, tipo, funcion, asyncio.get_running_loop())
+        self._trabajos[id_trabajo] = trabajo
+        self._cola.put_nowait(trabajo)
+        aviso = self._registrados.pop(id_trabajo, None)
+        if aviso is not None:
+            aviso.set()
+        print(f"📥 Trabajo {tipo} encolado: {id_trabajo} (pendientes: {self._cola.qsize()})")
+        return trabajo
+
+    def obtener(self, id_trabajo: str) -> Optional[Trabajo]:
+        return self._trabajos.get(id_trabajo)
+
+    async def esperar_registro(self, id_trabajo: str, timeout: float) -> Optional[Trabajo]:
+        """Para streams abiertos antes del POST: espera a que se envíe el trabajo con ese id"""
+        trabajo = self._trabajos.get(id_trabajo)
+        if trabajo is not None:
+            return trabajo
+        aviso = self._registrados.setdefault(id_trabajo, asyncio.Event())
+        try:
+            await asyncio.wait_for(aviso.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            if self._registrados.get(id_trabajo) is aviso and not aviso.is_set():
+                del self._registrados[id_trabajo]
+        return self._trabajos.get(id_trabajo)
+
+    async def _worker(self):
+        while True:
+            trabajo = await self._cola.get()
+            trabajo.estado = EJECUTANDO
+            trabajo.iniciado = time.time()
+            trabajo._aplicar_progreso(trabajo.progreso, 'Iniciando...')
+            try:
+                resultado = await trabajo.funcion(trabajo)
+            except asyncio.CancelledError:
+                trabajo._finalizar(excepcion=RuntimeError("Servidor detenido"))
+                raise
+            except Exception as e:
+                print(f"❌ Trabajo {trabajo.id} falló: {e}")
+                trabajo._finalizar(excepcion=e)
+            else:
+                trabajo._finalizar(resultado=resultado)
+                print(f"✅ Trabajo {trabajo.id} completado en {trabajo.terminado - trabajo.iniciado:.1f}s")
+            finally:
+                self._cola.task_done()
+
+    async def _limpieza(self):
+        while True:
+            await asyncio.sleep(INTERVALO_LIMPIEZA)
+            self.limpiar_expirados()
+
+    def limpiar_expirados(self):
+        """Elimina los trabajos terminados hace más de ttl_segundos"""
+        limite = time.time() - self.ttl_segundos
+        expirados = [i for i, t in self._trabajos.items() if t.terminado and t.terminado < limite]
+        for id_trabajo in expirados:
+            del self._trabajos[id_trabajo]
+        if expirados:
+            self.expirados += len(expirados)
+            print(f"🧹 {len(expirados)} trabajo(s) expirados")
+
+    def estadisticas(self) -> dict:
+        estados: Dict[str, int] = {}
+        for trabajo in self._trabajos.values():
+            estados[trabajo.estado] = estados.get(trabajo.estado, 0) + 1
+        return {
+            'workers': self.num_workers,
+            'ttl_segundos': self.ttl_segundos,
+            'pendientes': self._cola.qsize() if self._cola else 0,
+            'por_estado': estados,
+            'expirados': self.expirados,
+            'trabajos': [t.resumen() for t in self._trabajos.values()]
+        }
+
+
+# Instancia compartida por proceso
+_gestor: Optional[GestorTrabajos] = None
+
+
+def obtener_gestor() -> GestorTrabajos:
+    """Retorna el gestor de trabajos del proceso"""
+    global _gestor
+    if _gestor is None:
+        _gestor = GestorTrabajos()
+    return _gestor